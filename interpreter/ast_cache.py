@@ -0,0 +1,324 @@
+# ast_cache.py
+# ------------
+# Caches parsed IMP programs on disk, so that running an unchanged program
+# again skips lexing and parsing altogether.
+#
+# The AST is written to an .impc file as a pre-order stream of integers in
+# an `array`: each node is its opcode, followed by its immediate operands
+# (string table indices, integer values, statement counts), followed by its
+# children. Names and operators are stored once in a string table. An .impc
+# file is:
+#
+#   header         magic 'IMPC', format version, size of the string table,
+#                  number of stream items, stream item size
+#   string table   the strings, UTF-8 encoded and separated by NUL
+#                  characters
+#   stream         the opcode stream, as raw `array('i')` bytes
+#
+# The cache file for a program is named after a hash of its source, of
+# `FORMAT_VERSION` and of the source of the modules which decide what a
+# program parses to (the lexer, the parser and combinators, the AST classes
+# and this module), in an `__impcache__` directory next to the program (like
+# Python's `__pycache__`). A changed program, or a changed interpreter, gets
+# a different file, so a cached AST is never stale. Bump `FORMAT_VERSION`
+# when the .impc format changes.
+#
+# The program is hashed, and on a miss lexed and parsed, a chunk at a time,
+# so it is never held in memory as a whole (see `imp_lex_stream`).
+#
+# Encoding and decoding loop over an explicit stack, so very long programs
+# need no more Python stack than they do to run (see `BlockStatement`).
+
+import gc
+import os
+import sys
+import struct
+import hashlib
+from array import array
+
+import combinators
+import dfa_lexer
+import imp_ast
+import imp_lexer
+import imp_parser
+from imp_ast import *
+from imp_lexer import *
+from imp_parser import *
+
+FORMAT_VERSION = 1
+MAGIC = 'IMPC'
+CACHE_DIR_NAME = '__impcache__'
+
+# Size of the chunks a program is hashed in
+CHUNK_SIZE = 65536
+
+_header = struct.Struct('<4sIIII')
+_item_size = array('i').itemsize
+_long_max = 2 ** (8 * _item_size - 1)
+
+# Opcodes. Operands follow in the order listed.
+ASSIGN = 1      # name, aexp
+BLOCK = 2       # count, statements
+COMPOUND = 3    # first, second
+IF = 4          # has else, condition, true statement[, false statement]
+WHILE = 5       # condition, body
+INT = 6         # value
+LONG = 7        # string holding a value too big for the stream
+VAR = 8         # name
+BINOP = 9       # op, left, right
+RELOP = 10      # op, left, right
+AND = 11        # left, right
+OR = 12         # left, right
+NOT = 13        # exp
+
+# Returns the .impc bytes for `ast`.
+def dump_ast(ast):
+    strings = []
+    indices = {}
+    def string(text):
+        if isinstance(text, unicode):
+            # From a program read as unicode
+            text = text.encode('utf-8')
+        if text not in indices:
+            indices[text] = len(strings)
+            strings.append(text)
+        return indices[text]
+
+    stream = array('i')
+    append = stream.append
+    pending = [ast]
+    while pending:
+        node = pending.pop()
+        kind = node.__class__
+        if kind is AssignStatement:
+            stream.extend([ASSIGN, string(node.name)])
+            pending.append(node.aexp)
+            continue
+        elif kind is BlockStatement:
+            stream.extend([BLOCK, len(node.statements)])
+            children = node.statements
+        elif kind is CompoundStatement:
+            append(COMPOUND)
+            children = [node.first, node.second]
+        elif kind is IfStatement:
+            stream.extend([IF, node.false_stmt is not None])
+            children = [node.condition, node.true_stmt]
+            if node.false_stmt is not None:
+                children.append(node.false_stmt)
+        elif kind is WhileStatement:
+            append(WHILE)
+            children = [node.condition, node.body]
+        elif kind is IntAexp:
+            if -_long_max <= node.i < _long_max:
+                stream.extend([INT, node.i])
+            else:
+                stream.extend([LONG, string(str(node.i))])
+            continue
+        elif kind is VarAexp:
+            stream.extend([VAR, string(node.name)])
+            continue
+        elif kind is BinopAexp or kind is RelopBexp:
+            stream.extend([BINOP if kind is BinopAexp else RELOP, string(node.op)])
+            children = [node.left, node.right]
+        elif kind is AndBexp or kind is OrBexp:
+            append(AND if kind is AndBexp else OR)
+            children = [node.left, node.right]
+        elif kind is NotBexp:
+            append(NOT)
+            pending.append(node.exp)
+            continue
+        else:
+            raise RuntimeError('cannot serialize AST node: %r' % node)
+        pending.extend(reversed(children))
+
+    table = '\0'.join(strings)
+    return _header.pack(MAGIC, FORMAT_VERSION, len(table), len(stream), _item_size) + \
+           table + stream.tostring()
+
+# Builds the AST from .impc bytes (a string or a buffer). Raises ValueError
+# if they are not a valid .impc file of this version.
+#
+# Python's cycle collector runs every few hundred new objects and looks at
+# every object still alive, which makes building a large tree quadratic. An
+# AST has no cycles, so it is switched off while we build one.
+def load_ast(data):
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return decode(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+def decode(data):
+    if len(data) < _header.size:
+        raise ValueError('truncated .impc data')
+    magic, version, table_size, count, item_size = _header.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION or item_size != _item_size:
+        raise ValueError('not an .impc file of version %d' % FORMAT_VERSION)
+    start = _header.size + table_size
+    if len(data) != start + count * item_size:
+        raise ValueError('truncated .impc data')
+    strings = [decode_string(text) for text in str(data[_header.size:start]).split('\0')]
+    stream = array('i')
+    stream.fromstring(str(data[start:]))
+
+    # Each frame is [opcode, operand, children still to read, children]
+    frames = []
+    pos = 0
+    node = None
+    try:
+        while True:
+            op = stream[pos]
+            pos += 1
+            if op == INT:
+                node = IntAexp(stream[pos])
+                pos += 1
+            elif op == LONG:
+                node = IntAexp(int(strings[stream[pos]]))
+                pos += 1
+            elif op == VAR:
+                node = VarAexp(strings[stream[pos]])
+                pos += 1
+            else:
+                if op == ASSIGN or op == BINOP or op == RELOP:
+                    operand = strings[stream[pos]]
+                    pos += 1
+                    needed = 1 if op == ASSIGN else 2
+                elif op == BLOCK:
+                    operand = needed = stream[pos]
+                    pos += 1
+                elif op == IF:
+                    operand = stream[pos]
+                    pos += 1
+                    needed = 3 if operand else 2
+                elif op == NOT:
+                    operand, needed = None, 1
+                elif op in (COMPOUND, WHILE, AND, OR):
+                    operand, needed = None, 2
+                else:
+                    raise ValueError('bad .impc opcode: %d' % op)
+                if needed:
+                    frames.append([op, operand, needed, []])
+                    continue
+                node = BlockStatement([])
+            # Hand the finished node to its parent, finishing parents as
+            # they get all their children
+            while frames:
+                frame = frames[-1]
+                frame[3].append(node)
+                frame[2] -= 1
+                if frame[2]:
+                    break
+                frames.pop()
+                node = build_node(frame[0], frame[1], frame[3])
+            if not frames:
+                break
+    except IndexError:
+        raise ValueError('truncated .impc stream')
+    if pos != len(stream):
+        raise ValueError('trailing data in .impc stream')
+    return node
+
+# A string from the string table: a str if it is ASCII, as names are when
+# a program is parsed from a str, and otherwise unicode.
+def decode_string(text):
+    try:
+        text.decode('ascii')
+        return text
+    except UnicodeDecodeError:
+        return text.decode('utf-8')
+
+def build_node(op, operand, children):
+    if op == ASSIGN:
+        return AssignStatement(operand, children[0])
+    elif op == BLOCK:
+        return BlockStatement(children)
+    elif op == COMPOUND:
+        return CompoundStatement(children[0], children[1])
+    elif op == IF:
+        false_stmt = children[2] if operand else None
+        return IfStatement(children[0], children[1], false_stmt)
+    elif op == WHILE:
+        return WhileStatement(children[0], children[1])
+    elif op == BINOP:
+        return BinopAexp(operand, children[0], children[1])
+    elif op == RELOP:
+        return RelopBexp(operand, children[0], children[1])
+    elif op == AND:
+        return AndBexp(children[0], children[1])
+    elif op == OR:
+        return OrBexp(children[0], children[1])
+    else:
+        return NotBexp(children[0])
+
+_interpreter_digest = []
+
+# A hash of the source of the modules which decide what a program parses
+# to. Worked out the first time it is needed.
+def interpreter_digest():
+    if not _interpreter_digest:
+        digest = hashlib.sha1()
+        for module in [combinators, dfa_lexer, imp_lexer, imp_parser, imp_ast,
+                       sys.modules[__name__]]:
+            filename = module.__file__
+            if filename.endswith(('.pyc', '.pyo')) and os.path.exists(filename[:-1]):
+                filename = filename[:-1]
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+        _interpreter_digest.append(digest.hexdigest())
+    return _interpreter_digest[0]
+
+# The .impc file for a program `filename` with the given source: a string,
+# or a file object, which is read to the end.
+def cache_path(filename, source, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+    digest = hashlib.sha1('%s\0%d\0%s\0' % (MAGIC, FORMAT_VERSION, interpreter_digest()))
+    if isinstance(source, basestring):
+        digest.update(source)
+    else:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), ''):
+            digest.update(chunk)
+    name = '%s.%s.impc' % (os.path.basename(filename), digest.hexdigest()[:16])
+    return os.path.join(cache_dir, name)
+
+# Returns the cached AST at `path`, or None if there is no usable one.
+def read_cache(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        return load_ast(data)
+    except (IOError, ValueError):
+        return None
+
+# Writes `ast` to `path`. Like Python's byte code cache, failing to write
+# it (e.g. in a read-only directory) is not an error.
+def write_cache(path, ast):
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(temp_path, 'wb') as f:
+            f.write(dump_ast(ast))
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Returns the AST of the program in `filename`, from the cache if the source
+# has not changed since it was last parsed, and None if it does not parse.
+def load_program(filename, cache_dir=None):
+    with open(filename, 'rb') as f:
+        path = cache_path(filename, f, cache_dir)
+        ast = read_cache(path)
+        if ast is not None:
+            return ast
+        f.seek(0)
+        result = imp_parse_stream(imp_lex_stream(f))
+    if not result:
+        return None
+    ast = result.value
+    write_cache(path, ast)
+    return ast
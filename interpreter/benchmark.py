@@ -0,0 +1,628 @@
+# benchmark.py
+# ------------
+# Timing harness for the IMP interpreter. Each benchmark generates a synthetic
+# IMP program (similar to the machine-generated programs we run in practice),
+# times the interesting stage and prints a one line summary.
+#
+# Usage: python benchmark.py [benchmark ...]
+
+import re
+import sys
+import __builtin__
+import time
+import types
+
+import lexer
+import dfa_lexer
+import multiprocessing
+from incremental import *
+from imp_lexer import *
+from imp_parser import *
+
+# Generates a straight-line IMP program with `statements` statements, mixing
+# assignments, conditionals and loops so every token expression gets used.
+def generate_program(statements):
+    lines = []
+    for i in range(statements):
+        kind = i % 4
+        if kind == 0:
+            lines.append('x%d := (a + %d) * b - c / 2' % (i, i))
+        elif kind == 1:
+            lines.append('if x <= %d and not y >= 3 then z := 1 else z := 2 end' % i)
+        elif kind == 2:
+            lines.append('# loop %d\nwhile n != 0 or m = 1 do n := n - 1 end' % i)
+        else:
+            lines.append('counter_%d := counter_%d + 1' % (i, i))
+    return ';\n'.join(lines) + '\n'
+
+# Discards everything written to it; used to silence `lexer.lex` output.
+class NullWriter:
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+# Calls `function` with stdout discarded and returns its result.
+def quietly(function):
+    stdout = sys.stdout
+    sys.stdout = NullWriter()
+    try:
+        return function()
+    finally:
+        sys.stdout = stdout
+
+# Runs `function` `repeat` times and returns the best wall clock time.
+def best_time(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        quietly(function)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, size, seconds, baseline=None):
+    line = '%-32s %10d bytes %9.4f s' % (name, size, seconds)
+    if baseline is not None:
+        line += '  (%.1fx)' % (baseline / seconds)
+    print line
+
+# The lexer as it was originally written: every token expression is compiled
+# and tried in turn at every position. Kept here as the comparison baseline.
+def reference_lex(characters, token_exprs):
+    pos = 0
+    tokens = []
+    while pos < len(characters):
+        match = None
+        for token_expr in token_exprs:
+            pattern, tag = token_expr
+            regex = re.compile(pattern)
+            match = regex.match(characters, pos)
+            if match:
+                text = match.group(0)
+                if tag:
+                    tokens.append((text, tag))
+                break
+        if not match:
+            raise ValueError('Illegal character: %s' % characters[pos])
+        else:
+            pos = match.end(0)
+    return tokens
+
+def bench_lex():
+    for statements in [1000, 10000, 20000]:
+        text = generate_program(statements)
+        expected = reference_lex(text, token_exprs)
+        if lexer.lex_token_stream(text, token_exprs) != expected or \
+           imp_lex(text) != expected:
+            raise AssertionError('lexer output differs from reference')
+        baseline = best_time(lambda: reference_lex(text, token_exprs), 1)
+        report('lex (reference)', len(text), baseline)
+        seconds = best_time(lambda: lexer.lex_token_stream(text, token_exprs))
+        report('lex (master regex)', len(text), seconds, baseline)
+        report('lex (DFA)', len(text), best_time(lambda: imp_lex(text)), baseline)
+
+# Bytes held by a list of (text, tag) tuples, not counting the shared tag
+# strings.
+def token_list_size(tokens):
+    size = sys.getsizeof(tokens)
+    for token in tokens:
+        size += sys.getsizeof(token) + sys.getsizeof(token[0])
+    return size
+
+def token_stream_size(tokens):
+    return sum(sys.getsizeof(column)
+               for column in [tokens.codes, tokens.starts, tokens.ends])
+
+def bench_tokens():
+    text = generate_program(1000)
+    token_list = quietly(lambda: lexer.lex(text, token_exprs))
+    token_stream = imp_lex(text)
+    if imp_parse(token_list).value != imp_parse(token_stream).value:
+        raise AssertionError('parse results differ')
+    print '%-32s %10d bytes/token' % ('tokens (tuple list)',
+                                      token_list_size(token_list) / len(token_list))
+    print '%-32s %10d bytes/token' % ('tokens (TokenStream)',
+                                      token_stream_size(token_stream) / len(token_stream))
+    baseline = best_time(lambda: imp_parse(token_list))
+    report('parse (tuple list)', len(text), baseline)
+    report('parse (TokenStream)', len(text), best_time(lambda: imp_parse(token_stream)), baseline)
+
+def bench_dfa():
+    keywords = ' '.join(['while do end if then else and or not'] * 20000)
+    identifiers = ' '.join(['whilst doe endx iff thenx elsa andy orb note'] * 20000)
+    for name, text in [('keywords', keywords), ('identifiers', identifiers)]:
+        baseline = best_time(lambda: lexer.lex_token_stream(text, token_exprs))
+        report('lex %s (master regex)' % name, len(text), baseline)
+        seconds = best_time(lambda: dfa_lexer.dfa_lex(text, token_exprs))
+        report('lex %s (DFA)' % name, len(text), seconds, baseline)
+
+def bench_parallel():
+    text = generate_program(50000)
+    expected = imp_lex(text)
+    baseline = best_time(lambda: imp_lex(text), 1)
+    report('lex (serial DFA)', len(text), baseline)
+    cores = multiprocessing.cpu_count()
+    processes = 1
+    while True:
+        if imp_lex_parallel(text, processes) != expected:
+            raise AssertionError('parallel lexer output differs from serial')
+        seconds = best_time(lambda: imp_lex_parallel(text, processes), 1)
+        report('lex (%d processes)' % processes, len(text), seconds, baseline)
+        if processes >= cores:
+            break
+        processes = min(processes * 2, cores)
+
+# Times single keystrokes (replacing a digit in the middle of the program)
+# with an `IncrementalProgram` against re-lexing and re-parsing everything.
+def bench_incremental():
+    for statements in [100, 1000, 5000, 50000]:
+        text = generate_program(statements)
+        program = IncrementalProgram(text)
+        offset = text.index('x%d :=' % (statements // 2 // 4 * 4))
+        offset = text.index('+ ', offset) + 2
+        def keystrokes():
+            for digit in '1234567890':
+                program.edit(offset, 1, digit)
+        edit_seconds = best_time(keystrokes) / 10
+        full_seconds = best_time(lambda: imp_parse(imp_lex(program.text)), 1)
+        print '%-32s %10d bytes %9.6f s/edit  (full reparse %.4f s)' % \
+              ('incremental edit', len(text), edit_seconds, full_seconds)
+
+def bench_packrat():
+    for depth in [10, 40, 80]:
+        text = 'if ' + '(' * depth + 'x < 1' + ')' * depth + ' then x := 1 end'
+        tokens = imp_lex(text)
+        baseline = best_time(lambda: imp_parse(tokens))
+        report('nested parens %d (backtracking)' % depth, len(text), baseline)
+        seconds = best_time(lambda: imp_parse(tokens, packrat=True))
+        report('nested parens %d (packrat)' % depth, len(text), seconds, baseline)
+
+# Parses per second for many short programs. The "rebuilt" numbers throw the
+# shared grammar away before every parse, which is what every `imp_parse`
+# used to pay for.
+def bench_grammar():
+    programs = [imp_lex(generate_program(3)) for _ in range(200)]
+    def parse_all():
+        for tokens in programs:
+            imp_parse(tokens)
+    def parse_all_rebuilt():
+        for tokens in programs:
+            rebuild_grammar()
+            imp_parse(tokens)
+    baseline = best_time(parse_all_rebuilt)
+    seconds = best_time(parse_all)
+    print '%-32s %10d parses/s' % ('short programs (rebuilt)', len(programs) / baseline)
+    print '%-32s %10d parses/s  (%.1fx)' % ('short programs (shared)', len(programs) / seconds,
+                                            baseline / seconds)
+
+# Forgets every shared `rule` parser in `imp_parser`.
+def rebuild_grammar():
+    import imp_parser
+    for name in dir(imp_parser):
+        function = getattr(imp_parser, name)
+        if isinstance(function, types.FunctionType) and hasattr(function, 'clear'):
+            function.clear()
+
+# Parse throughput over a medium sized program.
+def bench_parse():
+    tokens = imp_lex(generate_program(1000))
+    seconds = best_time(lambda: imp_parse(tokens))
+    print '%-32s %10d tokens/s' % ('parse', len(tokens) / seconds)
+
+# A long sequence parsed with a chain of `Concat`s (a nested pair and a
+# result per step) against a single flat `Seq`.
+def bench_seq():
+    tokens = imp_lex(' '.join(['x := 1'] * 10))
+    parsers = [id, keyword(':='), Tag(INT)] * 10
+    chained = reduce(lambda l, r: l + r, parsers)
+    flat = Seq(*parsers)
+    def parse_all(parser):
+        for _ in range(10000):
+            parser.parse(tokens, 0)
+    baseline = best_time(lambda: parse_all(chained))
+    seconds = best_time(lambda: parse_all(flat))
+    print '%-32s %10d parses/s' % ('30 tokens (Concat chain)', 10000 / baseline)
+    print '%-32s %10d parses/s  (%.1fx)' % ('30 tokens (Seq)', 10000 / seconds,
+                                            baseline / seconds)
+
+def bench_compiled():
+    for statements in [100, 1000]:
+        text = generate_program(statements)
+        tokens = imp_lex(text)
+        if imp_parse(tokens, compiled=True).value != imp_parse(tokens).value:
+            raise AssertionError('compiled parser output differs')
+        baseline = best_time(lambda: imp_parse(tokens))
+        report('parse (combinators)', len(text), baseline)
+        seconds = best_time(lambda: imp_parse(tokens, compiled=True))
+        report('parse (compiled)', len(text), seconds, baseline)
+
+# Straight-line programs far longer than the recursion limit, parsed and run
+# with constant stack depth.
+def bench_long():
+    for statements in [10000, 100000]:
+        text = ';\n'.join(['x := x + 1'] * statements)
+        tokens = imp_lex(text)
+        ast = imp_parse(tokens).value
+        report('parse %d statements' % statements, len(text),
+               best_time(lambda: imp_parse(tokens), 1))
+        report('eval %d statements' % statements, len(text),
+               best_time(lambda: ast.eval({}), 1))
+
+# Loading a program's AST from its .impc file against lexing and parsing it.
+def bench_cache():
+    import ast_cache
+    for statements in [1000, 10000]:
+        text = generate_program(statements)
+        data = ast_cache.dump_ast(imp_parse_stream(imp_lex_stream(text)).value)
+        baseline = best_time(lambda: imp_parse_stream(imp_lex_stream(text)), 1)
+        report('lex and parse', len(text), baseline)
+        report('load .impc (%d bytes)' % len(data), len(text),
+               best_time(lambda: ast_cache.load_ast(data)), baseline)
+
+# Loop-heavy programs, for comparing ways of running an AST.
+loop_programs = [
+    ('factorial', 'n := 0; while n < 300 do n := n + 1; i := 0; p := 1; '
+                  'while i < 40 do i := i + 1; p := p * i end end'),
+    ('nested loops', 'i := 0; while i < 200 do j := 0; while j < 100 do '
+                     'if j / 2 * 2 = j then s := s + j else s := s - 1 end; '
+                     'j := j + 1 end; i := i + 1 end'),
+]
+
+# Walking the AST with `eval` against running it as compiled closures.
+def bench_closures():
+    for name, text in loop_programs:
+        ast = imp_parse(imp_lex(text)).value
+        expected = {}
+        ast.eval(expected)
+        env = {}
+        compile_program(ast)(env)
+        if env != expected:
+            raise AssertionError('compiled program output differs')
+        baseline = best_time(lambda: ast.eval({}), 10)
+        report('%s (eval)' % name, len(text), baseline)
+        seconds = best_time(lambda: compile_program(ast)({}), 10)
+        report('%s (closures)' % name, len(text), seconds, baseline)
+
+# The same loop-heavy programs run by the bytecode VM.
+def bench_vm():
+    from imp_vm import compile_bytecode, run
+    for name, text in loop_programs:
+        ast = imp_parse(imp_lex(text)).value
+        program = compile_bytecode(ast)
+        expected = {}
+        ast.eval(expected)
+        env = {}
+        run(program, env)
+        if env != expected:
+            raise AssertionError('VM output differs')
+        baseline = best_time(lambda: ast.eval({}), 10)
+        report('%s (eval)' % name, len(text), baseline)
+        seconds = best_time(lambda: run(program, {}), 10)
+        report('%s (VM)' % name, len(text), seconds, baseline)
+
+# The AST node classes as they were before they had `__slots__`: old-style
+# classes with a `__dict__`, compared by comparing `__dict__`s.
+class DictEquality:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and \
+               self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+dict_node_classes = {}
+
+# Returns `ast` rebuilt from `DictEquality` nodes, and the number of nodes.
+def dict_nodes(ast):
+    count = [0]
+    def convert(value):
+        if isinstance(value, list):
+            return [convert(item) for item in value]
+        if not isinstance(value, Equality):
+            return value
+        count[0] += 1
+        kind = value.__class__
+        if kind not in dict_node_classes:
+            dict_node_classes[kind] = types.ClassType(kind.__name__, (DictEquality,), {})
+        fields = dict((name, convert(getattr(value, name))) for name in kind.fields)
+        return dict_node_classes[kind](**fields)
+    return convert(ast), count[0]
+
+def node_sizes(ast):
+    size = 0
+    pending = [ast]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, (Equality, DictEquality)):
+            size += sys.getsizeof(value)
+            if hasattr(value, '__dict__'):
+                size += sys.getsizeof(value.__dict__)
+                pending.extend(value.__dict__.values())
+            else:
+                pending.extend(getattr(value, name) for name in value.fields)
+    return size
+
+# Bytes per AST node (not counting the lists, strings and ints they hold),
+# and the time to compare two equal ASTs, with `__dict__` and `__slots__`
+# nodes.
+def bench_nodes():
+    text = generate_program(10000)
+    tokens = imp_lex(text)
+    ast = imp_parse(tokens).value
+    other = imp_parse(tokens).value
+    dict_ast, count = dict_nodes(ast)
+    dict_other = dict_nodes(other)[0]
+    print '%-32s %10d bytes/node' % ('AST nodes (__dict__)', node_sizes(dict_ast) / count)
+    print '%-32s %10d bytes/node' % ('AST nodes (__slots__)', node_sizes(ast) / count)
+    if not (ast == other and dict_ast == dict_other):
+        raise AssertionError('ASTs differ')
+    baseline = best_time(lambda: dict_ast == dict_other)
+    report('compare ASTs (__dict__)', len(text), baseline)
+    report('compare ASTs (__slots__)', len(text), best_time(lambda: ast == other), baseline)
+
+# The number of distinct node objects in `ast`. (`id` is the `imp_parser`
+# parser here.)
+def distinct_nodes(ast):
+    object_id = __builtin__.id
+    seen = set()
+    pending = [ast]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, Equality) and object_id(value) not in seen:
+            seen.add(object_id(value))
+            pending.extend(getattr(value, name) for name in value.fields)
+    return len(seen)
+
+# Parsing with and without sharing identical subtrees through a `NodeTable`.
+def bench_hashcons():
+    text = generate_program(10000)
+    tokens = imp_lex(text)
+    ast = imp_parse(tokens).value
+    shared = imp_parse(tokens, table=NodeTable()).value
+    if ast != shared:
+        raise AssertionError('hash-consed AST differs')
+    print '%-32s %10d nodes' % ('AST nodes', distinct_nodes(ast))
+    print '%-32s %10d nodes' % ('AST nodes (hash-consed)', distinct_nodes(shared))
+    baseline = best_time(lambda: imp_parse(tokens))
+    report('parse', len(text), baseline)
+    report('parse (hash-consed)', len(text),
+           best_time(lambda: imp_parse(tokens, table=NodeTable())), baseline)
+
+# A loop full of constant subexpressions, run before and after constant
+# folding.
+def bench_fold():
+    from optimizer import optimize
+    text = 'i := 0; while i < 2000 * 5 do x := 2 * 3 + 0; y := i * 1 + x * (4 - 4); ' \
+           'if 1 < 0 then z := 1 else z := z + 60 / 6 end; ' \
+           'while 1 > 2 do i := i - 1 end; i := i + 1 end'
+    ast = imp_parse(imp_lex(text)).value
+    optimized = optimize(ast)
+    expected = {}
+    ast.eval(expected)
+    env = {}
+    optimized.eval(env)
+    if env != expected:
+        raise AssertionError('optimized program output differs')
+    baseline = best_time(lambda: ast.eval({}))
+    report('constants (eval)', len(text), baseline)
+    report('constants (folded, eval)', len(text), best_time(lambda: optimized.eval({})), baseline)
+    baseline = best_time(lambda: compile_program(ast)({}))
+    report('constants (closures)', len(text), baseline)
+    report('constants (folded, closures)', len(text),
+           best_time(lambda: compile_program(optimized)({})), baseline)
+
+# Loops recomputing invariant and repeated expressions, run before and after
+# optimizing.
+def bench_licm():
+    from optimizer import optimize, remove_temporaries
+    text = 'n := 100; i := 0; while i < n * n do x := (a + b) * c + i; ' \
+           'y := (a + b) * c - i; z := (x + y) * (x + y); i := i + 1 end'
+    ast = imp_parse(imp_lex(text)).value
+    optimized = optimize(ast)
+    expected = {}
+    ast.eval(expected)
+    env = {}
+    optimized.eval(env)
+    remove_temporaries(env)
+    if env != expected:
+        raise AssertionError('optimized program output differs')
+    baseline = best_time(lambda: ast.eval({}))
+    report('invariants (eval)', len(text), baseline)
+    report('invariants (optimized, eval)', len(text),
+           best_time(lambda: optimized.eval({})), baseline)
+    baseline = best_time(lambda: compile_program(ast)({}))
+    report('invariants (closures)', len(text), baseline)
+    report('invariants (optimized, closures)', len(text),
+           best_time(lambda: compile_program(optimized)({})), baseline)
+
+# Optimizing straight-line programs of growing size, most of which is sharing
+# their repeated subexpressions.
+def bench_cse():
+    def program(statements):
+        return '; '.join('x%d := (a + b) * (x%d + %d) - (a + b); a := a + x%d' %
+                         (i % 8, (i + 1) % 8, i % 7, i % 8) for i in range(statements // 2))
+    optimize_scaling(program, [10000, 20000, 40000, 80000])
+
+# Times `optimize` on `program(statements)` for each number of statements.
+# Each statement should take about the same time however many there are;
+# fails if the largest program takes more than three times as long per
+# statement as the smallest.
+def optimize_scaling(program, sizes):
+    from optimizer import optimize
+    per_statement = []
+    for statements in sizes:
+        text = program(statements)
+        ast = imp_parse(imp_lex(text)).value
+        seconds = best_time(lambda: optimize(ast), 1)
+        report('optimize (%d statements)' % statements, len(text), seconds)
+        per_statement.append(seconds / statements)
+    if per_statement[-1] > 3 * per_statement[0]:
+        raise AssertionError('optimizing grows faster than the program')
+
+# A generated-style program full of assignments which are overwritten before
+# they are read, run before and after removing dead stores (keeping every
+# variable, and keeping only `total`). Then optimizing generated programs of
+# growing size.
+def bench_deadstores():
+    from optimizer import optimize, remove_temporaries
+    text = 'i := 0; while i < 5000 do a := i * 3; a := i * 2; b := a + i; c := b - a; ' \
+           'd := b * b; c := 0; total := total + b; i := i + 1 end'
+    ast = imp_parse(imp_lex(text)).value
+    expected = {}
+    ast.eval(expected)
+    baseline = best_time(lambda: ast.eval({}))
+    report('dead stores (eval)', len(text), baseline)
+    for name, outputs in [('all', None), ('total', ['total'])]:
+        optimized = optimize(ast, outputs)
+        env = {}
+        optimized.eval(env)
+        remove_temporaries(env)
+        if any(env.get(name) != expected[name] for name in outputs or expected):
+            raise AssertionError('optimized program output differs')
+        report('dead stores (outputs %s, eval)' % name, len(text),
+               best_time(lambda: optimized.eval({})), baseline)
+    # Generated programs assign a new variable every few statements, so
+    # thousands of them are live
+    optimize_scaling(generate_program, [5000, 10000, 20000, 40000])
+
+# A loop whose condition and `if`s are guarded, as in a search: the left side
+# of each `and` and `or` almost always decides it, so short-circuiting skips
+# the polynomial on the right, which costs several times the guard. Timed evaluating both sides and
+# short-circuiting, with each way of running a program.
+def bench_shortcircuit():
+    import imp_ast
+    from imp_vm import compile_bytecode, run
+    text = 'n := 5000; i := 0; while i < n and (found = 0 or ' \
+           '((i * i + 3) * (i - 7) * i + (i + 5) * (i - 3)) / 7 < n * n * n * n) do ' \
+           'if i > n - 2 and ((i * i - i) * (i + 9) + (i * 3 - 1) * (i * i + 2)) / 3 > n then ' \
+           'found := 1 end; ' \
+           'if i < 100 and ((i * 5 + 3) * (i + 1) * (i - 4) + (i * i + 7) * (i - 2)) / 9 = n then ' \
+           's := s + 1 end; i := i + 1 end'
+    ast = imp_parse(imp_lex(text)).value
+    def vm():
+        program = compile_bytecode(ast)
+        return lambda env: run(program, env)
+    backends = [('eval', lambda: ast.eval),
+                ('closures', lambda: compile_program(ast)),
+                ('VM', vm)]
+    for name, backend in backends:
+        results = []
+        for short_circuit in (False, True):
+            imp_ast.short_circuit = short_circuit
+            try:
+                program = backend()
+                env = {}
+                program(env)
+                results.append(env)
+                seconds = best_time(lambda: program({}))
+            finally:
+                imp_ast.short_circuit = True
+            if not short_circuit:
+                baseline = seconds
+                report('guards (both sides, %s)' % name, len(text), seconds)
+            else:
+                report('guards (short-circuit, %s)' % name, len(text), seconds, baseline)
+        if results[0] != results[1]:
+            raise AssertionError('short-circuit output differs')
+
+# Counting loops, run as they are and as counted loops: over an `xrange`, and
+# (for sums) in closed form.
+counted_programs = [
+    ('range loop', 'n := 20000; i := 0; while i < n do x := i * 3 + y; i := i + 1 end'),
+    ('nested loops', 'i := 0; while i < 200 do j := 0; while j < 100 do x := x + i * j; '
+                     'j := j + 1 end; i := i + 1 end'),
+    ('sum loop', 'i := 0; while i < 20000 do s := s + i; t := t + 3; i := i + 1 end'),
+]
+
+def bench_counted():
+    import imp_ast
+    for name, text in counted_programs:
+        ast = imp_parse(imp_lex(text)).value
+        for backend, run in [('eval', lambda: ast.eval), ('closures', lambda: compile_program(ast))]:
+            results = []
+            for count_loops in (False, True):
+                imp_ast.count_loops = count_loops
+                try:
+                    program = run()
+                    env = {}
+                    program(env)
+                    results.append(env)
+                    seconds = best_time(lambda: program({}))
+                finally:
+                    imp_ast.count_loops = True
+                if not count_loops:
+                    baseline = seconds
+                    report('%s (%s)' % (name, backend), len(text), seconds)
+                else:
+                    report('%s (counted, %s)' % (name, backend), len(text), seconds, baseline)
+            if results[0] != results[1]:
+                raise AssertionError('counted loop output differs')
+
+# A parameter sweep: one program run on 20000 inputs, with `eval` on each
+# input in turn and as one batch of NumPy columns.
+def bench_batch():
+    from imp_batch import numpy, run_batch, lane
+    if numpy is None:
+        print 'batch: numpy is not installed'
+        return
+    text = 'x := a * 3 - b / 2; if x > b then y := x - b else y := b - x end; ' \
+           'n := a / 10; while n > 0 do s := s + n * b; n := n - 1 end'
+    ast = imp_parse(imp_lex(text)).value
+    size = 20000
+    a = [(i * 7919) % 100 for i in range(size)]
+    b = [(i * 104729) % 50 - 25 for i in range(size)]
+    columns = {'a': numpy.array(a), 'b': numpy.array(b)}
+    result = run_batch(ast, columns)
+    for index in range(0, size, 97):
+        env = {'a': a[index], 'b': b[index]}
+        ast.eval(env)
+        if env != lane(result, index):
+            raise AssertionError('batch output differs')
+    def run_each():
+        for index in range(size):
+            ast.eval({'a': a[index], 'b': b[index]})
+    baseline = best_time(run_each, 1)
+    report('sweep (eval each)', len(text), baseline)
+    report('sweep (batch)', len(text), best_time(lambda: run_batch(ast, columns)), baseline)
+
+benchmarks = [
+    ('lex', bench_lex),
+    ('tokens', bench_tokens),
+    ('dfa', bench_dfa),
+    ('parallel', bench_parallel),
+    ('incremental', bench_incremental),
+    ('packrat', bench_packrat),
+    ('grammar', bench_grammar),
+    ('parse', bench_parse),
+    ('seq', bench_seq),
+    ('compiled', bench_compiled),
+    ('long', bench_long),
+    ('cache', bench_cache),
+    ('closures', bench_closures),
+    ('vm', bench_vm),
+    ('nodes', bench_nodes),
+    ('hashcons', bench_hashcons),
+    ('fold', bench_fold),
+    ('licm', bench_licm),
+    ('cse', bench_cse),
+    ('deadstores', bench_deadstores),
+    ('shortcircuit', bench_shortcircuit),
+    ('counted', bench_counted),
+    ('batch', bench_batch),
+]
+
+if __name__ == '__main__':
+    selected = sys.argv[1:]
+    for name, function in benchmarks:
+        if not selected or name in selected:
+            function()
@@ -17,6 +17,10 @@
 # any language. First, we will write a language agnostic library of 
 # combinators, then use that to write our IMP parser.
 
+import copy
+
+from token_stream import *
+
 class Result:
     def __init__(self, value, pos):
         self.value = value
@@ -25,6 +29,46 @@ class Result:
     def __repr__(self):
         return 'Result(%s, %d)' % (self.value, self.pos)
 
+# Parsers usually work on a list of tokens, but they only ever index into it,
+# so any sequence of tokens will do. `TokenWindow` wraps a token iterator (such
+# as `lexer.lex_stream`) and pulls tokens from it only when a parser asks for
+# them. Tokens before a position can be dropped with `release` once the caller
+# knows no parser will backtrack over them, which keeps memory flat for long
+# inputs. Asking for a position past the last token raises `IndexError`, just
+# like a list.
+class TokenWindow:
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.buffer = []
+        self.offset = 0
+
+    def __getitem__(self, pos):
+        index = pos - self.offset
+        if index < 0:
+            raise RuntimeError('token %d has already been released' % pos)
+        buffer = self.buffer
+        while index >= len(buffer):
+            try:
+                buffer.append(next(self.tokens))
+            except StopIteration:
+                raise IndexError('no token at position %d' % pos)
+        return buffer[index]
+
+    def release(self, pos):
+        if pos > self.offset:
+            del self.buffer[:pos - self.offset]
+            self.offset = pos
+
+# Returns True if there are no tokens left at `pos`. This works for lists and
+# for lazy sequences like `TokenWindow`, which do not know their length until
+# they have been read to the end.
+def at_end(tokens, pos):
+    try:
+        tokens[pos]
+    except IndexError:
+        return True
+    return False
+
 # Parsers are functions which take a stream of tokens as input. 
 # We will define parsers as objects with a __call__ method. This 
 # means that a parser object will behave as if it were a function, 
@@ -33,15 +77,32 @@ class Result:
 
 # The __call__ method does the parsing. It's input is a full list 
 # of tokens, which are returned by the lexer, and an index into the
-# list indicating the next token. The default implementation will
+# list indicating the next token. It returns a `Result` on success and
+# `None` on failure.
+#
+# Internally, parsers talk to each other through the `parse` method
+# instead, which returns a plain `(value, pos)` tuple on success and `None`
+# on failure. A small tuple is much cheaper to create than a `Result`
+# instance, and since it cannot be changed, results can be passed on and
+# cached without copying. `__call__` just wraps the outcome of `parse` in a
+# `Result` for the caller. The default implementation of `parse` will
 # always return `None` (failure), and the subclasses of `Parser` will
-# provide their own __call__ implementation. 
+# provide their own `parse` implementation.
 
 # The other methods: __add__, __mul__, __or__, __xor__ define the 
 # `+`, `*`, `|`, `^` operators. Each operator provides a shortcut
 # for calling a different combinator. 
 
 class Parser:
+    def __call__(self, tokens, pos):
+        parsed = self.parse(tokens, pos)
+        if parsed:
+            return Result(parsed[0], parsed[1])
+        return None
+
+    def parse(self, tokens, pos):
+        return None
+
     def __add__(self, other):
         return Concat(self, other)
 
@@ -56,13 +117,28 @@ class Parser:
 
 # The next class we implement is the `Tag` combinator. It matches any
 # token which has a particular tag. The value can be anything.
+#
+# When the tokens are a `TokenStream`, `Tag` and `Reserved` compare integer
+# kind codes instead of looking at (text, tag) tuples. The text is only
+# sliced out of the source for the tokens `Tag` actually matches; `Reserved`
+# already knows the text it is looking for.
 class Tag(Parser):
     def __init__(self, tag):
         self.tag = tag
+        self.code = kind_code(tag)
 
-    def __call__(self, tokens, pos):
-        if pos < len(tokens) and tokens[pos][1] is self.tag:
-            return Result(tokens[pos][0], pos + 1)
+    def parse(self, tokens, pos):
+        if tokens.__class__ is TokenStream:
+            codes = tokens.codes
+            if pos < len(codes) and kind_tag_codes[codes[pos]] == self.code:
+                return (tokens.text(pos), pos + 1)
+            return None
+        try:
+            token = tokens[pos]
+        except IndexError:
+            return None
+        if token[1] is self.tag:
+            return (token[0], pos + 1)
         else:
             return None
 
@@ -77,12 +153,25 @@ class Reserved(Parser):
     def __init__(self, value, tag):
         self.value = value
         self.tag = tag
-
-    def __call__(self, tokens, pos):
-        if pos < len(tokens) and \
-           tokens[pos][0] == self.value and \
-           tokens[pos][1] is self.tag:
-            return Result(tokens[pos][0], pos + 1)
+        self.code = kind_code(tag, value)
+        self.tag_code = kind_code(tag)
+
+    def parse(self, tokens, pos):
+        if tokens.__class__ is TokenStream:
+            codes = tokens.codes
+            if pos < len(codes):
+                code = codes[pos]
+                # A token of the plain tag kind can still have our text
+                if code == self.code or \
+                   (code == self.tag_code and tokens.text(pos) == self.value):
+                    return (self.value, pos + 1)
+            return None
+        try:
+            token = tokens[pos]
+        except IndexError:
+            return None
+        if token[0] == self.value and token[1] is self.tag:
+            return (token[0], pos + 1)
         else:
             return None
 
@@ -100,15 +189,34 @@ class Concat(Parser):
         self.left = left
         self.right = right
 
-    def __call__(self, tokens, pos):
-        left_result = self.left(tokens, pos)
+    def parse(self, tokens, pos):
+        left_result = self.left.parse(tokens, pos)
         if left_result:
-            right_result = self.right(tokens, left_result.pos)
+            right_result = self.right.parse(tokens, left_result[1])
             if right_result:
-                combined_value = (left_result.value, right_result.value)
-                return Result(combined_value, right_result.pos)
+                combined_value = (left_result[0], right_result[0])
+                return (combined_value, right_result[1])
         return None
 
+# Chaining `Concat`s nests the pairs: `a + b + c + d` gives
+# `(((a, b), c), d)`, with a new pair (and a new result) for every `+`.
+# `Seq` instead applies any number of parsers one after the other and
+# returns all their values in one flat tuple, so `Seq(a, b, c, d)` gives
+# `(a, b, c, d)`. It fails if any of its parsers fails.
+class Seq(Parser):
+    def __init__(self, *parsers):
+        self.parsers = parsers
+
+    def parse(self, tokens, pos):
+        values = []
+        for parser in self.parsers:
+            result = parser.parse(tokens, pos)
+            if not result:
+                return None
+            values.append(result[0])
+            pos = result[1]
+        return (tuple(values), pos)
+
 # The last combinator we need is an expression parser, which is used to match an 
 # expression which consists of a list of elements separated by something. Here is 
 # an example with compound statements:
@@ -129,20 +237,102 @@ class Exp(Parser):
         self.parser = parser
         self.separator = separator
 
-    def __call__(self, tokens, pos):
-        result = self.parser(tokens, pos)
-
-        def process_next(parsed):
-            (sepfunc, right) = parsed
-            return sepfunc(result.value, right)
-        next_parser = self.separator + self.parser ^ process_next
-
-        next_result = result
-        while next_result:
-            next_result = next_parser(tokens, result.pos)
-            if next_result:
-                result = next_result
-        return result            
+    def parse(self, tokens, pos):
+        parser = self.parser
+        separator = self.separator
+        result = parser.parse(tokens, pos)
+        while result:
+            separator_result = separator.parse(tokens, result[1])
+            if not separator_result:
+                break
+            right_result = parser.parse(tokens, separator_result[1])
+            if not right_result:
+                break
+            sepfunc = separator_result[0]
+            result = (sepfunc(result[0], right_result[0]), right_result[1])
+        return result
+
+# `Exp` handles one level of binary operators, so an expression language
+# with several precedence levels stacks one `Exp` per level. Every operand
+# then goes through every level, each of which tries its own operators in
+# turn. `Precedence` parses all the levels at once by precedence climbing.
+# `levels` lists the operators (as `Reserved` parsers), from the most
+# tightly binding level to the loosest. `combine` takes an operator and
+# returns the function which joins the two operands, like the separator of
+# an `Exp`. The operator after each operand is found with one table lookup,
+# however many levels there are.
+#
+# The result is the same as with one `Exp` per level. All operators are
+# left associative. If an operator is not followed by a valid operand,
+# parsing stops in front of it; no other level tries it again. The same
+# happens if the combining function returns None, which is how it can turn
+# down operands it cannot join.
+class Precedence(Parser):
+    def __init__(self, parser, levels, combine):
+        self.parser = parser
+        self.levels = levels
+        self.combine = combine
+        self.operator_codes = {}    # kind code -> (level, text)
+        self.operator_levels = {}   # (text, tag) -> level
+        for level, operators in enumerate(levels):
+            for operator in operators:
+                self.operator_codes.setdefault(operator.code, (level, operator.value))
+                self.operator_levels.setdefault((operator.value, operator.tag), level)
+
+    def parse(self, tokens, pos):
+        return self.climb(tokens, pos, len(self.levels) - 1)
+
+    # Parses an operand followed by any operators of level `max_level` or
+    # tighter.
+    def climb(self, tokens, pos, max_level):
+        result = self.parser.parse(tokens, pos)
+        if not result:
+            return None
+        value, pos = result
+        min_level = 0
+        while True:
+            operator = self.operator(tokens, pos)
+            if not operator:
+                break
+            level, text = operator
+            # An operator tighter than the last one was left there because
+            # its right operand did not parse.
+            if level < min_level or level > max_level:
+                break
+            right_result = self.climb(tokens, pos + 1, level - 1)
+            if not right_result:
+                break
+            combined = self.combine(text)(value, right_result[0])
+            if combined is None:
+                break
+            value = combined
+            pos = right_result[1]
+            min_level = level
+        return (value, pos)
+
+    # Returns (level, text) for the operator at `pos`, or None.
+    def operator(self, tokens, pos):
+        if tokens.__class__ is TokenStream:
+            codes = tokens.codes
+            if pos >= len(codes):
+                return None
+            code = codes[pos]
+            operator = self.operator_codes.get(code)
+            if operator is None and kind_texts[code] is None:
+                # A token of a plain tag kind can still have an operator's text
+                text = tokens.text(pos)
+                level = self.operator_levels.get((text, kind_tags[code]))
+                if level is not None:
+                    operator = (level, text)
+            return operator
+        try:
+            token = tokens[pos]
+        except IndexError:
+            return None
+        level = self.operator_levels.get(token)
+        if level is not None:
+            return (level, token[0])
+        return None
 
 # `Concat` is useful for parsing sequences of tokens. For example, to parse
 # ` 1 + 2 `, we can write this as :
@@ -167,12 +357,12 @@ class Alternate(Parser):
         self.left = left
         self.right = right
 
-    def __call__(self, tokens, pos):
-        left_result = self.left(tokens, pos)
+    def parse(self, tokens, pos):
+        left_result = self.left.parse(tokens, pos)
         if left_result:
             return left_result
         else:
-            right_result = self.right(tokens, pos)
+            right_result = self.right.parse(tokens, pos)
             return right_result
 
 # The `Opt` Parser is useful for optional text, such as the else-caluse of an 
@@ -185,12 +375,12 @@ class Opt(Parser):
     def __init__(self, parser):
         self.parser = parser
 
-    def __call__(self, tokens, pos):
-        result = self.parser(tokens, pos)
+    def parse(self, tokens, pos):
+        result = self.parser.parse(tokens, pos)
         if result:
             return result
         else:
-            return Result(None, pos)
+            return (None, pos)
 
 # The `Rep` parser applies its input parser repeatedly until it fails. This is 
 # useful for generating lists of things. NOTE: `Rep` will successfully match an 
@@ -200,30 +390,29 @@ class Rep(Parser):
     def __init__(self, parser):
         self.parser = parser
 
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         results = []
-        result = self.parser(tokens, pos)
+        result = self.parser.parse(tokens, pos)
         while result:
-            results.append(result.value)
-            pos = result.pos
-            result = self.parser(tokens, pos)
-        return Result(results, pos)
+            results.append(result[0])
+            pos = result[1]
+            result = self.parser.parse(tokens, pos)
+        return (results, pos)
 
 # The `Process` parser is a useful combinator which allows us to manipulate result
 # values. Its input is a parser and a function. When the parser is applied successfully, 
 # the result value is passed to the function, and the return value from the function is 
 # returned instead of the original value. We will use `Process` to actually build the AST
-# nodes out of the pairs and lists that `Concat` and `Rep` return.
+# nodes out of the tuples and lists that `Seq`, `Concat` and `Rep` return.
 class Process(Parser):
     def __init__(self, parser, function):
         self.parser = parser
         self.function = function
 
-    def __call__(self, tokens, pos):
-        result = self.parser(tokens, pos)
+    def parse(self, tokens, pos):
+        result = self.parser.parse(tokens, pos)
         if result:
-            result.value = self.function(result.value)
-            return result
+            return (self.function(result[0]), result[1])
 
 # For example, consider the parser build with `Concat`. When it parsers `1 + 2`, the result
 # value we actually get back is `(('1', '+'), '2'), which is not very useful. With `Process
@@ -234,7 +423,23 @@ class Process(Parser):
 #                   ((1, _ ), r) = parsed
 #                   return int(1) + int(r)
 #               
-#               better_parser = parser ^ process_func 
+#               better_parser = parser ^ process_func
+
+# `Filter` is the other way to look at a result value: it takes a parser and a
+# predicate, and matches what the parser matches as long as the predicate
+# holds for the value. Otherwise it fails, just as if the parser had. It lets a
+# grammar parse something once and decide afterwards whether it can be used
+# here, rather than trying each reading of the same tokens in turn.
+class Filter(Parser):
+    def __init__(self, parser, predicate):
+        self.parser = parser
+        self.predicate = predicate
+
+    def parse(self, tokens, pos):
+        result = self.parser.parse(tokens, pos)
+        if result and self.predicate(result[0]):
+            return result
+        return None
 
 
 # The `Lazy` parser is a less useful combinator. Instead of taking an input parser, 
@@ -250,10 +455,10 @@ class Lazy(Parser):
         self.parser = None
         self.parser_func = parser_func
 
-    def __call__(self, tokens, pos):
+    def parse(self, tokens, pos):
         if not self.parser:
             self.parser = self.parser_func()
-        return self.parser(tokens, pos)
+        return self.parser.parse(tokens, pos)
 
 # Another combinator we will need to implement is the `Phrase`, which will take a 
 # single input parser, apply it and return its result normally. The only catch is 
@@ -264,9 +469,323 @@ class Phrase(Parser):
     def __init__(self, parser):
         self.parser = parser
 
-    def __call__(self, tokens, pos):
-        result = self.parser(tokens, pos)
-        if result and result.pos == len(tokens):
+    def parse(self, tokens, pos):
+        result = self.parser.parse(tokens, pos)
+        if result and at_end(tokens, result[1]):
             return result
         else:
             return None
+
+# Lookahead dispatch
+# ------------------
+# An `Alternate` tries its choices in order, so a statement parser written as
+# `assign_stmt | if_stmt | while_stmt` runs and fails the first two parsers
+# for every `while` loop. Usually the first token alone tells which choice
+# can match: an assignment starts with an identifier, an if statement with
+# `if`. The FIRST set of a parser is the set of tokens it can start with.
+#
+# `Dispatch(a, b, c)` matches like `a | b | c`, but works out the FIRST sets
+# of its choices the first time it is used (by then any `Lazy` rules can be
+# resolved) and from then on only tries the choices which can start with
+# the current token, still in order. If FIRST sets do not overlap, that is
+# at most one choice.
+class FirstSet:
+    def __init__(self):
+        self.tags = set()       # tags of tokens with any text
+        self.literals = set()   # (text, tag) of tokens with one text
+        self.empty = False      # True if it can match without consuming a token
+        self.anything = False   # True if we cannot tell what it starts with
+
+    def update(self, other):
+        self.tags.update(other.tags)
+        self.literals.update(other.literals)
+        self.anything = self.anything or other.anything
+
+    # Whether the parser must be tried whatever the token is (or at the end
+    # of the tokens).
+    def always(self):
+        return self.empty or self.anything
+
+    # Whether a token with this text (None if unknown) and tag can start a
+    # match.
+    def accepts(self, text, tag):
+        if self.always() or tag in self.tags:
+            return True
+        if text is None:
+            return any(literal[1] == tag for literal in self.literals)
+        return (text, tag) in self.literals
+
+# Computes the FIRST set of `parser`. `visiting` holds the parsers (and
+# `Lazy` functions) on the way here, to stop at left recursion.
+def first_set(parser, visiting=()):
+    first = FirstSet()
+    key = parser.parser_func if isinstance(parser, Lazy) else parser
+    if key in visiting:
+        first.anything = True
+        return first
+    visiting = visiting + (key,)
+    if isinstance(parser, Tag):
+        first.tags.add(parser.tag)
+    elif isinstance(parser, Reserved):
+        first.literals.add((parser.value, parser.tag))
+    elif isinstance(parser, Lazy):
+        first = first_set(parser.parser or parser.parser_func(), visiting)
+    elif isinstance(parser, (Seq, Concat)):
+        if isinstance(parser, Seq):
+            items = parser.parsers
+        else:
+            items = (parser.left, parser.right)
+        # A sequence can start with what its first item starts with, and if
+        # that can be empty, with what the next one starts with, and so on
+        first.empty = True
+        for item in items:
+            item_first = first_set(item, visiting)
+            first.update(item_first)
+            if not item_first.empty:
+                first.empty = False
+                break
+    elif isinstance(parser, (Alternate, Dispatch)):
+        if isinstance(parser, Dispatch):
+            items = parser.parsers
+        else:
+            items = (parser.left, parser.right)
+        for item in items:
+            item_first = first_set(item, visiting)
+            first.update(item_first)
+            first.empty = first.empty or item_first.empty
+    elif isinstance(parser, (Opt, Rep)):
+        first.update(first_set(parser.parser, visiting))
+        first.empty = True
+    elif isinstance(parser, (Exp, Precedence, Process, Filter, Phrase, Memo, Packrat)):
+        first = first_set(parser.parser, visiting)
+    else:
+        first.anything = True
+    return first
+
+class Dispatch(Parser):
+    def __init__(self, *parsers):
+        # Choices which are themselves choices are tried in the same order
+        # when flattened, and then need no lookup of their own.
+        flat = []
+        for parser in parsers:
+            if isinstance(parser, Dispatch):
+                flat.extend(parser.parsers)
+            elif isinstance(parser, Alternate):
+                flat.extend(alternatives(parser))
+            else:
+                flat.append(parser)
+        self.parsers = tuple(flat)
+        self.firsts = None
+        # The choices to try, by kind code and by token: a tuple of parsers,
+        # or the parser itself if there is only one.
+        self.code_choices = {}
+        self.token_choices = {}
+
+    # `packrat` copies parsers and then replaces their parsers, so a copy
+    # must not share the tables.
+    def __copy__(self):
+        return Dispatch(*self.parsers)
+
+    def parse(self, tokens, pos):
+        if tokens.__class__ is TokenStream and pos < len(tokens.codes):
+            choices = self.code_choices.get(tokens.codes[pos])
+            if choices is None:
+                choices = self.choices(tokens, pos)
+        else:
+            choices = self.choices(tokens, pos)
+        if choices.__class__ is not tuple:
+            return choices.parse(tokens, pos)
+        for parser in choices:
+            result = parser.parse(tokens, pos)
+            if result:
+                return result
+        return None
+
+    # Works out the FIRST sets of the choices. Called on first use.
+    def prepare(self):
+        firsts = [first_set(parser) for parser in self.parsers]
+        # Every (text, tag) some choice looks for
+        self.literals = set()
+        for first in firsts:
+            self.literals.update(first.literals)
+        self.firsts = firsts
+
+    # The choices which can match the token at `pos`.
+    def choices(self, tokens, pos):
+        if self.firsts is None:
+            self.prepare()
+        if tokens.__class__ is TokenStream:
+            codes = tokens.codes
+            code = codes[pos] if pos < len(codes) else -1
+            choices = self.code_choices.get(code)
+            if choices is None:
+                if code < 0:
+                    choices = self.find_choices(None)
+                else:
+                    choices = self.find_choices(kind_tags[code], kind_texts[code])
+                self.code_choices[code] = choices
+            return choices
+        try:
+            token = tokens[pos]
+        except IndexError:
+            token = None
+        # Tokens which no choice looks for by text are told apart by tag
+        # only, so the table does not grow with every identifier
+        if token is None or token in self.literals:
+            key = token
+        else:
+            key = token[1]
+        choices = self.token_choices.get(key)
+        if choices is None:
+            if token is None:
+                choices = self.find_choices(None)
+            else:
+                choices = self.find_choices(token[1], token[0])
+            self.token_choices[key] = choices
+        return choices
+
+    # The choices which can start with a token with this tag and text (None
+    # if it can have any text). With no tag, the choices which can match at
+    # the end of the tokens.
+    def find_choices(self, tag, text=None):
+        if tag is None:
+            choices = tuple(parser for parser, first in zip(self.parsers, self.firsts)
+                            if first.always())
+        else:
+            choices = tuple(parser for parser, first in zip(self.parsers, self.firsts)
+                            if first.accepts(text, tag))
+        if len(choices) == 1:
+            return choices[0]
+        return choices
+
+# The choices of a chain of `Alternate`s, in order.
+def alternatives(parser):
+    if isinstance(parser, Alternate):
+        return alternatives(parser.left) + alternatives(parser.right)
+    return [parser]
+
+# Grammar rules
+# -------------
+# A grammar is usually written as zero-argument functions which build and
+# return a parser, so that rules can refer to rules defined further down.
+# Calling such a function builds a brand new parser graph every time, and
+# each `Lazy` in it builds another one when it is first used. `rule` turns a
+# rule function into one which builds its parser once and then always
+# returns that same object. Recursive rules must still refer to each other
+# through `Lazy`, which now resolves to the shared parser as well.
+#
+# Parsers keep no state between calls (`Lazy` only remembers which parser it
+# resolved to), so a shared parser can be used for any number of parses,
+# including nested and concurrent ones.
+#
+# `clear()` on a rule forgets its parser, so the next call builds a new one.
+def rule(function):
+    parsers = []
+    def build():
+        if not parsers:
+            parsers.append(function())
+        return parsers[0]
+    def clear():
+        del parsers[:]
+    build.__name__ = function.__name__
+    build.clear = clear
+    return build
+
+# Packrat parsing
+# ---------------
+# Our parsers backtrack freely: when one branch of an `Alternate` fails, the
+# next branch starts again from the same position, and will often re-parse
+# the very same sub-expressions. A grammar with two rules that both start
+# with a parenthesised group, where only the closing parenthesis tells them
+# apart, parses every group twice, and nested parentheses make this pile up.
+#
+# A packrat parser remembers the result of every parser at every position,
+# so each parser runs at most once per position and parsing takes linear
+# time. `packrat(parser)` returns a copy of a parser graph in which every
+# node is wrapped in a `Memo` parser. All the `Memo` nodes of one copy share
+# a `MemoTable`, which is cleared whenever they are applied to a different
+# token sequence and after every complete parse. The table can be given a
+# `max_size`; it is cleared whenever it grows past it.
+#
+# `Lazy` parsers build a fresh sub-grammar the first time they are used, so
+# in the copy every `Lazy` with the same function shares one (memoized)
+# sub-grammar. Otherwise each level of nesting would get its own parsers and
+# nothing would ever be found in the table.
+class MemoTable:
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        self.results = {}
+        self.tokens = None
+
+_missing = object()
+
+class Memo(Parser):
+    def __init__(self, parser, table):
+        self.parser = parser
+        self.table = table
+
+    def parse(self, tokens, pos):
+        table = self.table
+        if table.tokens is not tokens:
+            table.clear()
+            table.tokens = tokens
+        results = table.results
+        key = (self, pos)
+        result = results.get(key, _missing)
+        if result is _missing:
+            result = self.parser.parse(tokens, pos)
+            if table.max_size is not None and len(results) >= table.max_size:
+                results.clear()
+            results[key] = result
+        return result
+
+# The top level of a packrat parser: applies the memoized grammar and then
+# clears the memo table so it does not keep the tokens alive.
+class Packrat(Parser):
+    def __init__(self, parser, table):
+        self.parser = parser
+        self.table = table
+
+    def parse(self, tokens, pos):
+        try:
+            return self.parser.parse(tokens, pos)
+        finally:
+            self.table.clear()
+
+def packrat(parser, max_size=None):
+    table = MemoTable(max_size)
+    return Packrat(memoize(parser, table, {}, {}), table)
+
+# Returns a memoized copy of `parser`. `copies` maps the ids of already
+# copied parsers to (parser, copy) pairs, keeping the originals alive so
+# their ids are not reused. `lazies` maps `Lazy` functions to the shared
+# sub-grammar they resolve to.
+def memoize(parser, table, copies, lazies):
+    if id(parser) in copies:
+        return copies[id(parser)][1]
+    if isinstance(parser, Lazy):
+        function = parser.parser_func
+        def resolve():
+            if function not in lazies:
+                lazies[function] = memoize(function(), table, copies, lazies)
+            return lazies[function]
+        parser_copy = Lazy(resolve)
+        memo = Memo(parser_copy, table)
+        copies[id(parser)] = (parser, memo)
+        return memo
+    parser_copy = copy.copy(parser)
+    memo = Memo(parser_copy, table)
+    copies[id(parser)] = (parser, memo)
+    for name, value in vars(parser_copy).items():
+        if isinstance(value, Parser):
+            setattr(parser_copy, name, memoize(value, table, copies, lazies))
+        elif isinstance(value, tuple):
+            # The parsers of a `Seq`
+            setattr(parser_copy, name,
+                    tuple(memoize(item, table, copies, lazies)
+                          if isinstance(item, Parser) else item
+                          for item in value))
+    return memo
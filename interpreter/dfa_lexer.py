@@ -0,0 +1,402 @@
+# dfa_lexer.py
+# ------------
+# A table driven lexer generator.
+#
+# `lexer.lex` hands the token expressions to Python's regex engine, which
+# tries them one after another at every position. For IMP that means every
+# identifier is first tried against 'and', 'or', 'not', 'if', ... before the
+# identifier expression gets a chance. Here we instead compile the token
+# expressions into a deterministic finite automaton (DFA) once, and lex by
+# walking its transition table one character at a time, so every character
+# is looked at once and nothing is ever re-tried.
+#
+# Building the DFA
+# ----------------
+#   1. Each token expression is parsed with `sre_parse` and turned into a
+#      nondeterministic automaton (NFA) fragment using Thompson's
+#      construction. Only the plain regular subset of the regex syntax is
+#      supported: literals, character sets, `.`, alternation, grouping and
+#      repetition. Anchors, lookarounds and backreferences are rejected.
+#   2. The 256 possible characters are split into character classes: two
+#      characters are in the same class if every NFA edge accepts either
+#      both or neither of them. IMP has a handful of classes (letters,
+#      digits, each operator character, whitespace, ...).
+#   3. The subset construction turns the NFA into a DFA over those classes.
+#      A DFA state accepts the token expression with the lowest index among
+#      the NFA accept states it contains.
+#
+# Keywords
+# --------
+# A token expression which can only match one text (like 'while') and whose
+# text is also matched by a later expression (like the identifier
+# expression) is a keyword. Keywords are left out of the DFA altogether.
+# Instead, when the DFA matches a token using the later expression, a single
+# dict lookup on the token text tells us whether it is really a keyword.
+#
+# Matching
+# --------
+# The DFA lexer takes the longest match at each position (ties go to the
+# expression listed first), which is the usual rule for lexers. For IMP this
+# agrees with `lexer.lex` everywhere except on identifiers which begin with a
+# keyword: `lexer.lex` splits 'android' into 'and' and 'roid', while the DFA
+# lexer gives a single identifier. `dfa_lex_stream` yields the same tokens as
+# `dfa_lex`, lazily, for sources too big to keep in memory, so both ways of
+# lexing IMP accept the same language.
+#
+# Illegal characters
+# ------------------
+# A character which no token expression matches raises `LexerError`. With
+# `errors=True`, `dfa_lex` instead gives it a one character token tagged
+# `ILLEGAL`, which no parser accepts, and carries on; an editor's buffer is
+# often not a valid program for a moment while someone types (see
+# `incremental`).
+
+import re
+import mmap
+import sre_parse
+import sre_constants
+
+from lexer import literal_text
+from token_stream import *
+
+ALPHABET_SIZE = 256
+
+ILLEGAL = 'ILLEGAL'
+
+class LexerError(ValueError):
+    def __init__(self, character, pos):
+        ValueError.__init__(self, character, pos)
+        self.character = character
+        self.pos = pos
+
+    def __str__(self):
+        return 'Illegal character: %s (at %d)' % (self.character, self.pos)
+
+class NFA:
+    def __init__(self):
+        self.epsilon = []   # state -> states reachable without input
+        self.edges = []     # state -> [(character set, state)]
+        self.accepts = {}   # state -> token expression index
+
+    def state(self):
+        self.epsilon.append([])
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    # Adds the states for `pattern` (a parsed regex) starting at `start` and
+    # returns the state reached once it has been matched.
+    def add_pattern(self, pattern, start):
+        state = start
+        for op, value in pattern:
+            state = self.add_item(op, value, state)
+        return state
+
+    def add_item(self, op, value, start):
+        if op == sre_constants.LITERAL:
+            return self.add_edge(start, frozenset([value]))
+        elif op == sre_constants.NOT_LITERAL:
+            return self.add_edge(start, ALL_CHARS - frozenset([value]))
+        elif op == sre_constants.ANY:
+            return self.add_edge(start, ALL_CHARS - frozenset([ord('\n')]))
+        elif op == sre_constants.IN:
+            return self.add_edge(start, charset(value))
+        elif op == sre_constants.SUBPATTERN:
+            # (group, pattern), or (group, add_flags, del_flags, pattern)
+            return self.add_pattern(value[-1], start)
+        elif op == sre_constants.BRANCH:
+            end = self.state()
+            for alternative in value[1]:
+                self.epsilon[self.add_pattern(alternative, start)].append(end)
+            return end
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, high, item = value
+            state = start
+            for _ in range(low):
+                state = self.add_pattern(item, state)
+            if high == sre_constants.MAXREPEAT:
+                loop = self.add_pattern(item, state)
+                self.epsilon[loop].append(state)
+                return state
+            end = self.state()
+            self.epsilon[state].append(end)
+            for _ in range(high - low):
+                state = self.add_pattern(item, state)
+                self.epsilon[state].append(end)
+            return end
+        else:
+            raise ValueError('unsupported regex feature in token expression: %s' % op)
+
+    def add_edge(self, start, chars):
+        end = self.state()
+        self.edges[start].append((chars, end))
+        return end
+
+    def closure(self, states):
+        stack = list(states)
+        seen = set(states)
+        while stack:
+            for state in self.epsilon[stack.pop()]:
+                if state not in seen:
+                    seen.add(state)
+                    stack.append(state)
+        return frozenset(seen)
+
+ALL_CHARS = frozenset(range(ALPHABET_SIZE))
+
+_categories = {
+    sre_constants.CATEGORY_DIGIT: frozenset(range(ord('0'), ord('9') + 1)),
+    sre_constants.CATEGORY_SPACE: frozenset(ord(c) for c in ' \t\n\r\f\v'),
+    sre_constants.CATEGORY_WORD: frozenset(ord(c) for c in
+        'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_'),
+}
+_categories[sre_constants.CATEGORY_NOT_DIGIT] = \
+    ALL_CHARS - _categories[sre_constants.CATEGORY_DIGIT]
+_categories[sre_constants.CATEGORY_NOT_SPACE] = \
+    ALL_CHARS - _categories[sre_constants.CATEGORY_SPACE]
+_categories[sre_constants.CATEGORY_NOT_WORD] = \
+    ALL_CHARS - _categories[sre_constants.CATEGORY_WORD]
+
+# The set of characters matched by a parsed `[...]` character set.
+def charset(items):
+    chars = set()
+    negate = False
+    for op, value in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            chars.add(value)
+        elif op == sre_constants.RANGE:
+            chars.update(range(value[0], value[1] + 1))
+        elif op == sre_constants.CATEGORY and value in _categories:
+            chars.update(_categories[value])
+        else:
+            raise ValueError('unsupported character set in token expression: %s' % op)
+    chars = frozenset(c for c in chars if c < ALPHABET_SIZE)
+    if negate:
+        return ALL_CHARS - chars
+    return chars
+
+# Splits the alphabet into classes of characters which no edge of `nfa`
+# tells apart. Returns a list mapping each character to its class number,
+# and one representative character per class.
+def character_classes(nfa):
+    signatures = {}
+    for chars in set(chars for edges in nfa.edges for chars, _ in edges):
+        for c in chars:
+            signatures.setdefault(c, []).append(chars)
+    classes = []
+    representatives = []
+    numbers = {}
+    for c in range(ALPHABET_SIZE):
+        signature = frozenset(signatures.get(c, []))
+        if signature not in numbers:
+            numbers[signature] = len(representatives)
+            representatives.append(c)
+        classes.append(numbers[signature])
+    return classes, representatives
+
+class DFA:
+    def __init__(self, token_exprs):
+        self.token_exprs = token_exprs
+        self.codes = []
+        for pattern, tag in token_exprs:
+            if tag:
+                self.codes.append(kind_code(tag, literal_text(pattern)))
+            else:
+                self.codes.append(None)
+        # keywords[rule] -> {keyword text: keyword kind code}
+        self.keywords = {}
+        keyword_rules = set()
+        for rule, table in find_keywords(token_exprs).items():
+            self.keywords[rule] = dict((text, self.codes[index])
+                                       for text, index in table.items())
+            keyword_rules.update(table.values())
+
+        nfa = NFA()
+        start = nfa.state()
+        for index, (pattern, tag) in enumerate(token_exprs):
+            if index in keyword_rules:
+                continue
+            rule_start = nfa.state()
+            nfa.epsilon[start].append(rule_start)
+            end = nfa.add_pattern(sre_parse.parse(pattern), rule_start)
+            nfa.accepts[end] = min(index, nfa.accepts.get(end, index))
+
+        self.classes, representatives = character_classes(nfa)
+        # transitions[state][character class] -> state, or -1 for no move
+        self.transitions = []
+        # accepts[state] -> token expression index, or None
+        self.accepts = []
+        states = {}
+        first = nfa.closure([start])
+        states[first] = 0
+        pending = [first]
+        while pending:
+            current = pending.pop(0)
+            row = []
+            for c in representatives:
+                targets = [target for state in current
+                                  for chars, target in nfa.edges[state]
+                                  if c in chars]
+                if not targets:
+                    row.append(-1)
+                    continue
+                target = nfa.closure(targets)
+                if target not in states:
+                    states[target] = len(states)
+                    pending.append(target)
+                row.append(states[target])
+            self.transitions.append(row)
+            rules = [nfa.accepts[state] for state in current if state in nfa.accepts]
+            self.accepts.append(min(rules) if rules else None)
+
+        # The table the lexer actually runs on: one dict per state mapping
+        # each character to the next state.
+        self.moves = []
+        for row in self.transitions:
+            moves = {}
+            for c in range(ALPHABET_SIZE):
+                target = row[self.classes[c]]
+                if target >= 0:
+                    moves[chr(c)] = target
+            self.moves.append(moves)
+
+    # Runs the DFA over `characters` from `pos`, stopping at `end`. Returns
+    # (rule, token end, scanned): the token expression of the longest match
+    # (None if nothing matches) and where it ends, and where the DFA stopped.
+    # A stop at `end` means a longer match might follow more input.
+    def match(self, characters, pos, end):
+        moves = self.moves
+        accepts = self.accepts
+        state = moves[0].get(characters[pos])
+        if state is None:
+            return None, pos, pos
+        i = pos + 1
+        rule = accepts[state]
+        token_end = i
+        while i < end:
+            state = moves[state].get(characters[i])
+            if state is None:
+                break
+            i += 1
+            if accepts[state] is not None:
+                rule = accepts[state]
+                token_end = i
+        return rule, token_end, i
+
+# Finds the keyword expressions in `token_exprs`. Returns a dict mapping the
+# index of the expression which would otherwise match a keyword (usually the
+# identifier expression) to a dict from keyword text to keyword index.
+def find_keywords(token_exprs):
+    keywords = {}
+    for index, (pattern, tag) in enumerate(token_exprs):
+        text = literal_text(pattern)
+        if text is None or not tag:
+            continue
+        for rule, (rule_pattern, rule_tag) in enumerate(token_exprs):
+            if literal_text(rule_pattern) is not None:
+                continue
+            if re.match('(?:%s)\\Z' % rule_pattern, text):
+                if rule > index and rule_tag:
+                    keywords.setdefault(rule, {})[text] = index
+                break
+    return keywords
+
+_dfa_cache = {}
+
+def compile_dfa(token_exprs):
+    key = tuple(tuple(token_expr) for token_expr in token_exprs)
+    dfa = _dfa_cache.get(key)
+    if dfa is None:
+        dfa = DFA(token_exprs)
+        _dfa_cache[key] = dfa
+    return dfa
+
+# Tokenizes a string or `mmap` into a `TokenStream`. `pos` and `end` limit
+# lexing to part of the source; token offsets are always relative to the
+# start of `characters`. See above for `errors`.
+def dfa_lex(characters, token_exprs, pos=0, end=None, errors=False):
+    dfa = compile_dfa(token_exprs)
+    moves = dfa.moves
+    accepts = dfa.accepts
+    codes = dfa.codes
+    keywords = dfa.keywords
+    start_moves = moves[0]
+    tokens = TokenStream(characters)
+    append = tokens.append
+    if end is None:
+        end = len(characters)
+    while pos < end:
+        state = start_moves.get(characters[pos])
+        rule = None
+        if state is not None:
+            i = pos + 1
+            rule = accepts[state]
+            token_end = i
+            while i < end:
+                state = moves[state].get(characters[i])
+                if state is None:
+                    break
+                i += 1
+                if accepts[state] is not None:
+                    rule = accepts[state]
+                    token_end = i
+        if rule is None:
+            if not errors:
+                raise LexerError(characters[pos], pos)
+            append(kind_code(ILLEGAL), pos, pos + 1)
+            pos += 1
+            continue
+        code = codes[rule]
+        if code is not None:
+            table = keywords.get(rule)
+            if table:
+                code = table.get(characters[pos:token_end], code)
+            append(code, pos, token_end)
+        pos = token_end
+    return tokens
+
+# Like `lexer.lex_stream`, yields (text, tag) tokens one at a time from a
+# string, `mmap` or file object (read `chunk_size` characters at a time), but
+# matching as `dfa_lex` does. A match which runs up to the end of what has
+# been read so far is tried again with more input before it is taken.
+def dfa_lex_stream(source, token_exprs, chunk_size=65536):
+    dfa = compile_dfa(token_exprs)
+    codes = dfa.codes
+    keywords = dfa.keywords
+    if isinstance(source, (basestring, mmap.mmap)):
+        buffer, read = source, None
+    else:
+        buffer, read = '', source.read
+    pos = 0
+    # Where `buffer` starts in the source
+    offset = 0
+    need_more = False
+    while True:
+        if read is not None and (need_more or len(buffer) - pos < chunk_size):
+            data = read(chunk_size)
+            if data:
+                offset += pos
+                buffer = buffer[pos:] + data
+                pos = 0
+            else:
+                read = None
+            need_more = False
+            continue
+        end = len(buffer)
+        if pos >= end:
+            return
+        rule, token_end, scanned = dfa.match(buffer, pos, end)
+        if read is not None and scanned == end:
+            need_more = True
+            continue
+        if rule is None:
+            raise LexerError(buffer[pos], offset + pos)
+        code = codes[rule]
+        if code is not None:
+            text = buffer[pos:token_end]
+            table = keywords.get(rule)
+            if table:
+                code = table.get(text, code)
+            yield (text, kind_tags[code])
+        pos = token_end
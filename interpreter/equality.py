@@ -1,7 +1,88 @@
-class Equality:
+# equality.py
+# -----------
+# Structural equality and hashing for AST nodes.
+#
+# A node class lists its fields in `__slots__`, so nodes carry no per-instance
+# `__dict__`. Two nodes are equal when they are the same object, or of the
+# same class with equal fields, compared one by one. A node's hash is
+# worked out from its class and fields the first time it is needed and kept
+# in the `_hash` slot, so nodes are cheap dictionary keys; nodes must not be
+# changed once they have been hashed.
+#
+# A node made by a `NodeTable` (see `imp_ast`) keeps the table in its
+# `_table` slot, which is None for other nodes; a node class's `__init__`
+# must set it. The table makes one node for each class and fields, so two
+# distinct nodes of the same table are never equal, and comparing them takes
+# constant time however deep they are. A table's node is also unequal to a
+# node whose hash is known and differs from its own. Other nodes go straight
+# to their fields, since looking for a hash which is usually not there costs
+# more than it saves.
+#
+# Slots whose names start with an underscore, like `_hash`, hold values
+# worked out from the fields and kept for later; they are not fields, and
+# take no part in equality. A class's fields are listed in its `fields`.
+#
+# `EqualityType` writes an `__eq__` and a `__hash__` using the fields of
+# each class when the class is defined, which is faster than looking up the
+# field names on every call.
+
+class EqualityType(type):
+    def __init__(cls, name, bases, namespace):
+        type.__init__(cls, name, bases, namespace)
+        fields = tuple(field for field in namespace.get('__slots__', ())
+                       if not field.startswith('_'))
+        cls.fields = fields
+        if fields and '__eq__' not in namespace:
+            cls.__eq__ = fields_function('__eq__', fields)
+        if fields and '__hash__' not in namespace:
+            cls.__hash__ = fields_function('__hash__', fields)
+
+fields_template = {
+    '__eq__': '''
+def __eq__(self, other):
+    if self is other:
+        return True
+    if other.__class__ is not self.__class__ and not isinstance(other, self.__class__):
+        return False
+    table = self._table
+    if table is not None:
+        if table is other._table:
+            return False
+        theirs = getattr(other, '_hash', None)
+        if theirs is not None and theirs != self._hash:
+            return False
+    return %(equal)s
+''',
+    '__hash__': '''
+def __hash__(self):
+    try:
+        return self._hash
+    except AttributeError:
+        self._hash = value = hash((self.__class__, %(self)s))
+        return value
+''',
+}
+
+# Returns the method `name` for a class with the given fields.
+def fields_function(name, fields):
+    source = fields_template[name] % {
+        'self': ', '.join('self.' + field for field in fields),
+        'other': ', '.join('other.' + field for field in fields),
+        'equal': ' and '.join('self.%s == other.%s' % (field, field) for field in fields),
+    }
+    namespace = {}
+    exec source in namespace
+    return namespace[name]
+
+class Equality(object):
+    __metaclass__ = EqualityType
+    __slots__ = ('_hash', '_table')
+
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and \
-               self.__dict__ == other.__dict__
+        return isinstance(other, self.__class__)
 
     def __ne__(self, other):
         return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.__class__)
@@ -0,0 +1,427 @@
+# grammar_compiler.py
+# -------------------
+# Compiles a combinator parser into Python source.
+#
+# A parser built from `combinators` is a graph of small objects, and parsing
+# makes at least one Python method call per node for every token it looks
+# at. `compile_parser` walks the graph once and generates a recursive
+# descent parser for it as plain Python functions, which does the same thing
+# with far fewer calls:
+#
+#   * `Tag` and `Reserved` checks are inlined as comparisons on the token.
+#   * `Seq`, `Concat`, `Process` and `Filter` are inlined into the function
+#     of the parser which uses them, so a whole statement rule becomes one
+#     function.
+#   * An `Alternate` chain is flattened, and each run of `Reserved`
+#     alternatives (like `any_operator_in_list`) becomes one dict lookup on
+#     the token.
+#   * `Lazy` parsers are resolved at compile time; they become plain calls.
+#   * A `Dispatch` checks the first token against the FIRST set of each
+#     choice before trying it.
+#
+# `Opt`, `Rep`, `Exp`, `Precedence`, `Alternate` and `Phrase` each get a
+# function of their own, with the operator lookup of a `Precedence` inlined.
+# Any other kind of parser (`Memo`, for example) is called as it is.
+#
+# Every parser function is generated twice: once working directly on the
+# kind codes of a `TokenStream`, and once for any other sequence of
+# (text, tag) tuples. The compiled parser picks one for each parse, so it
+# gives exactly the same results as the parser it was compiled from.
+#
+# The generated source only describes the shape of the grammar. Everything
+# else (`Process` functions, tags, kind codes, dispatch tables) is passed in
+# as a list of constants when the parser is built.
+
+from combinators import *
+from token_stream import *
+
+_header = '''# Generated by grammar_compiler.py. Do not edit.
+
+from token_stream import TokenStream, kind_texts, kind_tags, kind_tag_codes
+
+def token(t, pos):
+    try:
+        return t[pos]
+    except IndexError:
+        return None
+
+def build(C):
+'''
+
+# Whether some token can start both a choice with FIRST set `a` and one with
+# FIRST set `b`. A literal overlaps a tag if it has that tag.
+def overlap(a, b):
+    if a.always() or b.always():
+        return True
+    return bool(a.tags & b.tags) or bool(a.literals & b.literals) or \
+           any(tag in b.tags for text, tag in a.literals) or \
+           any(tag in a.tags for text, tag in b.literals)
+
+class GrammarCompiler:
+    def __init__(self):
+        self.constants = []
+        self.constant_names = {}
+        self.functions = {}     # id(parser) -> function name
+        self.pending = []
+        self.lazies = {}        # Lazy function -> the parser it resolves to
+        self.lines = []
+        self.temps = 0
+
+    # Returns the source of a module for `parser` and the constants its
+    # `build` function must be called with.
+    def compile(self, parser):
+        root = self.function(parser)
+        while self.pending:
+            node = self.pending.pop(0)
+            for stream in [True, False]:
+                self.stream = stream
+                self.node_function(node)
+        self.line(1, 'def parse(t, pos):')
+        self.line(2, 'if t.__class__ is TokenStream:')
+        self.line(3, 'return s_%s(t, t.codes, pos)' % root)
+        self.line(2, 'return g_%s(t, pos)' % root)
+        self.line(1, 'return parse')
+        unpack = ['    C%d = C[%d]' % (i, i) for i in range(len(self.constants))]
+        return _header + '\n'.join(unpack + self.lines) + '\n', self.constants
+
+    def line(self, indent, text):
+        self.lines.append('    ' * indent + text)
+
+    def temp(self):
+        self.temps += 1
+        return 'v%d' % self.temps
+
+    def constant(self, value):
+        if isinstance(value, int):
+            key = ('int', value)
+        else:
+            key = id(value)
+        if key not in self.constant_names:
+            self.constant_names[key] = 'C%d' % len(self.constants)
+            self.constants.append(value)
+        return self.constant_names[key]
+
+    # Every `Lazy` with the same function resolves to one parser, as in
+    # `combinators.memoize`.
+    def resolve(self, parser):
+        while isinstance(parser, Lazy):
+            function = parser.parser_func
+            if function not in self.lazies:
+                self.lazies[function] = parser.parser or function()
+            parser = self.lazies[function]
+        return parser
+
+    # The name (without the `s_` or `g_` prefix) of the function for
+    # `parser`, queueing it to be generated.
+    def function(self, parser):
+        parser = self.resolve(parser)
+        if id(parser) not in self.functions:
+            self.functions[id(parser)] = 'p%d' % len(self.functions)
+            self.pending.append(parser)
+        return self.functions[id(parser)]
+
+    # The name of the function for `parser` in the variant being generated.
+    def function_name(self, parser):
+        if self.stream:
+            return 's_' + self.function(parser)
+        return 'g_' + self.function(parser)
+
+    def call(self, parser, pos, *extra):
+        if self.stream:
+            arguments = ['t', 'codes', pos]
+        else:
+            arguments = ['t', pos]
+        return '%s(%s)' % (self.function_name(parser), ', '.join(arguments + list(extra)))
+
+    # For a `Tag` or `Reserved` parser, returns the statements to run first,
+    # a condition which is true if the token at `pos` matches, and an
+    # expression for the value.
+    def primitive(self, parser, pos):
+        if self.stream:
+            if isinstance(parser, Tag):
+                cond = '%s < len(codes) and kind_tag_codes[codes[%s]] == %s' % \
+                       (pos, pos, self.constant(parser.code))
+                return [], cond, 't.text(%s)' % pos
+            cond = '%s < len(codes) and (codes[%s] == %s or ' \
+                   '(codes[%s] == %s and t.text(%s) == %r))' % \
+                   (pos, pos, self.constant(parser.code), pos,
+                    self.constant(parser.tag_code), pos, parser.value)
+            return [], cond, repr(parser.value)
+        fetch = ['tok = token(t, %s)' % pos]
+        if isinstance(parser, Tag):
+            cond = 'tok is not None and tok[1] is %s' % self.constant(parser.tag)
+        else:
+            cond = 'tok is not None and tok[0] == %r and tok[1] is %s' % \
+                   (parser.value, self.constant(parser.tag))
+        return fetch, cond, 'tok[0]'
+
+    # Emits statements which apply `parser` at `pos` (a variable, which is
+    # advanced past the match) and store its value in `value`. On failure
+    # they run `fail`. `inlining` holds the parsers being inlined already, so
+    # cycles become calls.
+    def emit(self, parser, value, pos, fail, indent, inlining=()):
+        lazy = isinstance(parser, Lazy)
+        parser = self.resolve(parser)
+        if isinstance(parser, (Tag, Reserved)):
+            prefix, cond, expr = self.primitive(parser, pos)
+            for text in prefix:
+                self.line(indent, text)
+            self.line(indent, 'if not (%s):' % cond)
+            self.line(indent + 1, fail)
+            self.line(indent, '%s = %s' % (value, expr))
+            self.line(indent, '%s += 1' % pos)
+        elif not lazy and parser not in inlining and \
+             isinstance(parser, (Seq, Concat, Process, Filter)):
+            inlining = inlining + (parser,)
+            if isinstance(parser, Process):
+                item = self.temp()
+                self.emit(parser.parser, item, pos, fail, indent, inlining)
+                self.line(indent, '%s = %s(%s)' % (value, self.constant(parser.function), item))
+                return
+            if isinstance(parser, Filter):
+                self.emit(parser.parser, value, pos, fail, indent, inlining)
+                self.line(indent, 'if not %s(%s):' % (self.constant(parser.predicate), value))
+                self.line(indent + 1, fail)
+                return
+            if isinstance(parser, Seq):
+                items = parser.parsers
+            else:
+                items = (parser.left, parser.right)
+            names = []
+            for item in items:
+                names.append(self.temp())
+                self.emit(item, names[-1], pos, fail, indent, inlining)
+            self.line(indent, '%s = (%s)' % (value, ''.join(name + ', ' for name in names)))
+        else:
+            result = self.temp()
+            self.line(indent, '%s = %s' % (result, self.call(parser, pos)))
+            self.line(indent, 'if %s is None:' % result)
+            self.line(indent + 1, fail)
+            self.line(indent, '%s, %s = %s' % (value, pos, result))
+
+    # Emits a statement which returns the result of `parser` at `pos` if it
+    # matches, and otherwise carries on.
+    def emit_try(self, parser, pos, indent):
+        parser = self.resolve(parser)
+        if isinstance(parser, (Tag, Reserved)):
+            prefix, cond, expr = self.primitive(parser, pos)
+            for text in prefix:
+                self.line(indent, text)
+            self.line(indent, 'if %s:' % cond)
+            self.line(indent + 1, 'return (%s, %s + 1)' % (expr, pos))
+        else:
+            self.line(indent, 'r = %s' % self.call(parser, pos))
+            self.line(indent, 'if r is not None:')
+            self.line(indent + 1, 'return r')
+
+    def node_function(self, parser):
+        name = self.function_name(parser)
+        if self.stream:
+            arguments = 't, codes, pos'
+        else:
+            arguments = 't, pos'
+        if isinstance(parser, Precedence):
+            arguments += ', max_level=%d' % (len(parser.levels) - 1)
+        self.line(1, 'def %s(%s):' % (name, arguments))
+        if isinstance(parser, (Tag, Reserved, Seq, Concat, Process, Filter)):
+            self.emit(parser, 'v', 'pos', 'return None', 2)
+            self.line(2, 'return (v, pos)')
+        elif isinstance(parser, Alternate):
+            self.alternate(parser)
+        elif isinstance(parser, Opt):
+            self.emit_try(parser.parser, 'pos', 2)
+            self.line(2, 'return (None, pos)')
+        elif isinstance(parser, Rep):
+            self.line(2, 'values = []')
+            self.line(2, 'while True:')
+            self.line(3, 'p = pos')
+            self.emit(parser.parser, 'v', 'p', 'break', 3)
+            self.line(3, 'values.append(v)')
+            self.line(3, 'pos = p')
+            self.line(2, 'return (values, pos)')
+        elif isinstance(parser, Exp):
+            self.emit(parser.parser, 'v', 'pos', 'return None', 2)
+            self.line(2, 'while True:')
+            self.line(3, 'p = pos')
+            self.emit(parser.separator, 'f', 'p', 'break', 3)
+            self.emit(parser.parser, 'w', 'p', 'break', 3)
+            self.line(3, 'v = f(v, w)')
+            self.line(3, 'pos = p')
+            self.line(2, 'return (v, pos)')
+        elif isinstance(parser, Precedence):
+            self.precedence(parser)
+        elif isinstance(parser, Dispatch):
+            self.dispatch_choices(parser)
+        elif isinstance(parser, Phrase):
+            self.emit(parser.parser, 'v', 'pos', 'return None', 2)
+            if self.stream:
+                self.line(2, 'if pos < len(codes):')
+            else:
+                self.line(2, 'if token(t, pos) is not None:')
+            self.line(3, 'return None')
+            self.line(2, 'return (v, pos)')
+        else:
+            self.line(2, 'return %s.parse(t, pos)' % self.constant(parser))
+
+    # Precedence climbing, as in `Precedence.climb`. The function takes the
+    # loosest operator level it may consume as an extra argument.
+    def precedence(self, parser):
+        self.emit(parser.parser, 'v', 'pos', 'return None', 2)
+        self.line(2, 'min_level = 0')
+        self.line(2, 'while True:')
+        if self.stream:
+            self.line(3, 'if pos >= len(codes):')
+            self.line(4, 'break')
+            self.line(3, 'c = codes[pos]')
+            self.line(3, 'operator = %s.get(c)' % self.constant(parser.operator_codes))
+            self.line(3, 'if operator is None:')
+            self.line(4, 'if kind_texts[c] is not None:')
+            self.line(5, 'break')
+            self.line(4, 'text = t.text(pos)')
+            self.line(4, 'level = %s.get((text, kind_tags[c]))' %
+                      self.constant(parser.operator_levels))
+            self.line(4, 'if level is None:')
+            self.line(5, 'break')
+            self.line(3, 'else:')
+            self.line(4, 'level, text = operator')
+        else:
+            self.line(3, 'tok = token(t, pos)')
+            self.line(3, 'level = %s.get(tok)' % self.constant(parser.operator_levels))
+            self.line(3, 'if level is None:')
+            self.line(4, 'break')
+            self.line(3, 'text = tok[0]')
+        self.line(3, 'if level < min_level or level > max_level:')
+        self.line(4, 'break')
+        self.line(3, 'r = %s' % self.call(parser, 'pos + 1', 'level - 1'))
+        self.line(3, 'if r is None:')
+        self.line(4, 'break')
+        self.line(3, 'w = %s(text)(v, r[0])' % self.constant(parser.combine))
+        self.line(3, 'if w is None:')
+        self.line(4, 'break')
+        self.line(3, 'v = w')
+        self.line(3, 'pos = r[1]')
+        self.line(3, 'min_level = level')
+        self.line(2, 'return (v, pos)')
+
+    # A `Dispatch` becomes a guard on the first token for each choice, built
+    # from its FIRST set. A choice which no later choice can also start
+    # with returns directly.
+    def dispatch_choices(self, parser):
+        if parser.firsts is None:
+            parser.prepare()
+        guards = [self.guard(first) for first in parser.firsts]
+        if self.stream:
+            self.line(2, 'if pos < len(codes):')
+            self.line(3, 'c = codes[pos]')
+            self.line(3, 'tc = kind_tag_codes[c]')
+        else:
+            self.line(2, 'tok = token(t, pos)')
+            self.line(2, 'if tok is not None:')
+            self.line(3, 'tag = tok[1]')
+        firsts = parser.firsts
+        for index, (choice, guard) in enumerate(zip(parser.parsers, guards)):
+            exclusive = guard is not None and \
+                        not any(overlap(firsts[index], other)
+                                for other in firsts[index + 1:])
+            self.choice(choice, guard, exclusive, 3)
+        self.line(3, 'return None')
+        for choice, first in zip(parser.parsers, parser.firsts):
+            if first.always():
+                self.emit_try(choice, 'pos', 2)
+        self.line(2, 'return None')
+
+    # The kind codes and plain tag codes (or for token tuples, the tokens and
+    # tags) a choice with FIRST set `first` can start with. None if anything.
+    def guard(self, first):
+        if first.always():
+            return None
+        if self.stream:
+            codes = set(kind_code(tag, text) for text, tag in first.literals)
+            # Tokens of a plain tag kind are checked by text
+            codes.update(kind_code(tag) for text, tag in first.literals)
+            return frozenset(codes), frozenset(kind_code(tag) for tag in first.tags)
+        return frozenset(first.literals), frozenset(first.tags)
+
+    def choice(self, parser, guard, exclusive, indent):
+        if guard is not None:
+            conditions = []
+            key, tag_key = ('c', 'tc') if self.stream else ('tok', 'tag')
+            if guard[0]:
+                conditions.append('%s in %s' % (key, self.constant(guard[0])))
+            if guard[1]:
+                conditions.append('%s in %s' % (tag_key, self.constant(guard[1])))
+            if not conditions:
+                return
+            self.line(indent, 'if %s:' % ' or '.join(conditions))
+            indent += 1
+        if exclusive:
+            self.line(indent, 'return %s' % self.call(parser, 'pos'))
+        else:
+            self.emit_try(parser, 'pos', indent)
+
+    def alternate(self, parser):
+        alternatives = []
+        self.flatten(parser, alternatives)
+        index = 0
+        while index < len(alternatives):
+            run = index
+            while run < len(alternatives) and isinstance(alternatives[run], Reserved):
+                run += 1
+            if run - index < 2:
+                self.emit_try(alternatives[index], 'pos', 2)
+                index += 1
+                continue
+            self.dispatch(alternatives[index:run])
+            index = run
+        self.line(2, 'return None')
+
+    def flatten(self, parser, alternatives):
+        parser = self.resolve(parser)
+        if isinstance(parser, Alternate):
+            self.flatten(parser.left, alternatives)
+            self.flatten(parser.right, alternatives)
+        else:
+            alternatives.append(parser)
+
+    # A run of `Reserved` alternatives: at most one of them can match, so
+    # look the token up in a table instead of trying them in turn.
+    def dispatch(self, reserved):
+        if self.stream:
+            codes = {}
+            texts = {}    # plain tag code -> {text: value}
+            for parser in reserved:
+                codes.setdefault(parser.code, parser.value)
+                texts.setdefault(parser.tag_code, {}).setdefault(parser.value, parser.value)
+            self.line(2, 'if pos < len(codes):')
+            self.line(3, 'c = codes[pos]')
+            self.line(3, 'if c in %s:' % self.constant(codes))
+            self.line(4, 'return (%s[c], pos + 1)' % self.constant(codes))
+            self.line(3, 'if c in %s:' % self.constant(texts))
+            self.line(4, 'text = t.text(pos)')
+            self.line(4, 'if text in %s[c]:' % self.constant(texts))
+            self.line(5, 'return (text, pos + 1)')
+        else:
+            tokens = {}
+            for parser in reserved:
+                tokens.setdefault((parser.value, parser.tag), parser.tag)
+            self.line(2, 'tok = token(t, pos)')
+            self.line(2, 'if tok is not None and %s.get(tok, tok) is tok[1]:' %
+                      self.constant(tokens))
+            self.line(3, 'return (tok[0], pos + 1)')
+
+class CompiledParser(Parser):
+    def __init__(self, function, source):
+        self.function = function
+        self.source = source
+
+    def parse(self, tokens, pos):
+        return self.function(tokens, pos)
+
+# Compiles `parser` and returns an equivalent `CompiledParser`. Compiling
+# the IMP grammar takes about ten milliseconds, and `imp_parser` only does it
+# once per process (see `compiled_parser`).
+def compile_parser(parser):
+    source, constants = GrammarCompiler().compile(parser)
+    namespace = {'__name__': 'compiled_grammar'}
+    exec compile(source, '<compiled grammar>', 'exec') in namespace
+    return CompiledParser(namespace['build'](constants), source)
@@ -5,40 +5,64 @@
 # 2. Tokenizes target program.
 # 3. Builds a parser based on tokens.
 # 4. Builds AST based on Parser
-# 5. Stores final state of all assigned variables
+# 5. Compiles the AST into closures and runs it, storing the final state of
+#    all assigned variables (see `compile_program` in `imp_ast`)
 # 6. Prints out each variable and final state
+#
+# Steps 2 to 4 are skipped if the program has not changed since it was last
+# run: its AST is then read from the `__impcache__` directory next to it
+# (see `ast_cache`). With `-O`, the AST is optimized before it is run (see
+# `optimizer`); the temporary variables the optimizer adds are not printed.
+# `--outputs=x,y` says only the variables x and y matter: only they are
+# printed, and the optimizer removes work which only the others need.
 
 import sys
+import getopt
 from imp_parser import *
 from imp_lexer import *
+from dfa_lexer import LexerError
+from ast_cache import load_program
+from optimizer import optimize, remove_temporaries
 
 def usage():
-    sys.stderr.write('Usage: imp filename\n')
+    sys.stderr.write('Usage: imp [-O] [--outputs=name,...] filename\n')
     sys.exit(1)
 
 if __name__ == '__main__':
-    # Expects python imp.py <target program>
-    if len(sys.argv) != 2:
+    # Expects python imp.py [-O] [--outputs=name,...] <target program>
+    try:
+        options, args = getopt.getopt(sys.argv[1:], 'O', ['outputs='])
+    except getopt.GetoptError:
         usage()
-    filename = sys.argv[1]
+    if len(args) != 1:
+        usage()
+    optimizing = False
+    outputs = None
+    for option, value in options:
+        if option == '-O':
+            optimizing = True
+        else:
+            outputs = [name for name in value.split(',') if name]
+    filename = args[0]
     print filename
-    # Read target program
-    text = open(filename).read()
-    # Tokenize program
-    tokens = imp_lex(text)
-    # Attempt to consume tokens and build parse tree
-    parse_result = imp_parse(tokens)
-    print parse_result
-    if not parse_result:
+    # Tokenize and parse the target program, or load its cached AST
+    try:
+        ast = load_program(filename)
+    except LexerError as error:
+        sys.stderr.write('%s\n' % error)
+        sys.exit(1)
+    if not ast:
         sys.stderr.write('Parse error!\n')
         sys.exit(1)
-    # Build AST from parsed result to determine how to run target program
-    ast = parse_result.value
+    if optimizing:
+        ast = optimize(ast, outputs)
     print ast
     # Store values of all variables to print out later
     env = {}
-    ast.eval(env)
+    compile_program(ast)(env)
+    remove_temporaries(env)
 
     sys.stdout.write('Final variable values:\n')
     for name in env:
-        sys.stdout.write('%s: %s\n' % (name, env[name]))
+        if outputs is None or name in outputs:
+            sys.stdout.write('%s: %s\n' % (name, env[name]))
@@ -26,15 +26,60 @@
 #     classes won't do much except contain data. 
 #   * Include a __repr__ method for printing out the AST for debugging purposes.
 #   * All AST classes will subclass `Equality` so we can check if two AST objects
-#     are the same, to help with testing.
+#     are the same, to help with testing. Each class lists its fields in
+#     `__slots__`: a program can have millions of nodes, and a node without
+#     a `__dict__` takes a fraction of the memory.
+#
+# Running a program
+# -----------------
+# `eval(env)` walks the tree and is the reference for what a program means.
+# `compile_program(ast)` returns a function which does the same thing to an
+# `env` several times faster, by doing the work of looking at the tree once,
+# up front:
+#
+#   * Every variable is given a slot, an index in a list (the "frame") which
+#     holds the variables while the program runs, so reading or assigning
+#     one is a list index rather than a dict lookup by name. The frame is
+#     filled from `env` before running and copied back afterwards (see
+#     `Slots`).
+#   * Each node's `compile(slots)` turns it into a Python closure which
+#     takes the frame: statements return None and expressions return their
+#     value. Operators are resolved to functions from the `operator` module,
+#     children are compiled and captured by the closure, and constants and
+#     variables used as operands are read directly instead of through a
+#     closure of their own.
+#
+# `and` and `or`
+# --------------
+# By default `and` and `or` short-circuit, as in Python: the right side is
+# only evaluated when the left side does not decide the result, and the
+# value is the left side's when it does. IMP expressions have no side
+# effects, so this never changes what a program computes; the only
+# difference is that a right side which would fail (a division by zero or an
+# unknown operator) is skipped, so `x != 0 and 10 / x > 1` runs with `x` = 0.
+#
+# Setting `imp_ast.short_circuit` to False evaluates both sides every time,
+# which was IMP's original meaning, so that such programs fail instead.
+# `eval` looks at the setting as it runs; compiled programs (closures and
+# bytecode) use the setting in force when they were compiled.
+
+import operator
 
 from equality import *
 
+# Whether `and` and `or` skip their right side when the left decides; see
+# above.
+short_circuit = True
+
+# Whether loops which count are run over an `xrange`, or in closed form; see
+# "Counted loops" at the end.
+count_loops = True
+
 class Statement(Equality):
-    pass
+    __slots__ = ()
 
 class Aexp(Equality):
-    pass
+    __slots__ = ()
 
 # Boolean expressions are the next on our list. There are four kinds of 
 # Boolean expressions.
@@ -50,14 +95,17 @@ class Aexp(Equality):
 #
 #                                   X < 10 and 30
 class Bexp(Equality):
-    pass
+    __slots__ = ()
 
 # Next we focus on statements, which can contain both arithmetic and boolean expressions.
 # There are four kinds of statements: assignment, compound, conditional and loops.
 class AssignStatement(Statement):
+    __slots__ = ('name', 'aexp')
+
     def __init__(self, name, aexp):
         self.name = name
         self.aexp = aexp
+        self._table = None
 
     def __repr__(self):
         return 'AssignStatement(%s, %s)' % (self.name, self.aexp)
@@ -66,10 +114,43 @@ class AssignStatement(Statement):
         value = self.aexp.eval(env)
         env[self.name] = value
 
+    def compile(self, slots):
+        slot = slots.slot(self.name)
+        aexp = self.aexp
+        if aexp.__class__ is BinopAexp and aexp.op in binop_functions:
+            # The commonest statement, `x := y op z`, in one closure
+            op = binop_functions[aexp.op]
+            left_kind, left = compile_operand(aexp.left, slots)
+            right_kind, right = compile_operand(aexp.right, slots)
+            if left_kind == 'var' and right_kind == 'int':
+                def assign(frame):
+                    frame[slot] = op(frame[left], right)
+                return assign
+            elif left_kind == 'var' and right_kind == 'var':
+                def assign(frame):
+                    frame[slot] = op(frame[left], frame[right])
+                return assign
+        kind, aexp = compile_operand(aexp, slots)
+        if kind == 'int':
+            def assign(frame):
+                frame[slot] = aexp
+        elif kind == 'var':
+            # A copy of a variable which is unassigned is 0
+            def assign(frame):
+                value = frame[aexp]
+                frame[slot] = value if value is not unassigned else 0
+        else:
+            def assign(frame):
+                frame[slot] = aexp(frame)
+        return assign
+
 class CompoundStatement(Statement):
+    __slots__ = ('first', 'second')
+
     def __init__(self, first, second):
         self.first = first
         self.second = second
+        self._table = None
 
     def __repr__(self):
         return 'CompoundStatement(%s, %s)' % (self.first, self.second)
@@ -78,11 +159,50 @@ class CompoundStatement(Statement):
         self.first.eval(env)
         self.second.eval(env)
 
+    def compile(self, slots):
+        return BlockStatement([self.first, self.second]).compile(slots)
+
+# A sequence of statements, such as a whole program. Parsing `a; b; c` used
+# to give `CompoundStatement(CompoundStatement(a, b), c)`, which nests one
+# level deeper for every statement, so evaluating or printing a long program
+# recursed once per statement. A `BlockStatement` keeps the statements in
+# one flat list and runs them in a loop.
+class BlockStatement(Statement):
+    __slots__ = ('statements',)
+
+    def __init__(self, statements):
+        self.statements = statements
+        self._table = None
+
+    def __repr__(self):
+        return 'BlockStatement(%s)' % self.statements
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = value = hash((BlockStatement, tuple(self.statements)))
+            return value
+
+    def eval(self, env):
+        for statement in self.statements:
+            statement.eval(env)
+
+    def compile(self, slots):
+        statements = tuple(statement.compile(slots) for statement in self.statements)
+        def block(frame):
+            for statement in statements:
+                statement(frame)
+        return block
+
 class IfStatement(Statement):
+    __slots__ = ('condition', 'true_stmt', 'false_stmt')
+
     def __init__(self, condition, true_stmt, false_stmt):
         self.condition = condition
         self.true_stmt = true_stmt
         self.false_stmt = false_stmt
+        self._table = None
 
     def __repr__(self):
         return 'IfStatement(%s, %s, %s)' % (self.condition, self.true_stmt, self.false_stmt)
@@ -95,23 +215,70 @@ class IfStatement(Statement):
             if self.false_stmt:
                 self.false_stmt.eval(env)
 
+    def compile(self, slots):
+        condition = self.condition.compile(slots)
+        true_stmt = self.true_stmt.compile(slots)
+        if self.false_stmt:
+            false_stmt = self.false_stmt.compile(slots)
+            def if_else(frame):
+                if condition(frame):
+                    true_stmt(frame)
+                else:
+                    false_stmt(frame)
+            return if_else
+        def if_then(frame):
+            if condition(frame):
+                true_stmt(frame)
+        return if_then
+
 class WhileStatement(Statement):
+    __slots__ = ('condition', 'body', '_counted')
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
+        self._table = None
 
     def __repr__(self):
         return 'WhileStatement(%s, %s)' % (self.condition, self.body)
 
     def eval(self, env):
+        if count_loops:
+            counted = self.counted()
+            if counted is not None and counted.eval(env):
+                return
         condition_value = self.condition.eval(env)
         while condition_value:
             self.body.eval(env)
             condition_value = self.condition.eval(env)
 
+    def compile(self, slots):
+        condition = self.condition.compile(slots)
+        body = self.body.compile(slots)
+        def loop(frame):
+            while condition(frame):
+                body(frame)
+        if count_loops:
+            counted = self.counted()
+            if counted is not None:
+                return counted.compile(slots, loop)
+        return loop
+
+    # The `CountedLoop` for this loop, or None if it doesn't count (see
+    # "Counted loops" below). Worked out the first time it is needed.
+    def counted(self):
+        try:
+            return self._counted
+        except AttributeError:
+            self._counted = counted = counted_loop(self)
+            return counted
+
 class IntAexp(Aexp):
+    __slots__ = ('i',)
+
     def __init__(self, i):
         self.i = i
+        self._table = None
 
     def __repr__(self):
         return 'IntAexp(%d)' % self.i
@@ -119,9 +286,15 @@ class IntAexp(Aexp):
     def eval(self, env):
         return self.i
 
+    def compile(self, slots):
+        return operand_closure('int', self.i)
+
 class VarAexp(Aexp):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
+        self._table = None
 
     def __repr__(self):
         return 'VarAexp(%s)' % self.name
@@ -132,11 +305,17 @@ class VarAexp(Aexp):
         else:
             return 0
 
+    def compile(self, slots):
+        return operand_closure('var', slots.slot(self.name))
+
 class BinopAexp(Aexp):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
+        self._table = None
 
     def __repr__(self):
         return 'BinopAexp(%s, %s, %s)' % (self.op, self.left, self.right)
@@ -156,11 +335,18 @@ class BinopAexp(Aexp):
             raise RuntimeError('unknown operator: ' + self.op)
         return value
 
+    def compile(self, slots):
+        op = binop_functions.get(self.op) or unknown_operator(self.op)
+        return compile_binary(op, self.left, self.right, slots)
+
 class RelopBexp(Bexp):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
+        self._table = None
 
     def __repr__(self):
         return 'RelopBexp(%s, %s, %s)' % (self.op, self.left, self.right)
@@ -184,35 +370,78 @@ class RelopBexp(Bexp):
             raise RuntimeError('unknown operator: ' + self.op)
         return value
 
+    def compile(self, slots):
+        op = relop_functions.get(self.op) or unknown_operator(self.op)
+        return compile_binary(op, self.left, self.right, slots)
+
 class AndBexp(Bexp):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
+        self._table = None
 
     def __repr__(self):
         return 'AndBexp(%s, %s)' % (self.left, self.right)
 
     def eval(self, env):
         left_value = self.left.eval(env)
+        if short_circuit and not left_value:
+            return left_value
         right_value = self.right.eval(env)
         return left_value and right_value
 
+    def compile(self, slots):
+        left = self.left.compile(slots)
+        right = self.right.compile(slots)
+        if short_circuit:
+            def and_bexp(frame):
+                return left(frame) and right(frame)
+        else:
+            def and_bexp(frame):
+                left_value = left(frame)
+                right_value = right(frame)
+                return left_value and right_value
+        return and_bexp
+
 class OrBexp(Bexp):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
+        self._table = None
 
     def __repr__(self):
         return 'OrBexp(%s, %s)' % (self.left, self.right)
 
     def eval(self, env):
         left_value = self.left.eval(env)
+        if short_circuit and left_value:
+            return left_value
         right_value = self.right.eval(env)
         return left_value or right_value
 
+    def compile(self, slots):
+        left = self.left.compile(slots)
+        right = self.right.compile(slots)
+        if short_circuit:
+            def or_bexp(frame):
+                return left(frame) or right(frame)
+        else:
+            def or_bexp(frame):
+                left_value = left(frame)
+                right_value = right(frame)
+                return left_value or right_value
+        return or_bexp
+
 class NotBexp(Bexp):
+    __slots__ = ('exp',)
+
     def __init__(self, exp):
         self.exp = exp
+        self._table = None
 
     def __repr__(self):
         return 'NotBexp(%s)' % self.exp
@@ -220,3 +449,403 @@ class NotBexp(Bexp):
     def eval(self, env):
         value = self.exp.eval(env)
         return not value
+
+    def compile(self, slots):
+        exp = self.exp.compile(slots)
+        def not_bexp(frame):
+            return not exp(frame)
+        return not_bexp
+
+binop_functions = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.div,
+}
+
+relop_functions = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '!=': operator.ne,
+}
+
+# Hash-consing
+# ------------
+# Generated programs repeat the same small expressions (`x + 1`, `i < n`)
+# over and over. A `NodeTable` makes nodes which share such subtrees: `make`
+# returns the node it made before for the same class and fields, if any, so
+# identical nodes are one object. Since their children are shared too, a
+# node is looked up by its fields in constant time (nodes keep their hash,
+# see `equality`), and two shared nodes are equal exactly when they are the
+# same object, so passes over shared nodes can compare them with `is` and
+# use them as keys. `==` on two nodes of the same table does just that (see
+# `equality`). `imp_parse` makes its nodes through a table when given
+# one.
+class NodeTable:
+    def __init__(self):
+        self.nodes = {}
+
+    def make(self, cls, *fields):
+        if cls is BlockStatement:
+            key = (cls, tuple(fields[0]))
+        else:
+            key = (cls,) + fields
+        node = self.nodes.get(key)
+        if node is None:
+            node = cls(*fields)
+            hash(node)
+            node._table = self
+            self.nodes[key] = node
+        return node
+
+    def __len__(self):
+        return len(self.nodes)
+
+# Compiling
+# ---------
+
+# Returns a function which runs `ast` on an `env`, like `ast.eval(env)`.
+def compile_program(ast):
+    slots = Slots()
+    function = ast.compile(slots)
+    def run(env):
+        frame = slots.frame(env)
+        function(frame)
+        slots.store(frame, env)
+    return run
+
+# A variable which has never been assigned reads as 0, but unlike a
+# variable assigned 0 it must not show up in the final `env`. Its slot holds
+# `unassigned`, a 0 which can be told apart by identity. Arithmetic on it
+# gives plain ints, so it can only get into another slot by being copied
+# (`x := y`), and copies check for it.
+class Unassigned(int):
+    def __repr__(self):
+        return 'unassigned'
+
+unassigned = Unassigned(0)
+
+# The slots of the variables of a program, numbered in order of first use.
+class Slots:
+    def __init__(self):
+        self.names = []
+        self.indices = {}
+
+    def slot(self, name):
+        if name not in self.indices:
+            self.indices[name] = len(self.names)
+            self.names.append(name)
+        return self.indices[name]
+
+    # A frame holding the variables in `env`.
+    def frame(self, env):
+        return [env.get(name, unassigned) for name in self.names]
+
+    # Copies the assigned variables in `frame` back into `env`.
+    def store(self, frame, env):
+        for name, value in zip(self.names, frame):
+            if value is not unassigned:
+                env[name] = value
+
+# Reports an unknown operator when it is run, the way `eval` does.
+def unknown_operator(op):
+    def fail(*args):
+        raise RuntimeError('unknown operator: ' + op)
+    return fail
+
+# Compiles an operand, returning (kind, value): ('int', value) for a
+# constant, ('var', slot) for a variable and ('closure', function)
+# otherwise, so that binary operators can read the first two directly.
+def compile_operand(aexp, slots):
+    if aexp.__class__ is IntAexp:
+        return 'int', aexp.i
+    if aexp.__class__ is VarAexp:
+        return 'var', slots.slot(aexp.name)
+    return 'closure', aexp.compile(slots)
+
+# Compiles `op(left, right)` where `op` is a function of two values.
+def compile_binary(op, left, right, slots):
+    left_kind, left = compile_operand(left, slots)
+    right_kind, right = compile_operand(right, slots)
+    if left_kind == 'var' and right_kind == 'int':
+        def binary(frame):
+            return op(frame[left], right)
+    elif left_kind == 'var' and right_kind == 'var':
+        def binary(frame):
+            return op(frame[left], frame[right])
+    elif left_kind == 'closure' and right_kind == 'int':
+        def binary(frame):
+            return op(left(frame), right)
+    else:
+        left = operand_closure(left_kind, left)
+        right = operand_closure(right_kind, right)
+        def binary(frame):
+            return op(left(frame), right(frame))
+    return binary
+
+# The closure for an operand returned by `compile_operand`.
+def operand_closure(kind, value):
+    if kind == 'int':
+        return lambda frame: value
+    elif kind == 'var':
+        return lambda frame: frame[value]
+    return value
+
+# Walking ASTs
+# ------------
+
+def children(node):
+    if node.__class__ is BlockStatement:
+        return node.statements
+    return [node.first, node.second]
+
+# Returns `statements` with the statements of blocks among them in their
+# place.
+def flatten(statements):
+    flat = []
+    for statement in statements:
+        if statement.__class__ is BlockStatement:
+            flat.extend(statement.statements)
+        else:
+            flat.append(statement)
+    return flat
+
+# The names of the variables a statement assigns.
+def assigned_variables(node):
+    names = set()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        kind = node.__class__
+        if kind is AssignStatement:
+            names.add(node.name)
+        elif kind is BlockStatement or kind is CompoundStatement:
+            pending.extend(children(node))
+        elif kind is IfStatement:
+            pending.append(node.true_stmt)
+            if node.false_stmt:
+                pending.append(node.false_stmt)
+        elif kind is WhileStatement:
+            pending.append(node.body)
+    return names
+
+# The names of the variables an expression reads.
+def variables(node):
+    return set(aexp.name for aexp in subexpressions(node) if aexp.__class__ is VarAexp)
+
+# Every arithmetic subexpression of an expression (itself included), outer
+# ones first. For a condition, those of the arithmetic expressions in it.
+def subexpressions(node):
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        kind = node.__class__
+        if kind is BinopAexp or kind is IntAexp or kind is VarAexp:
+            yield node
+        if kind is NotBexp:
+            pending.append(node.exp)
+        elif kind is not IntAexp and kind is not VarAexp:
+            pending.append(node.right)
+            pending.append(node.left)
+
+# Counted loops
+# -------------
+# Most loops count: `i := 0; while i < n do ...; i := i + 1 end`. Rather than
+# evaluating `i < n` and `i + 1` every time round, such a loop is run as a
+# Python loop over an `xrange`. A `WhileStatement` counts when:
+#
+#   * its condition compares a variable (the counter) with `<`, `<=`, `>` or
+#     `>=` to an expression (the bound), either way round;
+#   * the last statement of its body adds a constant to the counter, or
+#     subtracts one, going towards the bound;
+#   * nothing else in the body assigns the counter or a variable the bound
+#     reads, so the bound is the same every time round and is worked out
+#     once.
+#
+# The counter is set to each value in turn before the rest of the body runs,
+# and is left one step past the last value, as the loop itself would leave
+# it.
+#
+# When the rest of the body only adds to or subtracts from variables
+# (`s := s + k`), and what it adds is a constant, a variable the body does
+# not assign or the counter itself, the loop is not run at all: the number of
+# iterations is worked out from the counter, bound and step, and from that
+# the totals.
+#
+# Any other loop, or a counted loop whose values don't fit in an `xrange`,
+# runs as it is. Setting `imp_ast.count_loops` to False runs every loop as
+# it is. Like `short_circuit`, `eval` looks at it as it runs and compiled
+# programs when they are compiled.
+
+# For each comparison a counted loop can make: the same comparison with its
+# sides swapped, and what to add to the bound to get where `xrange` stops.
+counted_relops = {
+    '<': ('>', 0),
+    '<=': ('>=', 1),
+    '>': ('<', 0),
+    '>=': ('<=', -1),
+}
+
+class CountedLoop:
+    # `sums` is a list of (variable, sign, operand), each adding
+    # `sign * operand` to `variable` every time round, with an operand of
+    # None standing for the counter; or None if the body does anything else.
+    def __init__(self, name, bound, offset, step, body, sums):
+        self.name = name
+        self.bound = bound
+        self.offset = offset
+        self.step = step
+        self.body = body
+        self.sums = sums
+
+    def __repr__(self):
+        return 'CountedLoop(%s, %s, %d, %d, %s, %r)' % \
+               (self.name, self.bound, self.offset, self.step, self.body, self.sums)
+
+    # Runs the loop on `env`, returning False, having done nothing, if it
+    # can't be run this way.
+    def eval(self, env):
+        name = self.name
+        step = self.step
+        start = env.get(name, 0)
+        stop = self.bound.eval(env) + self.offset
+        if self.sums is not None:
+            count = iterations(start, stop, step)
+            if count:
+                for target, sign, operand in self.sums:
+                    value = operand and operand.eval(env)
+                    env[target] = env.get(target, 0) + sign * total(start, step, count, value)
+                env[name] = start + count * step
+            return True
+        try:
+            values = xrange(start, stop, step)
+        except OverflowError:
+            return False
+        body = self.body
+        for value in values:
+            env[name] = value
+            body.eval(env)
+        if values:
+            env[name] = values[-1] + step
+        return True
+
+    # Returns a closure running the loop on a frame, which runs `loop` (the
+    # loop compiled as it is) when it can't be run this way.
+    def compile(self, slots, loop):
+        index = slots.slot(self.name)
+        bound = self.bound.compile(slots)
+        offset = self.offset
+        step = self.step
+        if self.sums is not None:
+            sums = [(slots.slot(target), sign, operand and operand.compile(slots))
+                    for target, sign, operand in self.sums]
+            def counted_sums(frame):
+                start = frame[index]
+                count = iterations(start, bound(frame) + offset, step)
+                if count:
+                    for target, sign, operand in sums:
+                        value = operand and operand(frame)
+                        frame[target] = frame[target] + sign * total(start, step, count, value)
+                    frame[index] = start + count * step
+            return counted_sums
+        body = self.body.compile(slots)
+        def counted_loop(frame):
+            stop = bound(frame) + offset
+            try:
+                values = xrange(frame[index], stop, step)
+            except OverflowError:
+                loop(frame)
+                return
+            for value in values:
+                frame[index] = value
+                body(frame)
+            if values:
+                frame[index] = values[-1] + step
+        return counted_loop
+
+# The number of values in `xrange(start, stop, step)`, for any integers.
+def iterations(start, stop, step):
+    return max(0, -((start - stop) // step))
+
+# The total of `value` over `count` iterations, or of the counter if `value`
+# is None.
+def total(start, step, count, value):
+    if value is None:
+        return count * start + step * (count * (count - 1) // 2)
+    return count * value
+
+# Returns the `CountedLoop` for a `WhileStatement`, or None.
+def counted_loop(loop):
+    condition = loop.condition
+    if condition.__class__ is not RelopBexp or condition.op not in counted_relops:
+        return None
+    statements = flatten([loop.body])
+    if not statements:
+        return None
+    body = BlockStatement(statements[:-1])
+    assigned = assigned_variables(body)
+    swapped = counted_relops[condition.op][0]
+    for counter, op, bound in [(condition.left, condition.op, condition.right),
+                               (condition.right, swapped, condition.left)]:
+        if counter.__class__ is not VarAexp or counter.name in assigned:
+            continue
+        name = counter.name
+        step = counter_step(statements[-1], name)
+        if step is None or (step > 0) != (op in ('<', '<=')):
+            continue
+        bound_variables = variables(bound)
+        if name in bound_variables or bound_variables & assigned:
+            continue
+        return CountedLoop(name, bound, counted_relops[op][1], step, body,
+                           loop_sums(body.statements, name, assigned))
+    return None
+
+# The constant `statement` adds to the variable `name` (3 for
+# `name := name + 3`, -1 for `name := name - 1`), or None.
+def counter_step(statement, name):
+    if statement.__class__ is not AssignStatement or statement.name != name:
+        return None
+    change = addition(statement.aexp, name)
+    if change is None:
+        return None
+    sign, operand = change
+    if operand.__class__ is not IntAexp or operand.i == 0:
+        return None
+    return sign * operand.i
+
+# Returns (sign, operand) if `aexp` is `name + operand`, `operand + name` or
+# `name - operand` (with a sign of -1), or None.
+def addition(aexp, name):
+    if aexp.__class__ is not BinopAexp:
+        return None
+    left = aexp.left
+    right = aexp.right
+    if left.__class__ is VarAexp and left.name == name and aexp.op in ('+', '-'):
+        return (1 if aexp.op == '+' else -1), right
+    if right.__class__ is VarAexp and right.name == name and aexp.op == '+':
+        return 1, left
+    return None
+
+# The sums (see `CountedLoop`) of a loop body which only adds constants,
+# variables it does not assign and the counter to variables; or None.
+def loop_sums(statements, counter, assigned):
+    sums = []
+    for statement in statements:
+        if statement.__class__ is not AssignStatement:
+            return None
+        change = addition(statement.aexp, statement.name)
+        if change is None:
+            return None
+        sign, operand = change
+        if operand.__class__ is VarAexp and operand.name == counter:
+            operand = None
+        elif operand.__class__ is VarAexp:
+            if operand.name in assigned:
+                return None
+        elif operand.__class__ is not IntAexp:
+            return None
+        sums.append((statement.name, sign, operand))
+    return sums
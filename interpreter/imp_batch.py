@@ -0,0 +1,276 @@
+# imp_batch.py
+# ------------
+# Runs one IMP program over many inputs at once, with NumPy.
+#
+# A parameter sweep runs the same program on a great many `env`s. Rather
+# than walking the tree once for each, `run_batch(ast, columns)` takes the
+# inputs as columns, a NumPy array per variable with one value per input
+# (a "lane"), and walks the tree once, working on whole columns:
+#
+#   * Arithmetic and comparisons are NumPy element-wise operations (`/` is
+#     `floor_divide`, which rounds down like Python 2's `/` on ints).
+#   * Statements run under a mask of the lanes they apply to. An assignment
+#     only changes the masked lanes; an `if` runs each branch for the lanes
+#     taking it; a `while` runs its body for the lanes whose condition holds,
+#     dropping lanes as their condition fails, until no lane is left.
+#
+# The result is a column for each variable, matching lane for lane what
+# `eval` leaves in the `env` for that lane's input. A variable which some
+# lanes never assign is a `numpy.ma` masked array, masked in those lanes,
+# and `lane(columns, index)` gives one lane's variables as an `env`.
+#
+# Errors are raised, as by `eval`, when a lane running the expression would
+# fail: dividing by zero in a lane which doesn't get there is not an error.
+# `and` and `or` follow `imp_ast.short_circuit`.
+#
+# Integer columns are worked on as int64, which is fast but can't hold every
+# result: where `eval` would go on to a long, an int64 wraps around. So each
+# `+`, `-`, `*` and `/` which might overflow is checked in the lanes running
+# it, and if any lane overflowed the operation is done again on Python ints
+# (a column of `dtype=object`). Everything worked out from that value is
+# then Python ints too, and so is the column of any variable it is assigned
+# to, so results still match `eval` lane for lane, only more slowly. An
+# unsigned 64 bit column, which doesn't fit in an int64, is worked on as
+# Python ints from the start.
+#
+# Checking every lane of every operation would cost more than the operation,
+# so the evaluator keeps a bound on the absolute value of each variable, and
+# works out from them a bound on each expression (`|a + b| <= |a| + |b|`,
+# and so on). Only an operation whose bound doesn't fit in an int64 looks at
+# its operands' values, and only if those could overflow too is each lane
+# checked.
+#
+# NumPy is only needed to run this module's functions; without it `numpy`
+# is None and they raise RuntimeError.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import imp_ast
+from imp_ast import *
+
+if numpy is not None:
+    batch_binop_functions = {
+        '+': numpy.add,
+        '-': numpy.subtract,
+        '*': numpy.multiply,
+        '/': numpy.floor_divide,
+    }
+    batch_relop_functions = {
+        '<': numpy.less,
+        '<=': numpy.less_equal,
+        '>': numpy.greater,
+        '>=': numpy.greater_equal,
+        '=': numpy.equal,
+        '!=': numpy.not_equal,
+    }
+
+class BatchEvaluator:
+    def __init__(self, columns, size):
+        self.size = size
+        self.values = {}
+        self.assigned = {}
+        # A bound on the absolute value of each variable in any lane
+        self.bounds = {}
+        for name, column in columns.items():
+            if column.dtype.kind == 'u' and column.dtype.itemsize >= 8:
+                column = column.astype(object)
+            elif column.dtype.kind in 'iu':
+                column = column.astype(numpy.int64)
+            self.values[name] = column
+            self.assigned[name] = numpy.ones(size, dtype=bool)
+            self.bounds[name] = magnitude(column) if column.dtype.kind == 'i' else 0
+        self.dtype = numpy.result_type(*self.values.values())
+
+    def statement(self, node, active):
+        kind = node.__class__
+        if kind is AssignStatement:
+            name = node.name
+            value = self.expression(node.aexp, active)
+            if name not in self.values:
+                self.values[name] = numpy.zeros(self.size, dtype=self.dtype)
+                self.assigned[name] = numpy.zeros(self.size, dtype=bool)
+            self.values[name] = numpy.where(active, value, self.values[name])
+            self.assigned[name] = self.assigned[name] | active
+            bound = max(self.bounds.get(name, 0), self.bound(node.aexp))
+            if bound > int64_max and self.values[name].dtype.kind == 'i':
+                # Worth finding the real one
+                bound = magnitude(self.values[name])
+            self.bounds[name] = bound
+        elif kind is BlockStatement:
+            for statement in node.statements:
+                self.statement(statement, active)
+        elif kind is CompoundStatement:
+            self.statement(node.first, active)
+            self.statement(node.second, active)
+        elif kind is IfStatement:
+            condition = self.condition(node.condition, active)
+            taken = active & condition
+            if taken.any():
+                self.statement(node.true_stmt, taken)
+            if node.false_stmt:
+                taken = active & ~condition
+                if taken.any():
+                    self.statement(node.false_stmt, taken)
+        elif kind is WhileStatement:
+            running = active & self.condition(node.condition, active)
+            while running.any():
+                self.statement(node.body, running)
+                running = running & self.condition(node.condition, running)
+        else:
+            raise RuntimeError('cannot run statement: %r' % node)
+
+    # The value of an expression, a column or a single value for every lane.
+    # Only the `active` lanes' values are used.
+    def expression(self, node, active):
+        kind = node.__class__
+        if kind is IntAexp:
+            return node.i
+        elif kind is VarAexp:
+            if node.name in self.values:
+                return self.values[node.name]
+            return 0
+        elif kind is BinopAexp or kind is RelopBexp:
+            functions = batch_binop_functions if kind is BinopAexp else batch_relop_functions
+            left = self.expression(node.left, active)
+            right = self.expression(node.right, active)
+            if node.op not in functions:
+                raise RuntimeError('unknown operator: ' + node.op)
+            if node.op == '/':
+                zero = numpy.asarray(numpy.equal(right, 0), dtype=bool)
+                if (zero & active).any():
+                    raise ZeroDivisionError('integer division or modulo by zero')
+                right = numpy.where(zero, 1, right)
+            if kind is RelopBexp:
+                return functions[node.op](left, right)
+            return self.arithmetic(node, left, right, active)
+        elif kind is AndBexp or kind is OrBexp:
+            left = self.condition(node.left, active)
+            if imp_ast.short_circuit:
+                # Only the lanes which the left side doesn't decide go on
+                undecided = active & (left if kind is AndBexp else ~left)
+                if not undecided.any():
+                    return left
+            else:
+                undecided = active
+            right = self.condition(node.right, undecided)
+            if kind is AndBexp:
+                return left & right
+            return left | right
+        elif kind is NotBexp:
+            return ~self.condition(node.exp, active)
+        else:
+            raise RuntimeError('cannot run expression: %r' % node)
+
+    # Applies an arithmetic operator, on Python ints if the result overflows
+    # in an active lane (see above). The operands are only looked at if the
+    # expression's bound doesn't fit in an int64.
+    def arithmetic(self, node, left, right, active):
+        op = node.op
+        function = batch_binop_functions[op]
+        with numpy.errstate(over='ignore', divide='ignore'):
+            result = function(left, right)
+            if numpy.asarray(result).dtype.kind != 'i' or self.bound(node) <= int64_max or \
+               operation_bound(op, magnitude(left), magnitude(right)) <= int64_max or \
+               not (overflows(op, left, right, result) & active).any():
+                return result
+        return function(python_ints(left), python_ints(right))
+
+    # A bound on the absolute value of an arithmetic expression in any lane.
+    def bound(self, node):
+        kind = node.__class__
+        if kind is IntAexp:
+            return abs(node.i)
+        elif kind is VarAexp:
+            return self.bounds.get(node.name, 0)
+        elif kind is BinopAexp:
+            return operation_bound(node.op, self.bound(node.left), self.bound(node.right))
+        return 1
+
+    # The truth value of a condition in every lane, as an array of bools.
+    def condition(self, node, active):
+        return numpy.asarray(self.expression(node, active), dtype=bool)
+
+    # The columns of the variables after running, as described above.
+    def columns(self):
+        columns = {}
+        for name, values in self.values.items():
+            assigned = self.assigned[name]
+            if assigned.all():
+                columns[name] = numpy.asarray(values)
+            elif assigned.any():
+                columns[name] = numpy.ma.masked_array(values, mask=~assigned)
+        return columns
+
+int64_max = 2 ** 63 - 1 if numpy is None else int(numpy.iinfo(numpy.int64).max)
+
+# A bound on the absolute value of `op` applied to values with absolute
+# values up to `left` and `right`.
+def operation_bound(op, left, right):
+    if op == '*':
+        return left * right
+    elif op == '/':
+        # Rounding down never takes the quotient past the dividend
+        return left
+    return left + right
+
+# The lanes in which `result`, the fixed size integer result of `op` on
+# `left` and `right`, has wrapped around. Call with overflow warnings off.
+def overflows(op, left, right, result):
+    minimum = numpy.iinfo(numpy.asarray(result).dtype).min
+    if op == '+':
+        # The result's sign differs from that of both operands
+        wrapped = ((left ^ result) & (right ^ result)) < 0
+    elif op == '-':
+        wrapped = ((left ^ right) & (left ^ result)) < 0
+    elif op == '*':
+        nonzero = numpy.not_equal(right, 0)
+        wrapped = nonzero & numpy.not_equal(result // numpy.where(nonzero, right, 1), left)
+        wrapped = wrapped | (numpy.equal(left, minimum) & numpy.equal(right, -1))
+    else:
+        wrapped = numpy.equal(left, minimum) & numpy.equal(right, -1)
+    return numpy.asarray(wrapped, dtype=bool)
+
+# The largest absolute value in `value`, a column or a single value, as a
+# Python int.
+def magnitude(value):
+    if isinstance(value, numpy.ndarray):
+        if not value.size:
+            return 0
+        return max(-int(value.min()), int(value.max()))
+    return abs(int(value))
+
+# `value`, a column or a single value, as Python ints.
+def python_ints(value):
+    if isinstance(value, numpy.ndarray):
+        return value.astype(object)
+    if isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+# Runs `ast` for each lane of `columns` (a dict of variable names to arrays
+# of the same length), and returns the columns of the variables after.
+def run_batch(ast, columns):
+    if numpy is None:
+        raise RuntimeError('running a batch needs numpy')
+    if not columns:
+        raise ValueError('running a batch needs at least one column')
+    columns = dict((name, numpy.asarray(column)) for name, column in columns.items())
+    sizes = set(len(column) for column in columns.values())
+    if len(sizes) != 1:
+        raise ValueError('columns must all have the same number of lanes')
+    size = sizes.pop()
+    evaluator = BatchEvaluator(columns, size)
+    evaluator.statement(ast, numpy.ones(size, dtype=bool))
+    return evaluator.columns()
+
+# The variables of lane `index` of `columns`, as an `env`.
+def lane(columns, index):
+    env = {}
+    for name, column in columns.items():
+        if not numpy.ma.getmaskarray(column)[index]:
+            # `tolist` gives Python ints, whatever the column's type
+            env[name] = numpy.ma.getdata(column)[index:index + 1].tolist()[0]
+    return env
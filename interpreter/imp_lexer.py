@@ -8,7 +8,8 @@
 #   2. INT : tag indicator for a literal integer
 #   3. ID : tag indicator for identifiers
 
-import lexer
+import dfa_lexer
+import parallel_lexer
 
 # Bind tags for keywords
 
@@ -53,6 +54,17 @@ token_exprs = [
     (r'[A-Za-z][A-Za-z0-9_]*', ID),
 ]
 
-# Create our lexer function
+# Create our lexer function. It runs the DFA built from `token_exprs` (see
+# `dfa_lexer`), and the tokens come back as a compact `TokenStream`, which the
+# combinators can match on by kind code.
 def imp_lex(characters):
-    return lexer.lex(characters, token_exprs)
+    return dfa_lexer.dfa_lex(characters, token_exprs)
+
+# Lazily tokenize a string, `mmap` or file object, matching tokens the same
+# way as `imp_lex`
+def imp_lex_stream(source):
+    return dfa_lexer.dfa_lex_stream(source, token_exprs)
+
+# Tokenize a large string or `mmap` on several cores
+def imp_lex_parallel(characters, processes=None):
+    return parallel_lexer.parallel_lex(characters, token_exprs, processes)
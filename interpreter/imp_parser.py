@@ -9,13 +9,22 @@
 # NOTE: The `Reserved` tag will match a single token where both the text and tag are the 
 # same as the ones given.
 
+from contextlib import contextmanager
+
 from imp_lexer import *
 from combinators import *
 from imp_ast import *
+from grammar_compiler import compile_parser
 
 # Basic parsers
+_keywords = {}
+
 def keyword(kw):
-    return Reserved(kw, RESERVED)
+    parser = _keywords.get(kw)
+    if parser is None:
+        parser = Reserved(kw, RESERVED)
+        _keywords[kw] = parser
+    return parser
 
 
 # The `num` parser is used to match integers. It works similarly to `id`, except it 
@@ -30,120 +39,252 @@ num = Tag(INT) ^ (lambda i: int(i))
 # matches a token with the specified tag. 
 id = Tag(ID)
 
-# Top level parser
-def imp_parse(tokens):
-    ast = parser()(tokens, 0)
+# Top level parser. Every grammar rule below is a `rule`, so the whole grammar
+# is built once, the first time it is used, and shared by every parse. With
+# `packrat` set, every parser remembers its results for the duration of the
+# parse (see `combinators.packrat`), which keeps heavily nested expressions
+# linear. With `compiled` set, the grammar is compiled to Python functions
+# first (see `grammar_compiler`), which gives the same result faster. Given a
+# `NodeTable`, identical subtrees of the AST are made once and shared.
+def imp_parse(tokens, packrat=False, compiled=False, table=None):
+    with sharing(table):
+        if packrat:
+            ast = packrat_parser()(tokens, 0)
+        elif compiled:
+            ast = compiled_parser()(tokens, 0)
+        else:
+            ast = parser()(tokens, 0)
     return ast
 
+@rule
 def parser():
     return Phrase(stmt_list())    
 
+# The memo table makes a packrat parser stateful, so each parse gets its own
+# memoized copy of the shared grammar.
+def packrat_parser():
+    return packrat(parser())
+
+@rule
+def compiled_parser():
+    return compile_parser(parser())
+
+# Parses a lazily produced token stream (e.g. from `imp_lex_stream`). This is
+# the same grammar as `parser()`, but the top level statement list is unrolled
+# here so that the tokens of each completed statement can be released from the
+# window: nothing ever backtracks across a top level `;`.
+def imp_parse_stream(tokens, table=None):
+    with sharing(table):
+        return parse_stream(tokens)
+
+def parse_stream(tokens):
+    window = TokenWindow(tokens)
+    statement = stmt()
+    separator = keyword(';')
+    result = statement.parse(window, 0)
+    if not result:
+        return None
+    statements = [result[0]]
+    pos = result[1]
+    while True:
+        window.release(pos)
+        separator_result = separator.parse(window, pos)
+        if not separator_result:
+            break
+        next_result = statement.parse(window, separator_result[1])
+        if not next_result:
+            break
+        statements.append(next_result[0])
+        pos = next_result[1]
+    if not at_end(window, pos):
+        return None
+    return Result(process_block(statements), pos)
+
+# AST nodes are made by `node(cls, *fields)`, which makes them through the
+# `NodeTable` of the current parse, if it has one.
+_tables = [None]
+
+def node(cls, *fields):
+    table = _tables[-1]
+    if table is None:
+        return cls(*fields)
+    return table.make(cls, *fields)
+
+@contextmanager
+def sharing(table):
+    _tables.append(table)
+    try:
+        yield
+    finally:
+        _tables.pop()
+
 # Statements
+@rule
 def stmt_list():
-    separator = keyword(';') ^ (lambda x: lambda l, r: CompoundStatement(l, r))
-    return Exp(stmt(), separator)
+    def process(parsed):
+        (first, rest) = parsed
+        return process_block([first] + [statement for (_, statement) in rest])
+    return Seq(stmt(), Rep(Seq(keyword(';'), stmt()))) ^ process
 
+# The choices below are `Dispatch`es: the first token of a statement or term
+# picks the parser to try (see `combinators.Dispatch`).
+@rule
 def stmt():
-    return assign_stmt() | \
-           if_stmt()     | \
-           while_stmt()
+    return Dispatch(assign_stmt(),
+                    if_stmt(),
+                    while_stmt())
 
+@rule
 def assign_stmt():
     def process(parsed):
-        ((name, _), exp) = parsed
-        return AssignStatement(name, exp)
-    return id + keyword(':=') + aexp() ^ process
+        (name, _, exp) = parsed
+        return node(AssignStatement, name, exp)
+    return Seq(id, keyword(':='), aexp()) ^ process
 
+@rule
 def if_stmt():
     def process(parsed):
-        (((((_, condition), _), true_stmt), false_parsed), _) = parsed
+        (_, condition, _, true_stmt, false_parsed, _) = parsed
         if false_parsed:
             (_, false_stmt) = false_parsed
         else:
             false_stmt = None
-        return IfStatement(condition, true_stmt, false_stmt)
-    return keyword('if') + bexp() + \
-           keyword('then') + Lazy(stmt_list) + \
-           Opt(keyword('else') + Lazy(stmt_list)) + \
-           keyword('end') ^ process
+        return node(IfStatement, condition, true_stmt, false_stmt)
+    return Seq(keyword('if'), bexp(),
+               keyword('then'), Lazy(stmt_list),
+               Opt(Seq(keyword('else'), Lazy(stmt_list))),
+               keyword('end')) ^ process
 
+@rule
 def while_stmt():
     def process(parsed):
-        ((((_, condition), _), body), _) = parsed
-        return WhileStatement(condition, body)
-    return keyword('while') + bexp() + \
-           keyword('do') + Lazy(stmt_list) + \
-           keyword('end') ^ process
+        (_, condition, _, body, _) = parsed
+        return node(WhileStatement, condition, body)
+    return Seq(keyword('while'), bexp(),
+               keyword('do'), Lazy(stmt_list),
+               keyword('end')) ^ process
 
 # Boolean expressions
+#
+# A condition can start with a parenthesis which opens either an arithmetic
+# group, as in `(x + 1) < y`, or a boolean one, as in `(x < 1 or y < 1)`,
+# and there is no telling which until its closing parenthesis. Trying one
+# reading and then the other parses the same tokens twice at every level of
+# nesting, which makes nested groups quadratic. Instead, a group holds a
+# `condition`, either kind of expression, and the rules check afterwards
+# what kind of node they got: `bexp` and `aexp` only accept their own kind,
+# a relational operator only joins arithmetic expressions, and the operator
+# functions turn down operands of the wrong kind (see `Precedence`).
+@rule
 def bexp():
-    return precedence(bexp_term(),
+    return Filter(condition(), is_bexp)
+
+@rule
+def condition():
+    return precedence(condition_term(),
                       bexp_precedence_levels,
                       process_logic)
 
+@rule
 def bexp_term():
-    return bexp_not()   | \
-           bexp_relop() | \
-           bexp_group()
+    return Filter(condition_term(), is_bexp)
 
+@rule
+def condition_term():
+    return Dispatch(bexp_not(),
+                    bexp_relop())
+
+@rule
 def bexp_not():
-    return keyword('not') + Lazy(bexp_term) ^ (lambda parsed: NotBexp(parsed[1]))
+    return Seq(keyword('not'), Lazy(bexp_term)) ^ (lambda parsed: node(NotBexp, parsed[1]))
 
+# An arithmetic expression, optionally compared with another one. Without
+# an operator, this is also where a group of either kind ends up.
+@rule
 def bexp_relop():
     relops = ['<', '<=', '>', '>=', '=', '!=']
-    return aexp() + any_operator_in_list(relops) + aexp() ^ process_relop
-
-def bexp_group():
-    return keyword('(') + Lazy(bexp) + keyword(')') ^ process_group
+    return Filter(Seq(arithmetic(), Opt(Seq(any_operator_in_list(relops), aexp()))),
+                  relop_operands) ^ process_relop
 
 # Arithmetic expressions
+@rule
 def aexp():
+    return Filter(arithmetic(), is_aexp)
+
+@rule
+def arithmetic():
     return precedence(aexp_term(),
                       aexp_precedence_levels,
                       process_binop)
 
+@rule
 def aexp_term():
-    return aexp_value() | aexp_group()
+    return Dispatch(aexp_value(), aexp_group())
 
+@rule
 def aexp_group():
-    return keyword('(') + Lazy(aexp) + keyword(')') ^ process_group
+    return Seq(keyword('('), Lazy(condition), keyword(')')) ^ process_group
 
 # The next parser we need to build is the arithmetic expression parser, since we need to 
 # parser these in order to parse Boolean expressions and statements. 
 #
 # We will first define the `aexp_value` parser, which will convert the values returned 
 # by `num` and `id` into actual expressions. 
+@rule
 def aexp_value():
-    return (num ^ (lambda i: IntAexp(i))) | \
-           (id  ^ (lambda v: VarAexp(v)))
+    return Dispatch(num ^ (lambda i: node(IntAexp, i)),
+                    id  ^ (lambda v: node(VarAexp, v)))
 
 # An IMP-specific combinator for binary operator expressions (aexp and bexp)
 def precedence(value_parser, precedence_levels, combine):
-    def op_parser(precedence_level):
-        return any_operator_in_list(precedence_level) ^ combine
-    parser = value_parser * op_parser(precedence_levels[0])
-    for precedence_level in precedence_levels[1:]:
-        parser = parser * op_parser(precedence_level)
-    return parser
+    levels = [[keyword(op) for op in precedence_level]
+              for precedence_level in precedence_levels]
+    return Precedence(value_parser, levels, combine)
 
 # Miscellaneous functions for binary and relational operators
+def is_aexp(value):
+    return isinstance(value, Aexp)
+
+def is_bexp(value):
+    return isinstance(value, Bexp)
+
 def process_binop(op):
-    return lambda l, r: BinopAexp(op, l, r)
+    def combine(l, r):
+        if isinstance(l, Aexp) and isinstance(r, Aexp):
+            return node(BinopAexp, op, l, r)
+    return combine
+
+def relop_operands(parsed):
+    (left, compared) = parsed
+    return compared is None or isinstance(left, Aexp)
 
 def process_relop(parsed):
-    ((left, op), right) = parsed
-    return RelopBexp(op, left, right)
+    (left, compared) = parsed
+    if compared is None:
+        return left
+    (op, right) = compared
+    return node(RelopBexp, op, left, right)
 
 def process_logic(op):
     if op == 'and':
-        return lambda l, r: AndBexp(l, r)
+        cls = AndBexp
     elif op == 'or':
-        return lambda l, r: OrBexp(l, r)
+        cls = OrBexp
     else:
         raise RuntimeError('unknown logic operator: ' + op)
+    def combine(l, r):
+        if isinstance(l, Bexp) and isinstance(r, Bexp):
+            return node(cls, l, r)
+    return combine
+
+# A list of one statement is just that statement
+def process_block(statements):
+    if len(statements) == 1:
+        return statements[0]
+    return node(BlockStatement, statements)
 
 def process_group(parsed):
-    ((_, p), _) = parsed
+    (_, p, _) = parsed
     return p
 
 def any_operator_in_list(ops):
@@ -0,0 +1,552 @@
+# imp_vm.py
+# ---------
+# Compiles an IMP AST into flat bytecode for a small stack machine, and runs
+# it.
+#
+# Walking the tree makes a Python call for every node each time it runs. The
+# bytecode puts the whole program into one `array('i')` which a single loop
+# steps through, keeping intermediate values on a stack. Most instructions
+# are two integers, an opcode and its operand:
+#
+#   CONST k        push constants[k]
+#   LOAD n         push the variable in slot n
+#   LOAD_VALUE n   push the variable in slot n, or 0 if it is unassigned
+#   STORE n        pop a value into the variable in slot n
+#   BINARY f       pop right, pop left, push operators[f](left, right)
+#   BINARY_CONST k * 16 + f
+#                  pop left, push operators[f](left, constants[k])
+#   BINARY_LOAD n * 16 + f
+#                  pop left, push operators[f](left, the variable in slot n)
+#   NOT 0          replace the top of the stack with `not` it
+#   JUMP d         continue d items further on
+#   JUMP_IF_FALSE d
+#                  pop a value and jump by d if it is false
+#   JUMP_IF_TRUE d pop a value and jump by d if it is true
+#   JUMP_IF_FALSE_OR_POP d
+#                  jump by d if the top of the stack is false, leaving it
+#                  there, and otherwise pop it
+#   JUMP_IF_TRUE_OR_POP d
+#                  the same, jumping if it is true
+#   FAIL k         raise RuntimeError for the unknown operator constants[k]
+#
+# The BINARY_ forms do the work of a CONST or LOAD and a BINARY in one
+# instruction, since a right operand which is a constant or a variable (as
+# in `x + 1` or `i < n`) is by far the most common. Jump offsets are
+# relative to the next instruction. Values are kept in a constant table, so
+# integers of any size fit.
+#
+# The loop spends most of its time picking the next instruction, so the
+# commonest sequences each get an instruction of their own, which takes
+# three or four integers:
+#
+#   UPDATE_CONST n, k * 16 + f
+#                  set the variable in slot n to
+#                  operators[f](the variable, constants[k])
+#   UPDATE_LOAD n, m * 16 + f
+#                  the same with the variable in slot m
+#   TEST_CONST n, k * 16 + f, d
+#                  jump by d if operators[f](the variable in slot n,
+#                  constants[k]) is true
+#   TEST_LOAD n, m * 16 + f, d
+#                  the same with the variable in slot m
+#   BRANCH_CONST k * 16 + f, d
+#                  pop left and jump by d if operators[f](left,
+#                  constants[k]) is true
+#   BRANCH_LOAD m * 16 + f, d
+#                  the same with the variable in slot m
+#
+# `x := x + 1` is an UPDATE_CONST. Conditions of `if` and `while` are
+# compiled into jumps: a comparison with a constant or variable is a TEST or
+# BRANCH, jumping if it is false by testing the opposite comparison (values
+# are always integers, so `not x < 1` is `x >= 1`); `not` swaps where the
+# jumps go; and when `and` and `or` short-circuit (see `imp_ast`), each side
+# jumps on its own, so `if a < 1 and b < 1 then ...` jumps past the `then`
+# part as soon as either test fails. Any other condition is evaluated onto
+# the stack and tested with JUMP_IF_FALSE or JUMP_IF_TRUE.
+#
+# Elsewhere, when `and` and `or` short-circuit, the left side decides
+# whether the right side runs at all:
+#
+#           <left>
+#           JUMP_IF_FALSE_OR_POP end     (JUMP_IF_TRUE_OR_POP for `or`)
+#           <right>
+#   end:
+#
+# Otherwise they are ordinary binary operators and both sides are evaluated.
+#
+# Variables live in a frame, with slots given out by `Slots` as for
+# compiled closures (see `imp_ast`). Copies (`x := y`) use LOAD_VALUE, so
+# `unassigned` is never stored.
+#
+# A `while` loop tests its condition at the bottom, so each iteration runs
+# one conditional jump, usually a TEST:
+#
+#           JUMP test
+#   body:   <body>
+#   test:   <jump to body if the condition holds>
+#
+# `run` does not pick the operands apart every time it runs an instruction:
+# the first time a program runs, `decode` turns each instruction into a
+# tuple holding the operator function, constant and slots it uses, and the
+# index of the instruction a jump goes to.
+#
+# `decode` also fuses pairs of instructions which often run one after the
+# other into "superinstructions", which only exist in its tuples:
+#
+#   UPDATE_TEST        an UPDATE_CONST then a TEST_CONST, as at the end of
+#                      a counting loop (`i := i + 1` and then `i < n`)
+#   UPDATE_CONST_JUMP  an UPDATE_CONST then a JUMP, as at the end of the
+#   UPDATE_LOAD_JUMP   `then` part of an `if`, and the same for UPDATE_LOAD
+#   LOAD_BINARY_CONST  a LOAD then a BINARY_CONST, as in `x * 2 < y`
+#
+# A superinstruction takes the place of the first instruction of its pair
+# and goes on past the second. The second stays where it was, since a jump
+# may go straight to it (the test at the bottom of a `while` loop is
+# reached by a jump the first time round).
+#
+# `disassemble` lists the instructions of a compiled program.
+
+from array import array
+
+import imp_ast
+from imp_ast import *
+
+CONST = 1
+LOAD = 2
+STORE = 3
+BINARY = 4
+NOT = 5
+JUMP = 6
+JUMP_IF_FALSE = 7
+JUMP_IF_TRUE = 8
+FAIL = 9
+BINARY_CONST = 10
+BINARY_LOAD = 11
+LOAD_VALUE = 12
+JUMP_IF_FALSE_OR_POP = 13
+JUMP_IF_TRUE_OR_POP = 14
+UPDATE_CONST = 15
+UPDATE_LOAD = 16
+TEST_CONST = 17
+TEST_LOAD = 18
+BRANCH_CONST = 19
+BRANCH_LOAD = 20
+
+# Superinstructions, made by `decode`
+UPDATE_TEST = 21
+UPDATE_CONST_JUMP = 22
+UPDATE_LOAD_JUMP = 23
+LOAD_BINARY_CONST = 24
+
+opcode_names = {
+    CONST: 'CONST',
+    LOAD: 'LOAD',
+    STORE: 'STORE',
+    BINARY: 'BINARY',
+    NOT: 'NOT',
+    JUMP: 'JUMP',
+    JUMP_IF_FALSE: 'JUMP_IF_FALSE',
+    JUMP_IF_TRUE: 'JUMP_IF_TRUE',
+    FAIL: 'FAIL',
+    BINARY_CONST: 'BINARY_CONST',
+    BINARY_LOAD: 'BINARY_LOAD',
+    LOAD_VALUE: 'LOAD_VALUE',
+    JUMP_IF_FALSE_OR_POP: 'JUMP_IF_FALSE_OR_POP',
+    JUMP_IF_TRUE_OR_POP: 'JUMP_IF_TRUE_OR_POP',
+    UPDATE_CONST: 'UPDATE_CONST',
+    UPDATE_LOAD: 'UPDATE_LOAD',
+    TEST_CONST: 'TEST_CONST',
+    TEST_LOAD: 'TEST_LOAD',
+    BRANCH_CONST: 'BRANCH_CONST',
+    BRANCH_LOAD: 'BRANCH_LOAD',
+}
+
+jumps = (JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP,
+         TEST_CONST, TEST_LOAD, BRANCH_CONST, BRANCH_LOAD)
+
+# The number of integers in each instruction which isn't two long.
+sizes = {
+    UPDATE_CONST: 3,
+    UPDATE_LOAD: 3,
+    TEST_CONST: 4,
+    TEST_LOAD: 4,
+    BRANCH_CONST: 3,
+    BRANCH_LOAD: 3,
+}
+
+# The operators of BINARY, by operand.
+operator_names = ['+', '-', '*', '/', '<', '<=', '>', '>=', '=', '!=', 'and', 'or']
+operator_functions = [binop_functions.get(name) or relop_functions.get(name)
+                      for name in operator_names[:-2]] + \
+                     [lambda left, right: left and right,
+                      lambda left, right: left or right]
+operator_indices = dict((name, index) for index, name in enumerate(operator_names))
+operator_bits = 4
+operator_mask = (1 << operator_bits) - 1
+
+# The comparison which holds exactly when each one doesn't.
+opposite_relops = {'<': '>=', '<=': '>', '>': '<=', '>=': '<', '=': '!=', '!=': '='}
+
+class Bytecode:
+    def __init__(self, code, constants, slots):
+        self.code = code
+        self.constants = constants
+        self.slots = slots
+        # Decoded for `run` on first use
+        self.instructions = None
+
+    def __repr__(self):
+        return 'Bytecode(%d instructions)' % (len(self.code) // 2)
+
+class BytecodeCompiler:
+    def __init__(self):
+        self.code = array('i')
+        self.constants = []
+        self.constant_indices = {}
+        self.slots = Slots()
+
+    def compile(self, ast):
+        self.statement(ast)
+        return Bytecode(self.code, self.constants, self.slots)
+
+    def emit(self, op, *args):
+        self.code.append(op)
+        self.code.extend(args or [0])
+
+    # Emits a jump with its offset (the last integer of the instruction) to
+    # be filled in by `patch`, and returns where it is.
+    def emit_jump(self, op, *args):
+        self.emit(op, *(args + (0,)))
+        return len(self.code)
+
+    def patch(self, jump, target=None):
+        if target is None:
+            target = len(self.code)
+        self.code[jump - 1] = target - jump
+
+    def constant(self, value):
+        # Keyed by type as well, since 1 == True
+        key = (type(value), value)
+        if key not in self.constant_indices:
+            self.constant_indices[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_indices[key]
+
+    def statement(self, node):
+        kind = node.__class__
+        if kind is AssignStatement:
+            aexp = node.aexp
+            update = None
+            if aexp.__class__ is BinopAexp and aexp.op in operator_indices and \
+               aexp.left.__class__ is VarAexp and aexp.left.name == node.name:
+                update = self.operand(aexp.op, aexp.right)
+            if update is not None:
+                self.emit(UPDATE_CONST if update[0] == BINARY_CONST else UPDATE_LOAD,
+                          self.slots.slot(node.name), update[1])
+                return
+            if aexp.__class__ is VarAexp:
+                self.emit(LOAD_VALUE, self.slots.slot(aexp.name))
+            else:
+                self.expression(aexp)
+            self.emit(STORE, self.slots.slot(node.name))
+        elif kind is BlockStatement:
+            for statement in node.statements:
+                self.statement(statement)
+        elif kind is CompoundStatement:
+            self.statement(node.first)
+            self.statement(node.second)
+        elif kind is IfStatement:
+            false_jumps = self.branch(node.condition, False)
+            self.statement(node.true_stmt)
+            if node.false_stmt:
+                end_jump = self.emit_jump(JUMP)
+                self.patch_all(false_jumps)
+                self.statement(node.false_stmt)
+                self.patch(end_jump)
+            else:
+                self.patch_all(false_jumps)
+        elif kind is WhileStatement:
+            test_jump = self.emit_jump(JUMP)
+            body = len(self.code)
+            self.statement(node.body)
+            self.patch(test_jump)
+            self.patch_all(self.branch(node.condition, True), body)
+        else:
+            raise RuntimeError('cannot compile statement: %r' % node)
+
+    def expression(self, node):
+        kind = node.__class__
+        if kind is IntAexp:
+            self.emit(CONST, self.constant(node.i))
+        elif kind is VarAexp:
+            self.emit(LOAD, self.slots.slot(node.name))
+        elif kind is BinopAexp or kind is RelopBexp:
+            self.binary(node.op, node.left, node.right)
+        elif kind is AndBexp:
+            self.logical('and', JUMP_IF_FALSE_OR_POP, node.left, node.right)
+        elif kind is OrBexp:
+            self.logical('or', JUMP_IF_TRUE_OR_POP, node.left, node.right)
+        elif kind is NotBexp:
+            self.expression(node.exp)
+            self.emit(NOT)
+        else:
+            raise RuntimeError('cannot compile expression: %r' % node)
+
+    # Emits jumps taken when `node` is true (if `jump_if` is true) or false,
+    # and returns where they are, for `patch_all`.
+    def branch(self, node, jump_if):
+        kind = node.__class__
+        if kind is NotBexp:
+            return self.branch(node.exp, not jump_if)
+        if (kind is AndBexp or kind is OrBexp) and imp_ast.short_circuit:
+            # `and` stops at a false side, `or` at a true one
+            stop_if = kind is OrBexp
+            if jump_if == stop_if:
+                return self.branch(node.left, jump_if) + self.branch(node.right, jump_if)
+            skip_jumps = self.branch(node.left, stop_if)
+            jumps = self.branch(node.right, jump_if)
+            self.patch_all(skip_jumps)
+            return jumps
+        if kind is RelopBexp and node.op in opposite_relops:
+            op = node.op if jump_if else opposite_relops[node.op]
+            operand = self.operand(op, node.right)
+            if operand is not None:
+                if node.left.__class__ is VarAexp:
+                    test = TEST_CONST if operand[0] == BINARY_CONST else TEST_LOAD
+                    return [self.emit_jump(test, self.slots.slot(node.left.name), operand[1])]
+                self.expression(node.left)
+                branch = BRANCH_CONST if operand[0] == BINARY_CONST else BRANCH_LOAD
+                return [self.emit_jump(branch, operand[1])]
+        self.expression(node)
+        return [self.emit_jump(JUMP_IF_TRUE if jump_if else JUMP_IF_FALSE)]
+
+    def patch_all(self, jumps, target=None):
+        for jump in jumps:
+            self.patch(jump, target)
+
+    # For a right operand which is a constant or a variable, the BINARY_
+    # opcode and its operand; otherwise None.
+    def operand(self, op, right):
+        function = operator_indices[op]
+        if right.__class__ is IntAexp:
+            return (BINARY_CONST, self.constant(right.i) << operator_bits | function)
+        elif right.__class__ is VarAexp:
+            return (BINARY_LOAD, self.slots.slot(right.name) << operator_bits | function)
+        return None
+
+    def binary(self, op, left, right):
+        self.expression(left)
+        if op not in operator_indices:
+            self.expression(right)
+            self.emit(FAIL, self.constant(op))
+            return
+        operand = self.operand(op, right)
+        if operand is not None:
+            self.emit(*operand)
+        else:
+            self.expression(right)
+            self.emit(BINARY, operator_indices[op])
+
+    def logical(self, op, jump, left, right):
+        if not imp_ast.short_circuit:
+            self.binary(op, left, right)
+            return
+        self.expression(left)
+        end_jump = self.emit_jump(jump)
+        self.expression(right)
+        self.patch(end_jump)
+
+def compile_bytecode(ast):
+    return BytecodeCompiler().compile(ast)
+
+# Decodes the instructions of `program` for `run`: a list of tuples (op,
+# function, a, b, target, test), one per instruction, holding the operator
+# function, slots and constants the operands refer to, and for jumps the
+# index of the instruction they go to. An UPDATE_TEST's `test` holds the
+# function, slot and constant of its TEST_CONST. Worked out once per
+# program, so that running an instruction only takes unpacking its tuple.
+def decode(program):
+    code = program.code
+    constants = program.constants
+    starts = []
+    pc = 0
+    while pc < len(code):
+        starts.append(pc)
+        pc += sizes.get(code[pc], 2)
+    indices = dict((start, index) for index, start in enumerate(starts))
+    indices[len(code)] = len(starts)
+    instructions = []
+    for start in starts:
+        op = code[start]
+        size = sizes.get(op, 2)
+        args = code[start + 1:start + size]
+        arg = args[0]
+        function = a = b = target = None
+        if op in jumps:
+            target = indices[start + size + args[-1]]
+        if op in (UPDATE_CONST, UPDATE_LOAD, TEST_CONST, TEST_LOAD):
+            a = arg
+            arg = args[1]
+        if op in (BINARY_CONST, UPDATE_CONST, TEST_CONST, BRANCH_CONST):
+            function = operator_functions[arg & operator_mask]
+            b = constants[arg >> operator_bits]
+        elif op in (BINARY_LOAD, UPDATE_LOAD, TEST_LOAD, BRANCH_LOAD):
+            function = operator_functions[arg & operator_mask]
+            b = arg >> operator_bits
+        elif op == BINARY:
+            function = operator_functions[arg]
+        elif op == CONST or op == FAIL:
+            b = constants[arg]
+        elif op in (LOAD, LOAD_VALUE, STORE):
+            a = arg
+        instructions.append((op, function, a, b, target, None))
+    # Superinstructions. Each one reads the second instruction of its pair
+    # as it was decoded, not as fused with the one after it.
+    for index in range(len(instructions) - 1):
+        (op, function, a, b, target, test) = instructions[index]
+        second = instructions[index + 1]
+        if op == UPDATE_CONST and second[0] == TEST_CONST:
+            instructions[index] = (UPDATE_TEST, function, a, b, second[4], second[1:4])
+        elif op == UPDATE_CONST and second[0] == JUMP:
+            instructions[index] = (UPDATE_CONST_JUMP, function, a, b, second[4], None)
+        elif op == UPDATE_LOAD and second[0] == JUMP:
+            instructions[index] = (UPDATE_LOAD_JUMP, function, a, b, second[4], None)
+        elif op == LOAD and second[0] == BINARY_CONST:
+            instructions[index] = (LOAD_BINARY_CONST, second[1], a, second[3], None, None)
+    return instructions
+
+# Runs `program` (a `Bytecode`), updating `env`.
+def run(program, env):
+    if program.instructions is None:
+        program.instructions = decode(program)
+    instructions = program.instructions
+    frame = program.slots.frame(env)
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # Opcodes as locals, most often run first
+    (update_test, test_const, update_const, load_binary_const, binary_const,
+     update_load, update_const_jump, update_load_jump, load, store,
+     branch_load, branch_const, jump, test_load, const, binary_load, binary,
+     jump_if_true, jump_if_false) = \
+        (UPDATE_TEST, TEST_CONST, UPDATE_CONST, LOAD_BINARY_CONST, BINARY_CONST,
+         UPDATE_LOAD, UPDATE_CONST_JUMP, UPDATE_LOAD_JUMP, LOAD, STORE,
+         BRANCH_LOAD, BRANCH_CONST, JUMP, TEST_LOAD, CONST, BINARY_LOAD, BINARY,
+         JUMP_IF_TRUE, JUMP_IF_FALSE)
+    pc = 0
+    end = len(instructions)
+    while pc < end:
+        (op, function, a, b, target, test) = instructions[pc]
+        pc += 1
+        if op == update_test:
+            frame[a] = function(frame[a], b)
+            (function, a, b) = test
+            if function(frame[a], b):
+                pc = target
+            else:
+                pc += 1
+        elif op == test_const:
+            if function(frame[a], b):
+                pc = target
+        elif op == update_const:
+            frame[a] = function(frame[a], b)
+        elif op == load_binary_const:
+            push(function(frame[a], b))
+            pc += 1
+        elif op == binary_const:
+            stack[-1] = function(stack[-1], b)
+        elif op == update_load:
+            frame[a] = function(frame[a], frame[b])
+        elif op == update_const_jump:
+            frame[a] = function(frame[a], b)
+            pc = target
+        elif op == update_load_jump:
+            frame[a] = function(frame[a], frame[b])
+            pc = target
+        elif op == load:
+            push(frame[a])
+        elif op == store:
+            frame[a] = pop()
+        elif op == branch_load:
+            if function(pop(), frame[b]):
+                pc = target
+        elif op == branch_const:
+            if function(pop(), b):
+                pc = target
+        elif op == jump:
+            pc = target
+        elif op == test_load:
+            if function(frame[a], frame[b]):
+                pc = target
+        elif op == const:
+            push(b)
+        elif op == binary_load:
+            stack[-1] = function(stack[-1], frame[b])
+        elif op == binary:
+            right = pop()
+            stack[-1] = function(stack[-1], right)
+        elif op == jump_if_true:
+            if pop():
+                pc = target
+        elif op == jump_if_false:
+            if not pop():
+                pc = target
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if stack[-1]:
+                pop()
+            else:
+                pc = target
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if stack[-1]:
+                pc = target
+            else:
+                pop()
+        elif op == NOT:
+            stack[-1] = not stack[-1]
+        elif op == LOAD_VALUE:
+            value = frame[a]
+            push(value if value is not unassigned else 0)
+        elif op == FAIL:
+            raise RuntimeError('unknown operator: ' + b)
+        else:
+            raise RuntimeError('bad opcode %d at instruction %d' % (op, pc - 1))
+    program.slots.store(frame, env)
+
+# Returns a listing of the instructions in `program`, one per line: the
+# position, the opcode, the operands and what they refer to.
+def disassemble(program):
+    code = program.code
+    names = program.slots.names
+    def operand(op, arg):
+        if op in (BINARY_CONST, UPDATE_CONST, TEST_CONST, BRANCH_CONST):
+            value = repr(program.constants[arg >> operator_bits])
+        else:
+            value = names[arg >> operator_bits]
+        return '%s %s' % (operator_names[arg & operator_mask], value)
+    lines = []
+    pc = 0
+    while pc < len(code):
+        op = code[pc]
+        size = sizes.get(op, 2)
+        args = code[pc + 1:pc + size]
+        arg = args[0]
+        name = opcode_names.get(op, '<%d>' % op)
+        if op == CONST or op == FAIL:
+            notes = [repr(program.constants[arg])]
+        elif op in (LOAD, LOAD_VALUE, STORE):
+            notes = [names[arg]]
+        elif op == BINARY:
+            notes = [operator_names[arg]]
+        elif op in (BINARY_CONST, BINARY_LOAD, BRANCH_CONST, BRANCH_LOAD):
+            notes = [operand(op, arg)]
+        elif op in (UPDATE_CONST, UPDATE_LOAD, TEST_CONST, TEST_LOAD):
+            notes = ['%s %s' % (names[arg], operand(op, args[1]))]
+        else:
+            notes = []
+        if op in jumps:
+            notes.append('to %d' % (pc + size + args[-1]))
+        note = '(%s)' % ', '.join(notes) if notes else ''
+        arguments = ' '.join('%4d' % arg for arg in args)
+        lines.append(('%4d %-14s %s %s' % (pc, name, arguments, note)).rstrip())
+        pc += size
+    return '\n'.join(lines)
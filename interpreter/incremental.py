@@ -0,0 +1,282 @@
+# incremental.py
+# --------------
+# Incremental re-lexing and re-parsing of an edited IMP program.
+#
+# An editor sends us one small edit at a time: `offset`, the number of
+# characters deleted there and the text inserted in their place. Rather than
+# running `imp_lex` and `imp_parse` over the whole buffer again, an
+# `IncrementalProgram` keeps the buffer cut into segments, one per top level
+# statement, and redoes only the segments the edit touched.
+#
+# Segments
+# --------
+# The top level of a program is a list of statements separated by `;`. A
+# segment is the text of one statement up to and including the `;` after it
+# (the first segment also holds whatever comes before the first statement,
+# and the last one whatever comes after the last). Each segment keeps its
+# text, its tokens with offsets counted from the start of the segment, and
+# the statement it parsed into. Nothing in a segment depends on where in the
+# buffer it is, so an edit never has to update the segments after it.
+#
+# The segments are kept in blocks of about `block_size`, and each block
+# knows the length of its text. Finding the segment at an offset walks the
+# blocks and then the segments of one block, and replacing segments only
+# rebuilds the blocks they were in.
+#
+# Re-lexing and re-parsing
+# ------------------------
+# An edit takes the segments it touches (the "window"), applies the edit to
+# their text and lexes and parses it as a list of statements on its own.
+# Every segment starts just after a `;` token, and the lexer's only state
+# between tokens is its position, so the window lexes the same on its own as
+# it would in the whole buffer, as long as it still ends with a `;` token.
+# If it doesn't (the edit deleted the `;`, or opened a comment running past
+# it) the window takes in more segments until it does.
+#
+# Nothing backtracks across a top level `;` either (see `imp_parse_stream`),
+# so statements in the window parse just as they would in the whole
+# program. A statement in the window that is cut short by the window's end
+# (a `while` whose `end` was deleted, say) would go on to parse all the
+# following statements as its body and still fail at the end of the buffer,
+# since each of them is complete on its own. The one exception is a "gap":
+# when the window does not parse (which happens all the time while someone
+# is typing), it becomes a single segment without a statement, and `ast` is
+# None. The gap might hold the missing `end`, so a window that fails before
+# a gap takes it in and tries again, and a window after a gap starts at the
+# gap. There is at most one gap.
+#
+# `ast`, `text` and `tokens` are put together from all the segments when
+# they are read, so an edit costs time in proportion to the edited
+# statements (and the number of blocks), not the size of the buffer. While a
+# gap is open, edits after it re-parse everything from the gap on.
+
+from array import array
+
+import dfa_lexer
+from imp_lexer import *
+from imp_parser import *
+
+class Segment:
+    __slots__ = ('text', 'tokens', 'statement')
+
+    def __init__(self, text, tokens, statement):
+        self.text = text
+        self.tokens = tokens
+        self.statement = statement
+
+class IncrementalProgram:
+    # Segments per block
+    block_size = 64
+
+    def __init__(self, text):
+        self.statement = stmt()
+        self.separator = keyword(';')
+        self.blocks = [[]]
+        self.lengths = [0]
+        # Offset of the gap segment, or None
+        self.gap = None
+        self._ast = self._text = None
+        segments = self.parse(text, True)
+        self.replace((0, 0), (0, -1), segments)
+
+    # Applies an edit. The new AST is put together when `ast` is next read.
+    def edit(self, offset, deleted, inserted):
+        start = self.locate(offset)
+        if self.gap is not None and self.gap < start[2]:
+            start = self.locate(self.gap)
+        last = self.locate(max(offset + deleted - 1, offset))
+        old = list(self.window(start, last))
+        extra = 1
+        while True:
+            text = ''.join(segment.text for segment in old)
+            before = offset - start[2]
+            text = text[:before] + inserted + text[before + deleted:]
+            final = self.following(last) is None
+            segments = self.parse(text, final)
+            if segments is None:
+                # Take in more segments, twice as many each time
+                for _ in range(extra):
+                    if self.following(last) is None:
+                        break
+                    last = self.following(last)
+                    old.append(self.blocks[last[0]][last[1]])
+                extra *= 2
+                continue
+            gap_end = start[2] + sum(len(segment.text) for segment in old)
+            if segments[-1].statement is None and self.gap_after(last, gap_end):
+                # A failing window before the gap takes the gap in
+                gap = self.locate(self.gap)
+                while last[:2] != gap[:2]:
+                    last = self.following(last)
+                    old.append(self.blocks[last[0]][last[1]])
+                continue
+            break
+        # Keep the statements which came out the same, so that the AST only
+        # changes if some statement did
+        changed = len(segments) != len(old)
+        for new_segment, old_segment in zip(segments, old):
+            if new_segment.statement is not None and \
+               old_segment.statement is not None and \
+               new_segment.statement == old_segment.statement:
+                new_segment.statement = old_segment.statement
+            else:
+                changed = True
+        delta = len(inserted) - deleted
+        if self.gap_after(last, gap_end):
+            self.gap += delta
+        else:
+            self.gap = None
+        self.replace(start, last, segments)
+        self._text = None
+        if changed:
+            self._ast = None
+
+    # Whether the gap comes after the window ending with the segment at
+    # `last`, at offset `end`. An empty gap can only be the last segment, so
+    # one at `end` is the window's own if nothing follows it.
+    def gap_after(self, last, end):
+        return self.gap is not None and self.gap >= end and \
+               self.following(last) is not None
+
+    # The AST of the program, or None if it does not parse.
+    @property
+    def ast(self):
+        if self.gap is not None:
+            return None
+        if self._ast is None:
+            self._ast = process_block(self.statements)
+        return self._ast
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = ''.join(segment.text for segment in self.segments())
+        return self._text
+
+    # The tokens of the whole buffer, as `dfa_lex` with `errors=True` gives
+    # them.
+    @property
+    def tokens(self):
+        tokens = TokenStream(self.text)
+        offset = 0
+        for segment in self.segments():
+            tokens.codes.extend(segment.tokens.codes)
+            tokens.starts.extend(shift(segment.tokens.starts, offset))
+            tokens.ends.extend(shift(segment.tokens.ends, offset))
+            offset += len(segment.text)
+        return tokens
+
+    # The top level statements, with None for the gap.
+    @property
+    def statements(self):
+        return [segment.statement for segment in self.segments()]
+
+    def segments(self):
+        for block in self.blocks:
+            for segment in block:
+                yield segment
+
+    # Lexes and parses `text`, which is made of whole segments (and is at the
+    # end of the buffer if `final`). Returns its segments: one per statement,
+    # or a single gap segment if it doesn't parse. Returns None if more text
+    # is needed to tell.
+    def parse(self, text, final):
+        tokens = dfa_lexer.dfa_lex(text, token_exprs, errors=True)
+        count = len(tokens)
+        if not final and not (count and tokens.ends[-1] == len(text) and
+                              tokens[-1] == (';', RESERVED)):
+            return None
+        statements = []
+        # Token index after each top level `;`
+        cuts = [0]
+        pos = 0
+        while True:
+            result = self.statement.parse(tokens, pos)
+            if not result:
+                return [Segment(text, tokens, None)]
+            statements.append(result[0])
+            pos = result[1]
+            if pos == count:
+                break
+            result = self.separator.parse(tokens, pos)
+            if not result or (result[1] == count and final):
+                return [Segment(text, tokens, None)]
+            pos = result[1]
+            cuts.append(pos)
+            if pos == count:
+                break
+        if len(cuts) == len(statements):
+            cuts.append(count)
+        segments = []
+        for index, statement in enumerate(statements):
+            first = cuts[index]
+            stop = cuts[index + 1]
+            begin = tokens.ends[first - 1] if first else 0
+            end = tokens.ends[stop - 1] if stop < count else len(text)
+            part = TokenStream(text[begin:end])
+            part.codes = tokens.codes[first:stop]
+            part.starts = shift(tokens.starts[first:stop], -begin)
+            part.ends = shift(tokens.ends[first:stop], -begin)
+            segments.append(Segment(part.source, part, statement))
+        return segments
+
+    # Finds the segment containing `offset` (the last one if `offset` is the
+    # end of the buffer). Returns (block index, index in block, offset of the
+    # segment).
+    def locate(self, offset):
+        start = 0
+        last = len(self.blocks) - 1
+        for index, length in enumerate(self.lengths):
+            if offset < start + length or index == last:
+                break
+            start += length
+        block = self.blocks[index]
+        for position, segment in enumerate(block):
+            if offset < start + len(segment.text) or position == len(block) - 1:
+                return (index, position, start)
+            start += len(segment.text)
+
+    # The position of the segment after the one at `position`, or None.
+    def following(self, position):
+        index, position = position[:2]
+        if position + 1 < len(self.blocks[index]):
+            return (index, position + 1, None)
+        if index + 1 < len(self.blocks):
+            return (index + 1, 0, None)
+        return None
+
+    def window(self, first, last):
+        index, position = first[:2]
+        while True:
+            yield self.blocks[index][position]
+            if (index, position) == last[:2]:
+                return
+            (index, position, _) = self.following((index, position))
+
+    # Replaces the segments from `first` to `last` by `segments`.
+    def replace(self, first, last, segments):
+        (first_block, first_position) = first[:2]
+        (last_block, last_position) = last[:2]
+        merged = self.blocks[first_block][:first_position] + segments + \
+                 self.blocks[last_block][last_position + 1:]
+        # Blocks shrink as statements are deleted; fold small ones into the
+        # next block
+        if len(merged) < self.block_size // 2 and last_block + 1 < len(self.blocks):
+            last_block += 1
+            merged += self.blocks[last_block]
+        if len(merged) > 2 * self.block_size:
+            blocks = [merged[i:i + self.block_size]
+                      for i in range(0, len(merged), self.block_size)]
+        else:
+            blocks = [merged]
+        self.blocks[first_block:last_block + 1] = blocks
+        self.lengths[first_block:last_block + 1] = \
+            [sum(len(segment.text) for segment in block) for block in blocks]
+        if segments[-1].statement is None:
+            self.gap = sum(self.lengths[:first_block]) + \
+                       sum(len(segment.text) for segment in merged[:first_position])
+
+def shift(offsets, delta):
+    if delta:
+        return array(offsets.typecode, map(delta.__add__, offsets))
+    return offsets
@@ -1,27 +1,121 @@
 # Agnostic lexer
+#
+# The token expressions are compiled once into a single "master" regex. Each
+# expression becomes a named group `T<index>` in one big alternation, in the
+# same order as `token_exprs`. Python's regex alternation tries branches left
+# to right and takes the first one that matches, which is exactly what trying
+# each expression in turn did, so the tokens produced are identical. The
+# matched group's name tells us which expression (and therefore which tag)
+# matched.
+#
+# NOTE: since the expressions are wrapped in named groups, numbered
+#       backreferences (\1, \2, ...) inside a token expression are not
+#       supported.
 
 import sys
 import re
+import mmap
+import sre_parse
+import sre_constants
 
-def lex(characters, token_exprs):
+from token_stream import *
+
+# Compiled lexers, keyed by the token expressions they were built from.
+_lexer_cache = {}
+
+# If `pattern` can only ever match one string, returns that string, otherwise
+# returns None. Tokens from such patterns get a literal kind code (see
+# `token_stream`), so their text never has to be sliced out of the source.
+def literal_text(pattern):
+    chars = []
+    for op, value in sre_parse.parse(pattern):
+        if op != sre_constants.LITERAL or value > 127:
+            return None
+        chars.append(chr(value))
+    return ''.join(chars)
+
+def compile_token_exprs(token_exprs):
+    key = tuple(tuple(token_expr) for token_expr in token_exprs)
+    compiled = _lexer_cache.get(key)
+    if compiled is None:
+        groups = []
+        tags = {}
+        codes = {}
+        for index, (pattern, tag) in enumerate(token_exprs):
+            name = 'T%d' % index
+            groups.append('(?P<%s>%s)' % (name, pattern))
+            tags[name] = tag
+            if tag:
+                codes[name] = kind_code(tag, literal_text(pattern))
+        compiled = (re.compile('|'.join(groups)), tags, codes)
+        _lexer_cache[key] = compiled
+    return compiled
+
+# `lex_stream` is a generator which yields tokens one at a time instead of
+# building the whole list. The source can be a string, an `mmap` (which the
+# regex engine scans in place, without copying the file into memory) or a file
+# object, which is read `chunk_size` characters at a time.
+#
+# When reading chunks, a token might be cut in half at the end of the buffer.
+# We always keep at least `chunk_size` characters of lookahead in the buffer,
+# and if a match fails or runs up to the end of the buffer we read more input
+# and try again before deciding.
+def lex_stream(source, token_exprs, chunk_size=65536):
+    regex, tags, _ = compile_token_exprs(token_exprs)
+    match_at = regex.match
+    if isinstance(source, (basestring, mmap.mmap)):
+        buffer, read = source, None
+    else:
+        buffer, read = '', source.read
     pos = 0
+    need_more = False
+    while True:
+        if read is not None and (need_more or len(buffer) - pos < chunk_size):
+            data = read(chunk_size)
+            if data:
+                buffer = buffer[pos:] + data
+                pos = 0
+            else:
+                read = None
+            need_more = False
+            continue
+        if pos >= len(buffer):
+            return
+        match = match_at(buffer, pos)
+        if read is not None and (not match or match.end(0) == len(buffer)):
+            need_more = True
+            continue
+        if not match:
+            sys.stderr.write('Illegal character: %s\n' % buffer[pos])
+            sys.exit(1)
+        tag = tags[match.lastgroup]
+        if tag:
+            yield (match.group(0), tag)
+        pos = match.end(0)
+
+def lex(characters, token_exprs):
     tokens = []
-    while pos < len(characters):
-        match = None
-        for token_expr in token_exprs:
-            pattern, tag = token_expr
-            regex = re.compile(pattern)
-            match = regex.match(characters, pos)
-            if match:
-                text = match.group(0)
-                if tag:
-                    token = (text, tag)
-                    tokens.append(token)
-                    print token
-                break
+    for token in lex_stream(characters, token_exprs):
+        tokens.append(token)
+        print token
+    return tokens
+
+# Tokenizes a whole string or `mmap` into a compact `TokenStream`.
+def lex_token_stream(characters, token_exprs):
+    regex, _, codes = compile_token_exprs(token_exprs)
+    match_at = regex.match
+    tokens = TokenStream(characters)
+    append = tokens.append
+    pos = 0
+    end = len(characters)
+    while pos < end:
+        match = match_at(characters, pos)
         if not match:
             sys.stderr.write('Illegal character: %s\n' % characters[pos])
             sys.exit(1)
-        else:
-            pos = match.end(0)
+        match_end = match.end(0)
+        code = codes.get(match.lastgroup)
+        if code is not None:
+            append(code, pos, match_end)
+        pos = match_end
     return tokens
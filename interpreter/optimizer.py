@@ -0,0 +1,554 @@
+# optimizer.py
+# ------------
+# Rewrites an IMP AST into one which gives the same results with less work.
+# `optimize(ast)` returns the new AST; the original is not changed. It runs
+# the passes below in turn.
+#
+# Constant folding
+# ----------------
+# Operators whose operands are all constants are worked out once, here,
+# instead of every time the program runs them:
+#
+#   * `BinopAexp`s and `RelopBexp`s over `IntAexp`s are folded into their
+#     value (an `IntAexp`, or a truth value for a condition).
+#   * `x * 1`, `1 * x`, `x / 1`, `x + 0`, `0 + x` and `x - 0` become `x`;
+#     `x * 0` and `0 * x` become `0`.
+#   * `not not b` becomes `b`, and `and` and `or` with a constant side
+#     become the other side or a constant.
+#   * An `IfStatement` whose condition is constant becomes the branch it
+#     takes, and a `WhileStatement` whose condition is always false is
+#     removed. (A loop which never ends is left as it is.)
+#
+# Conditions are only ever used for their truth value, so a condition is
+# free to be replaced by another with the same truth value (`b and 1 < 2`
+# by `b`). There is no AST node for a constant truth value: folding a
+# condition gives a node and the constant it always has, if any, and the
+# node is kept wherever the constant cannot be used directly.
+#
+# Running a program can fail, on a division by zero or an unknown operator.
+# An expression which might fail is never folded away (`x / 0 * 0` stays as
+# it is), so an optimized program fails exactly where the original does.
+#
+# Loop-invariant code motion
+# --------------------------
+# An arithmetic expression inside a `WhileStatement` (in its condition or
+# anywhere in its body) which reads no variable the loop assigns has the
+# same value on every iteration. It is worked out once, into a temporary
+# variable assigned just before the loop, and the loop reads the temporary:
+#
+#   while i < n * n do i := i + (a + b) * c end
+#
+# becomes
+#
+#   $t0 := n * n; $t1 := (a + b) * c; while i < $t0 do i := i + $t1 end
+#
+# Inner loops are done first, and the largest invariant expressions are
+# taken. Expressions which might fail are left in place, since the loop
+# might never have run them.
+#
+# Common subexpression elimination
+# --------------------------------
+# Within a run of assignments (a basic block: nothing in it is skipped or
+# repeated), an expression which is worked out again, with none of its
+# variables assigned in between, is worked out once into a temporary:
+#
+#   x := (a + b) * 2; y := (a + b) * 3
+#
+# becomes
+#
+#   $t0 := a + b; x := $t0 * 2; y := $t0 * 3
+#
+# Dead store elimination
+# ----------------------
+# An assignment is dead if the variable is assigned again, on every path
+# through the program, before anything reads it: it can be removed without
+# changing the results. Which variables might still be read (are "live")
+# at each point is worked out backwards from the end of the program, where
+# the output variables are live. By default every variable the program
+# assigns is an output, since they are all printed; `optimize(ast,
+# outputs)` takes the names of the variables whose final values matter,
+# and then assignments to any others are dead unless they are read. An
+# `IfStatement` left with nothing to do is removed too.
+#
+# At a loop the live variables are found by going round until they no
+# longer change: what is live at the top of the loop is what is live after
+# it, what its condition reads, and what is live at the top of its body
+# when the top of the loop follows it. Assignments which might fail are
+# never removed.
+#
+# Temporaries
+# -----------
+# Temporaries are named `$t0`, `$t1` and so on, which no IMP program can
+# use, so they never clash with the program's own variables. They are left
+# in the `env` a program runs in; `remove_temporaries(env)` takes them out
+# again.
+
+import gc
+
+from imp_ast import *
+
+TEMPORARY_PREFIX = '$'
+
+# The passes make new nodes, and tables of them, in proportion to the size
+# of the program. As in `ast_cache.load_ast`, Python's cycle collector is
+# switched off while they run: it would look at every object still alive
+# every few hundred new ones, so a large program would take time growing
+# with the square of its size. ASTs have no cycles.
+def optimize(ast, outputs=None):
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        temporaries = Temporaries(ast)
+        if outputs is None:
+            outputs = temporaries.taken
+        ast = fold_statement(ast)
+        ast = move_invariants(ast, temporaries)
+        ast = share_subexpressions(ast, temporaries)
+        return remove_dead_stores(ast, set(outputs))
+    finally:
+        if enabled:
+            gc.enable()
+
+def fold_statement(node):
+    kind = node.__class__
+    if kind is AssignStatement:
+        return AssignStatement(node.name, fold_aexp(node.aexp))
+    elif kind is BlockStatement or kind is CompoundStatement:
+        if kind is BlockStatement:
+            children = node.statements
+        else:
+            children = [node.first, node.second]
+        statements = []
+        for child in children:
+            statement = fold_statement(child)
+            if statement.__class__ is BlockStatement:
+                statements.extend(statement.statements)
+            else:
+                statements.append(statement)
+        return make_block(statements)
+    elif kind is IfStatement:
+        condition, value = fold_bexp(node.condition)
+        if value is True:
+            return fold_statement(node.true_stmt)
+        elif value is False:
+            if node.false_stmt:
+                return fold_statement(node.false_stmt)
+            return make_block([])
+        false_stmt = node.false_stmt and fold_statement(node.false_stmt)
+        return IfStatement(condition, fold_statement(node.true_stmt), false_stmt)
+    elif kind is WhileStatement:
+        condition, value = fold_bexp(node.condition)
+        if value is False:
+            return make_block([])
+        return WhileStatement(condition, fold_statement(node.body))
+    else:
+        raise RuntimeError('cannot optimize statement: %r' % node)
+
+# Like `imp_parser.process_block`, a block of one statement is that statement
+def make_block(statements):
+    if len(statements) == 1:
+        return statements[0]
+    return BlockStatement(statements)
+
+def fold_aexp(node):
+    if node.__class__ is not BinopAexp:
+        return node
+    op = node.op
+    left = fold_aexp(node.left)
+    right = fold_aexp(node.right)
+    left_value = constant(left)
+    right_value = constant(right)
+    if op not in binop_functions or (op == '/' and right_value in (None, 0)):
+        pass
+    elif left_value is not None and right_value is not None:
+        return IntAexp(binop_functions[op](left_value, right_value))
+    elif right_value == 1 and op in ('*', '/') or right_value == 0 and op in ('+', '-'):
+        return left
+    elif left_value == 1 and op == '*' or left_value == 0 and op == '+':
+        return right
+    elif op == '*' and (right_value == 0 and not can_fail(left) or
+                        left_value == 0 and not can_fail(right)):
+        return IntAexp(0)
+    return BinopAexp(op, left, right)
+
+# Returns (node, value): the folded condition, and the truth value it
+# always has, or None if that is not known.
+def fold_bexp(node):
+    kind = node.__class__
+    if kind is RelopBexp:
+        left = fold_aexp(node.left)
+        right = fold_aexp(node.right)
+        folded = RelopBexp(node.op, left, right)
+        left_value = constant(left)
+        right_value = constant(right)
+        if node.op in relop_functions and left_value is not None and right_value is not None:
+            return folded, bool(relop_functions[node.op](left_value, right_value))
+        return folded, None
+    elif kind is NotBexp:
+        exp, value = fold_bexp(node.exp)
+        if value is not None:
+            value = not value
+        if exp.__class__ is NotBexp:
+            return exp.exp, value
+        return NotBexp(exp), value
+    elif kind is AndBexp or kind is OrBexp:
+        left, left_value = fold_bexp(node.left)
+        right, right_value = fold_bexp(node.right)
+        # `and` is decided by a false side, and otherwise is the other side;
+        # `or` the same way round
+        deciding = kind is OrBexp
+        if left_value is not None and right_value is not None:
+            if deciding:
+                return kind(left, right), left_value or right_value
+            return kind(left, right), left_value and right_value
+        elif left_value is not None:
+            if left_value != deciding:
+                return right, right_value
+            if not can_fail(right):
+                return kind(left, right), deciding
+        elif right_value is not None:
+            if right_value != deciding:
+                return left, left_value
+            if not can_fail(left):
+                return kind(left, right), deciding
+        return kind(left, right), None
+    else:
+        raise RuntimeError('cannot optimize condition: %r' % node)
+
+# The value of a constant arithmetic expression, or None.
+def constant(node):
+    if node.__class__ is IntAexp:
+        return node.i
+    return None
+
+# Whether evaluating an expression might raise an error: a division by
+# anything but a non-zero constant, or an unknown operator.
+def can_fail(node):
+    kind = node.__class__
+    if kind is BinopAexp:
+        if node.op not in binop_functions or \
+           node.op == '/' and constant(node.right) in (None, 0):
+            return True
+        return can_fail(node.left) or can_fail(node.right)
+    elif kind is RelopBexp:
+        return node.op not in relop_functions or \
+               can_fail(node.left) or can_fail(node.right)
+    elif kind is AndBexp or kind is OrBexp:
+        return can_fail(node.left) or can_fail(node.right)
+    elif kind is NotBexp:
+        return can_fail(node.exp)
+    return False
+
+# Temporaries
+
+def is_temporary(name):
+    return name.startswith(TEMPORARY_PREFIX)
+
+def remove_temporaries(env):
+    for name in [name for name in env if is_temporary(name)]:
+        del env[name]
+
+# Gives out the names of new temporaries for a program.
+class Temporaries:
+    def __init__(self, ast):
+        self.taken = assigned_variables(ast)
+        self.count = 0
+
+    def new(self):
+        while True:
+            name = '%st%d' % (TEMPORARY_PREFIX, self.count)
+            self.count += 1
+            if name not in self.taken:
+                return name
+
+# Loop-invariant code motion
+
+def move_invariants(node, temporaries):
+    kind = node.__class__
+    if kind is BlockStatement or kind is CompoundStatement:
+        return make_block(flatten([move_invariants(child, temporaries)
+                                   for child in children(node)]))
+    elif kind is IfStatement:
+        false_stmt = node.false_stmt and move_invariants(node.false_stmt, temporaries)
+        return IfStatement(node.condition, move_invariants(node.true_stmt, temporaries),
+                           false_stmt)
+    elif kind is WhileStatement:
+        body = flatten([move_invariants(node.body, temporaries)])
+        # Temporaries of inner loops which are invariant here too move on
+        # out, as they are
+        statements = []
+        while True:
+            assigned = assigned_variables(make_block(body))
+            moving = [statement for statement in body
+                      if statement.__class__ is AssignStatement and
+                         is_temporary(statement.name) and
+                         not (variables(statement.aexp) & assigned)]
+            if not moving:
+                break
+            statements.extend(moving)
+            body = [statement for statement in body if statement not in moving]
+        loop = WhileStatement(node.condition, make_block(body))
+        invariants = []
+        for aexp in statement_aexps(loop):
+            find_invariants(aexp, assigned, invariants)
+        names = {}
+        for invariant in invariants:
+            if invariant not in names:
+                names[invariant] = temporaries.new()
+                statements.append(AssignStatement(names[invariant], invariant))
+        if names:
+            loop = map_aexps(loop, lambda aexp: replace(aexp, names))
+        return make_block(statements + [loop])
+    return node
+
+# Adds the largest invariant subexpressions of `aexp` to `invariants`.
+def find_invariants(aexp, assigned, invariants):
+    if aexp.__class__ is not BinopAexp:
+        return
+    if not can_fail(aexp) and not (variables(aexp) & assigned):
+        invariants.append(aexp)
+    else:
+        find_invariants(aexp.left, assigned, invariants)
+        find_invariants(aexp.right, assigned, invariants)
+
+# Common subexpression elimination
+
+def share_subexpressions(node, temporaries):
+    kind = node.__class__
+    if kind is AssignStatement:
+        return make_block(share_in_run([node], temporaries))
+    elif kind is BlockStatement or kind is CompoundStatement:
+        statements = []
+        run = []
+        for child in flatten(children(node)) + [None]:
+            if child.__class__ is AssignStatement:
+                run.append(child)
+                continue
+            statements.extend(share_in_run(run, temporaries))
+            run = []
+            if child is not None:
+                statements.append(share_subexpressions(child, temporaries))
+        return make_block(flatten(statements))
+    elif kind is IfStatement:
+        false_stmt = node.false_stmt and share_subexpressions(node.false_stmt, temporaries)
+        return IfStatement(node.condition, share_subexpressions(node.true_stmt, temporaries),
+                           false_stmt)
+    elif kind is WhileStatement:
+        return WhileStatement(node.condition, share_subexpressions(node.body, temporaries))
+    return node
+
+# A subexpression worked out again while it still has the same value.
+class Repeat:
+    def __init__(self, aexp, start):
+        self.aexp = aexp
+        self.start = start
+        self.repeated = False
+        self.name = None
+
+# Returns the run of assignments `run` with its repeated subexpressions
+# worked out into temporaries.
+def share_in_run(run, temporaries):
+    # Find the repeats. `current` holds the repeat of each subexpression
+    # which still has the value it was first worked out with, and `readers`
+    # those subexpressions by the variables they read.
+    current = {}
+    readers = {}
+    uses = []
+    for index, statement in enumerate(run):
+        used = {}
+        pending = [statement.aexp]
+        while pending:
+            aexp = pending.pop()
+            if aexp.__class__ is not BinopAexp:
+                continue
+            if can_fail(aexp):
+                pending.extend([aexp.right, aexp.left])
+                continue
+            repeat = current.get(aexp)
+            if repeat is None:
+                repeat = current[aexp] = Repeat(aexp, index)
+                for name in variables(aexp):
+                    readers.setdefault(name, []).append(aexp)
+                pending.extend([aexp.right, aexp.left])
+            else:
+                # The whole of it will be replaced, so its parts are not
+                # used again here
+                repeat.repeated = True
+            used[aexp] = repeat
+        uses.append(used)
+        for aexp in readers.pop(statement.name, []):
+            current.pop(aexp, None)
+
+    # Work each repeated subexpression out into a temporary before the
+    # statement it is first used in, smaller ones first
+    starting = {}
+    for used in uses:
+        for repeat in used.itervalues():
+            if repeat.repeated:
+                repeats = starting.setdefault(repeat.start, [])
+                if repeat not in repeats:
+                    repeats.append(repeat)
+    statements = []
+    for index, statement in enumerate(run):
+        used = uses[index]
+        for repeat in sorted(starting.get(index, ()), key=lambda repeat: size(repeat.aexp)):
+            repeat.name = temporaries.new()
+            names = dict((aexp, other.name) for aexp, other in used.items()
+                         if other.name is not None and other is not repeat)
+            statements.append(AssignStatement(repeat.name, replace(repeat.aexp, names)))
+        names = dict((aexp, repeat.name) for aexp, repeat in used.items()
+                     if repeat.name is not None)
+        statements.append(AssignStatement(statement.name, replace(statement.aexp, names)))
+    return statements
+
+# Dead store elimination
+
+def remove_dead_stores(node, live):
+    live = set(name for name in live if not is_temporary(name))
+    return remove_dead(node, live, [])
+
+# Returns `node` without its dead assignments, given the variables `live`
+# after it, and changes `live` into the variables live before it.
+#
+# Making a new set of live variables at every statement would take time in
+# proportion to the number of variables, at every statement. Instead there
+# is one set, changed in place, and each change is written down in
+# `journal` as (name, whether it was live before). Each branch of an `if`
+# is worked out from what is live after the `if`, so the changes of the
+# first branch are undone before the second, and then the changes of both
+# are made (see `changes` and `undo`).
+def remove_dead(node, live, journal):
+    kind = node.__class__
+    if kind is AssignStatement:
+        if node.name not in live and not can_fail(node.aexp):
+            return make_block([])
+        kill(live, node.name, journal)
+        for name in variables(node.aexp):
+            gen(live, name, journal)
+        return node
+    elif kind is BlockStatement or kind is CompoundStatement:
+        statements = []
+        for child in reversed(children(node)):
+            statements.append(remove_dead(child, live, journal))
+        return make_block(flatten(reversed(statements)))
+    elif kind is IfStatement:
+        mark = len(journal)
+        true_stmt = remove_dead(node.true_stmt, live, journal)
+        true_added, true_removed = changes(live, journal, mark)
+        undo(live, journal, mark)
+        if node.false_stmt:
+            false_stmt = remove_dead(node.false_stmt, live, journal)
+            false_added, false_removed = changes(live, journal, mark)
+            undo(live, journal, mark)
+        else:
+            false_stmt, false_added, false_removed = None, set(), set()
+        if is_empty(true_stmt) and (false_stmt is None or is_empty(false_stmt)) and \
+           not can_fail(node.condition):
+            return make_block([])
+        if false_stmt is not None and is_empty(false_stmt):
+            false_stmt = None
+        for name in true_removed & false_removed:
+            kill(live, name, journal)
+        for name in true_added | false_added | variables(node.condition):
+            gen(live, name, journal)
+        return IfStatement(node.condition, true_stmt, false_stmt)
+    elif kind is WhileStatement:
+        for name in variables(node.condition):
+            gen(live, name, journal)
+        while True:
+            mark = len(journal)
+            body = remove_dead(node.body, live, journal)
+            added = changes(live, journal, mark)[0]
+            undo(live, journal, mark)
+            if not added:
+                break
+            for name in added:
+                gen(live, name, journal)
+        return WhileStatement(node.condition, body)
+    else:
+        raise RuntimeError('cannot optimize statement: %r' % node)
+
+# `name` is assigned: it is not live before.
+def kill(live, name, journal):
+    if name in live:
+        live.remove(name)
+        journal.append((name, True))
+
+# `name` is read: it is live before.
+def gen(live, name, journal):
+    if name not in live:
+        live.add(name)
+        journal.append((name, False))
+
+# The variables which have become live, and those which have stopped being
+# live, since `journal` was `mark` long.
+def changes(live, journal, mark):
+    added = set()
+    removed = set()
+    seen = set()
+    for name, was_live in journal[mark:]:
+        if name in seen:
+            continue
+        seen.add(name)
+        if was_live and name not in live:
+            removed.add(name)
+        elif not was_live and name in live:
+            added.add(name)
+    return added, removed
+
+# Undoes the changes made to `live` since `journal` was `mark` long.
+def undo(live, journal, mark):
+    for name, was_live in reversed(journal[mark:]):
+        if was_live:
+            live.add(name)
+        else:
+            live.discard(name)
+    del journal[mark:]
+
+def is_empty(node):
+    return node.__class__ is BlockStatement and not node.statements
+
+# Walking and rewriting ASTs (see also the walkers at the end of `imp_ast`)
+
+def size(node):
+    return sum(1 for aexp in subexpressions(node))
+
+# The top level arithmetic expressions in a statement: right hand sides of
+# assignments and sides of comparisons.
+def statement_aexps(node):
+    result = []
+    map_aexps(node, lambda aexp: result.append(aexp) or aexp)
+    return result
+
+# Returns a statement or condition with `function(aexp)` in place of each of
+# its top level arithmetic expressions.
+def map_aexps(node, function):
+    kind = node.__class__
+    if kind is AssignStatement:
+        return AssignStatement(node.name, function(node.aexp))
+    elif kind is BlockStatement or kind is CompoundStatement:
+        return make_block([map_aexps(child, function) for child in children(node)])
+    elif kind is IfStatement:
+        false_stmt = node.false_stmt and map_aexps(node.false_stmt, function)
+        return IfStatement(map_aexps(node.condition, function),
+                           map_aexps(node.true_stmt, function), false_stmt)
+    elif kind is WhileStatement:
+        return WhileStatement(map_aexps(node.condition, function),
+                              map_aexps(node.body, function))
+    elif kind is RelopBexp:
+        return RelopBexp(node.op, function(node.left), function(node.right))
+    elif kind is AndBexp or kind is OrBexp:
+        return kind(map_aexps(node.left, function), map_aexps(node.right, function))
+    elif kind is NotBexp:
+        return NotBexp(map_aexps(node.exp, function))
+    else:
+        raise RuntimeError('cannot optimize: %r' % node)
+
+# Returns `aexp` with each of the largest subexpressions which are keys of
+# `names` replaced by the variable named there.
+def replace(aexp, names):
+    if aexp in names:
+        return VarAexp(names[aexp])
+    if aexp.__class__ is BinopAexp:
+        return BinopAexp(aexp.op, replace(aexp.left, names), replace(aexp.right, names))
+    return aexp
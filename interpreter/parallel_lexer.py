@@ -0,0 +1,85 @@
+# parallel_lexer.py
+# -----------------
+# Lexes very large sources on several cores at once.
+#
+# The source is cut into chunks at newlines. A newline can never be part of
+# a comment (comments run up to, but not including, the newline) and the only
+# other token which can contain one is whitespace, which is dropped. So at a
+# newline the lexer is always between tokens, or inside whitespace which
+# lexes the same either way, and each chunk can be lexed on its own. The
+# token expressions must have that property for the results to be the same
+# as lexing serially; IMP's do.
+#
+# The chunks are handed to a `multiprocessing` pool and lexed with the DFA
+# lexer. The source itself is not sent to the workers: it is stored in a
+# module global before the pool is started, so the forked workers inherit it
+# (for an `mmap`, they share the same pages). Each worker returns the kind
+# codes and offsets of its tokens as raw `array` bytes, and the results are
+# appended to one `TokenStream` in chunk order.
+
+import multiprocessing
+from array import array
+
+import dfa_lexer
+from token_stream import *
+
+# The source being lexed, inherited by the worker processes.
+_source = None
+
+# Returns (start, end) offsets of about `count` chunks of `characters`, each
+# ending just after a newline (or at the end of the source).
+def split_chunks(characters, count):
+    end = len(characters)
+    starts = [0]
+    for i in range(1, count):
+        target = max(end * i // count, starts[-1])
+        newline = characters.find('\n', target)
+        if newline < 0:
+            break
+        if newline + 1 > starts[-1] and newline + 1 < end:
+            starts.append(newline + 1)
+    return zip(starts, starts[1:] + [end])
+
+def _lex_chunk(args):
+    token_exprs, start, end = args
+    # A `LexerError` is raised again in the parent by `pool.map`
+    tokens = dfa_lexer.dfa_lex(_source, token_exprs, start, end)
+    kinds = zip(kind_texts, kind_tags)
+    return (kinds,
+            tokens.codes.tostring(),
+            tokens.starts.tostring(),
+            tokens.ends.tostring())
+
+# Lexes `characters` (a string or `mmap`) with `processes` worker processes
+# (default: one per core) and returns a `TokenStream` identical to the one
+# `dfa_lexer.dfa_lex` would return.
+def parallel_lex(characters, token_exprs, processes=None, chunks_per_process=4):
+    global _source
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    # Register the kind codes before forking so the workers agree with us
+    dfa_lexer.compile_dfa(token_exprs)
+    chunks = split_chunks(characters, processes * chunks_per_process)
+    _source = characters
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_lex_chunk,
+                           [(token_exprs, start, end) for start, end in chunks])
+    finally:
+        pool.close()
+        pool.join()
+        _source = None
+
+    tokens = TokenStream(characters)
+    for result in results:
+        kinds, codes, starts, ends = result
+        chunk_codes = array('i')
+        chunk_codes.fromstring(codes)
+        # Only needed if a worker assigned kind codes in a different order
+        if kinds != zip(kind_texts, kind_tags)[:len(kinds)]:
+            remap = [kind_code(tag, text) for text, tag in kinds]
+            chunk_codes = array('i', [remap[code] for code in chunk_codes])
+        tokens.codes.extend(chunk_codes)
+        tokens.starts.fromstring(starts)
+        tokens.ends.fromstring(ends)
+    return tokens
@@ -2,6 +2,6 @@ import sys
 import unittest
 
 if __name__ == '__main__':
-    test_names = ['test_lexer', 'test_combinators', 'test_eval', 'test_imp_parser']
+    test_names = ['test_lexer', 'test_dfa_lexer', 'test_parallel_lexer', 'test_incremental', 'test_combinators', 'test_grammar_compiler', 'test_eval', 'test_vm', 'test_optimizer', 'test_ast_cache', 'test_imp_parser', 'test_batch']
     suite = unittest.defaultTestLoader.loadTestsFromNames(test_names)
     result = unittest.TextTestRunner().run(suite)
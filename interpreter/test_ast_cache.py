@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+import ast_cache
+from imp_lexer import *
+from imp_parser import *
+from ast_cache import *
+
+class TestAstCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def roundtrip_test(self, ast):
+        self.assertEquals(ast, load_ast(dump_ast(ast)))
+
+    def test_roundtrip(self):
+        code = 'x := 1; if x < 2 and not y = 3 or z >= 4 then y := (x + 1) * 2 / 3 - 4 ' \
+               'else while x != 0 do x := x - 1 end end; if x > 0 then y := 1 end'
+        self.roundtrip_test(imp_parse(imp_lex(code)).value)
+        self.roundtrip_test(IntAexp(12345678901234567890))
+        self.roundtrip_test(CompoundStatement(AssignStatement('x', IntAexp(-1)), BlockStatement([])))
+
+    def test_unicode(self):
+        # As parsed from text read through `io` or `json`
+        ast = imp_parse(imp_lex(u'x := 1; if x < 2 then y := x * 2 end')).value
+        data = dump_ast(ast)
+        self.assertTrue(isinstance(data, str))
+        self.assertEquals(ast, load_ast(data))
+        self.assertEquals(str, type(load_ast(data).statements[0].name))
+        self.roundtrip_test(AssignStatement(u'\xfcber', VarAexp(u'\u03b1')))
+        self.assertEquals(u'\u03b1', load_ast(dump_ast(VarAexp(u'\u03b1'))).name)
+
+    def test_long_block(self):
+        ast = BlockStatement([AssignStatement('x%d' % (i % 7), VarAexp('y')) for i in range(20000)])
+        self.roundtrip_test(ast)
+
+    def test_bad_data(self):
+        data = dump_ast(imp_parse(imp_lex('x := 1; y := x')).value)
+        self.assertRaises(ValueError, lambda: load_ast(data[:-1]))
+        self.assertRaises(ValueError, lambda: load_ast('IMPX' + data[4:]))
+        self.assertRaises(ValueError, lambda: load_ast(''))
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_load_program(self):
+        filename = self.write('test.imp', 'x := 1; y := x + 2')
+        expected = imp_parse(imp_lex('x := 1; y := x + 2')).value
+        self.assertEquals(expected, load_program(filename))
+        cache_dir = os.path.join(self.directory, CACHE_DIR_NAME)
+        self.assertEquals(1, len(os.listdir(cache_dir)))
+        # The second run must not lex or parse
+        parse = ast_cache.imp_parse_stream
+        ast_cache.imp_parse_stream = None
+        try:
+            self.assertEquals(expected, load_program(filename))
+        finally:
+            ast_cache.imp_parse_stream = parse
+        # A changed program is parsed again
+        self.write('test.imp', 'x := 2')
+        self.assertEquals(AssignStatement('x', IntAexp(2)), load_program(filename))
+        self.assertEquals(2, len(os.listdir(cache_dir)))
+
+    def test_load_program_streams(self):
+        # The program is lexed from the file, not read into memory first
+        code = ';\n'.join('x%d := %d' % (i, i) for i in range(5000))
+        filename = self.write('long.imp', code)
+        sources = []
+        lex_stream = ast_cache.imp_lex_stream
+        def recording(source):
+            sources.append(source)
+            return lex_stream(source)
+        ast_cache.imp_lex_stream = recording
+        try:
+            self.assertEquals(imp_parse(imp_lex(code)).value, load_program(filename))
+        finally:
+            ast_cache.imp_lex_stream = lex_stream
+        self.assertEquals(1, len(sources))
+        self.assertFalse(isinstance(sources[0], basestring))
+        with open(filename, 'rb') as f:
+            self.assertEquals(cache_path(filename, code), cache_path(filename, f))
+
+    def test_interpreter_changed(self):
+        filename = self.write('test.imp', 'x := 1')
+        path = cache_path(filename, 'x := 1')
+        digest = ast_cache.interpreter_digest()
+        ast_cache._interpreter_digest[:] = [digest + 'changed']
+        try:
+            self.assertNotEquals(path, cache_path(filename, 'x := 1'))
+        finally:
+            ast_cache._interpreter_digest[:] = [digest]
+        self.assertEquals(path, cache_path(filename, 'x := 1'))
+
+    def test_parse_error(self):
+        filename = self.write('bad.imp', 'x := ')
+        self.assertEquals(None, load_program(filename, self.directory))
+        self.assertEquals(['bad.imp'], os.listdir(self.directory))
+
+    def test_corrupt_cache(self):
+        filename = self.write('test.imp', 'x := 1')
+        path = cache_path(filename, 'x := 1')
+        load_program(filename)
+        with open(path, 'w') as f:
+            f.write('garbage')
+        self.assertEquals(AssignStatement('x', IntAexp(1)), load_program(filename))
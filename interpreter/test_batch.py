@@ -0,0 +1,85 @@
+import unittest
+import imp_ast
+from imp_lexer import *
+from imp_parser import *
+from imp_batch import *
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestBatch(unittest.TestCase):
+    # Runs `code` as a batch over `inputs` (a dict of variable names to
+    # lists), and checks each lane against `eval` on that lane's input.
+    def batch_test(self, code, inputs, dtype=None):
+        program = imp_parse(imp_lex(code)).value
+        columns = dict((name, numpy.array(values, dtype=dtype))
+                       for name, values in inputs.items())
+        result = run_batch(program, columns)
+        for index in range(len(inputs.values()[0])):
+            env = dict((name, values[index]) for name, values in inputs.items())
+            program.eval(env)
+            self.assertEquals(env, lane(result, index))
+        return result
+
+    def test_expressions(self):
+        self.batch_test('x := (a + 3) * b - a / 2; y := b / a; z := 0 - a / 3',
+                        {'a': [1, -7, 5, -1, 9], 'b': [2, 3, -4, 0, 7]})
+
+    def test_if(self):
+        result = self.batch_test('if a < b and not a = 0 then x := a else if a > 3 or b = 1 then ' \
+                                 'y := b end end', {'a': [0, 1, 5, 7, 2], 'b': [1, 2, 3, 9, 2]})
+        self.assertTrue(isinstance(result['x'], numpy.ma.MaskedArray))
+
+    def test_while(self):
+        self.batch_test('p := 1; while n > 0 do p := p * n; n := n - 1 end',
+                        {'n': [0, 1, 5, 3, 10]})
+        self.batch_test('while i < n do j := 0; while j < i do s := s + j; j := j + 1 end; ' \
+                        'i := i + 1 end', {'n': [0, 3, 6, 1], 'i': [0, 0, 2, 5]})
+
+    def test_unassigned(self):
+        result = self.batch_test('x := y; if a > 0 then z := w + 1 end', {'a': [1, 0, 2]})
+        self.assertEquals([0, 0, 0], result['x'].tolist())
+
+    def test_division_by_zero(self):
+        self.batch_test('if b != 0 then x := a / b end; if b = 0 or a / b > 1 then y := 1 end',
+                        {'a': [6, -5, 3], 'b': [4, 0, -2]})
+        program = imp_parse(imp_lex('x := a / b')).value
+        columns = {'a': numpy.array([1, 2]), 'b': numpy.array([1, 0])}
+        self.assertRaises(ZeroDivisionError, run_batch, program, columns)
+        program = imp_parse(imp_lex('if b = 0 or a / b > 1 then y := 1 end')).value
+        imp_ast.short_circuit = False
+        try:
+            self.assertRaises(ZeroDivisionError, run_batch, program, columns)
+        finally:
+            imp_ast.short_circuit = True
+
+    def test_big_integers(self):
+        self.batch_test('while i < 70 do x := x * 2 + 1; i := i + 1 end',
+                        {'i': [0, 60, 69], 'x': [0, 1, 2]}, dtype=object)
+
+    def test_overflow(self):
+        # Fixed size columns go on to Python ints where `eval` would
+        self.batch_test('while i < 70 do x := x * 2 + 1; i := i + 1 end',
+                        {'i': [0, 60, 69], 'x': [0, 1, 2]})
+        big = 2 ** 62
+        code = 'x := a * a; y := a + a; z := 0 - a - a; w := a / (0 - 1); v := a * (0 - 1)'
+        result = self.batch_test(code, {'a': [3, big, -2 * big]})
+        self.assertEquals(numpy.dtype(object), result['y'].dtype)
+        self.batch_test(code, {'a': [3, 2 ** 31 - 1, -2 ** 31]}, dtype=numpy.int32)
+        self.batch_test(code, {'a': [3, 2 ** 64 - 1]}, dtype=numpy.uint64)
+        # Lanes which don't run an overflowing expression don't count
+        result = self.batch_test('if a < 10 then x := a * a end', {'a': [3, big]})
+        self.assertEquals(numpy.dtype(numpy.int64), result['x'].dtype)
+        # A bound which grows past int64 while the values don't is not an
+        # overflow
+        result = self.batch_test('while i < 40 do x := x * 4 / 4 + 1; i := i + 1 end',
+                                 {'i': [0, 20, 39], 'x': [1, 2, 3]})
+        self.assertEquals(numpy.dtype(numpy.int64), result['x'].dtype)
+
+    def test_unknown_operator(self):
+        program = AssignStatement('x', BinopAexp('%', VarAexp('a'), IntAexp(2)))
+        self.assertRaises(RuntimeError, run_batch, program, {'a': numpy.array([1])})
+
+    def test_columns(self):
+        program = imp_parse(imp_lex('x := 1')).value
+        self.assertRaises(ValueError, run_batch, program, {})
+        self.assertRaises(ValueError, run_batch, program,
+                          {'a': numpy.array([1, 2]), 'b': numpy.array([1])})
@@ -33,6 +33,16 @@ class TestCombinators(unittest.TestCase):
         parser = id + id + id
         self.combinator_test('x y z', parser, (('x', 'y'), 'z'))
 
+    def test_seq(self):
+        parser = Seq(id, keyword(':='), integer)
+        self.combinator_test('x := 1', parser, ('x', ':=', '1'))
+        self.assertEquals(None, parser(imp_lex('x := y'), 0))
+
+    def test_parse(self):
+        parser = Seq(id, Opt(integer)) ^ (lambda parsed: parsed[0])
+        self.assertEquals(('x', 1), parser.parse(imp_lex('x'), 0))
+        self.assertEquals(None, parser.parse(imp_lex('12'), 0))
+
     def test_exp(self):
         separator = keyword('+') ^ (lambda x: lambda l, r: l + r)
         parser = Exp(id, separator)
@@ -45,6 +55,25 @@ class TestCombinators(unittest.TestCase):
         parser = id * separator
         self.combinator_test('x + y + z', parser, 'xyz')
 
+    def test_precedence(self):
+        combine = lambda op: lambda l, r: '(%s %s %s)' % (l, op, r)
+        levels = [[keyword('*'), keyword('/')], [keyword('+'), keyword('-')], [keyword('and')]]
+        parser = Precedence(id, levels, combine)
+        stacked = id
+        for level in levels:
+            stacked = stacked * (reduce(lambda l, r: l | r, level) ^ combine)
+        for code in ['x', 'x + y * z', 'x * y + z * w - v', 'x - y - z and w / v',
+                     'x + y * and z', 'x + y *', 'x and y + ( - z']:
+            tokens = imp_lex(code)
+            self.assertEquals(stacked(tokens, 0).__dict__, parser(tokens, 0).__dict__)
+            self.assertEquals(stacked(list(tokens), 0).__dict__,
+                              parser(list(tokens), 0).__dict__)
+        self.combinator_test('x + y * z - w', parser, '((x + (y * z)) - w)')
+        # A combining function can turn operands down
+        refuse = lambda op: lambda l, r: None if r == 'z' else '(%s %s %s)' % (l, op, r)
+        parser = Precedence(id, levels, refuse)
+        self.assertEquals(('(x + y)', 3), parser.parse(imp_lex('x + y * z'), 0))
+
     def test_alternate(self):
         parser = Alternate(id, integer)
         self.combinator_test('x', parser, 'x')
@@ -54,6 +83,51 @@ class TestCombinators(unittest.TestCase):
         parser = id | integer
         self.combinator_test('x', parser, 'x')
 
+    def test_first_set(self):
+        first = first_set(Opt(keyword('-')) + integer | Rep(id) | (keyword('(') + id))
+        self.assertTrue(first.empty)
+        self.assertFalse(first_set(id + Parser()).anything)
+        self.assertTrue(first_set(Parser() + id).anything)
+        first = first_set(Seq(Opt(keyword('-')), integer) | Lazy(lambda: keyword('(') + id))
+        self.assertEquals(set([INT]), first.tags)
+        self.assertEquals(set([('-', RESERVED), ('(', RESERVED)]), first.literals)
+        self.assertFalse(first.anything)
+
+    def test_dispatch(self):
+        parser = Dispatch(Seq(id, keyword(':='), integer) ^ (lambda p: 'assign'),
+                          Seq(keyword('if'), id) ^ (lambda p: 'if'),
+                          Seq(id, id) ^ (lambda p: 'pair'),
+                          Opt(integer) ^ (lambda p: 'number'))
+        self.combinator_test('x := 1', parser, 'assign')
+        self.combinator_test('x y', parser, 'pair')
+        self.combinator_test('if x', parser, 'if')
+        self.combinator_test('12', parser, 'number')
+        self.combinator_test(':=', parser, 'number')
+        self.combinator_test('', parser, 'number')
+        tokens = imp_lex('if x')
+        self.assertEquals('if', parser(list(tokens), 0).value)
+
+    def test_dispatch_attempts(self):
+        class Counted(Reserved):
+            def parse(self, tokens, pos):
+                attempts.append(pos)
+                return Reserved.parse(self, tokens, pos)
+        attempts = []
+        statement = Dispatch(Seq(Counted('if', RESERVED), id),
+                             Seq(Counted('while', RESERVED), id),
+                             Seq(Counted('do', RESERVED), id))
+        parser = Rep(statement)
+        for tokens in [imp_lex('do x while y if z do w'), list(imp_lex('do x while y'))]:
+            del attempts[:]
+            result = parser(tokens, 0)
+            self.assertEquals(len(tokens), result.pos)
+            self.assertEquals(range(0, len(tokens), 2), attempts)
+
+    def test_packrat_dispatch(self):
+        parser = packrat(Dispatch(keyword('if') + id, id, integer))
+        self.combinator_test('if x', parser, ('if', 'x'))
+        self.combinator_test('12', parser, '12')
+
     def test_opt(self):
         parser = Opt(id)
         self.combinator_test('x', parser, 'x')
@@ -72,6 +146,12 @@ class TestCombinators(unittest.TestCase):
         parser = integer ^ int
         self.combinator_test('12', parser, 12)
 
+    def test_filter(self):
+        parser = Filter(integer ^ int, lambda i: i > 1)
+        self.combinator_test('12', parser, 12)
+        self.assertEquals(None, parser(imp_lex('1'), 0))
+        self.assertEquals(None, parser(imp_lex('x'), 0))
+
     def test_lazy(self):
         def get_parser():
             return id
@@ -80,4 +160,57 @@ class TestCombinators(unittest.TestCase):
 
     def test_phrase(self):
         parser = Phrase(id)
-        self.combinator_test('x', parser, 'x')
\ No newline at end of file
+        self.combinator_test('x', parser, 'x')
+
+    def test_token_window(self):
+        parser = Phrase(Rep(id))
+        tokens = TokenWindow(iter(imp_lex('x y z')))
+        result = parser(tokens, 0)
+        self.assertEquals(['x', 'y', 'z'], result.value)
+        tokens.release(2)
+        self.assertEquals(('z', ID), tokens[2])
+        self.assertRaises(RuntimeError, lambda: tokens[1])
+
+    def test_packrat(self):
+        calls = []
+        def count(value):
+            calls.append(value)
+            return value
+        term = id ^ count
+        parser = packrat((term + keyword('+') + term) | (term + keyword('-') + term))
+        self.combinator_test('x - y', parser, (('x', '-'), 'y'))
+        self.assertEquals(['x', 'y'], calls)
+
+    def test_packrat_process(self):
+        parser = packrat(Opt(integer ^ int) + (integer ^ int) | (integer ^ int))
+        self.combinator_test('12', parser, 12)
+        self.combinator_test('1 2', parser, (1, 2))
+
+    def test_packrat_lazy(self):
+        def get_parser():
+            return (keyword('(') + Lazy(get_parser) + keyword(')') ^ (lambda p: p[0][1])) | id
+        parser = packrat(Lazy(get_parser))
+        self.combinator_test('(((x)))', parser, 'x')
+
+    def test_packrat_seq(self):
+        parser = packrat(Seq(id, integer) | Seq(id, id))
+        self.combinator_test('x y', parser, ('x', 'y'))
+        self.assertTrue(isinstance(parser.parser.parser.left.parser.parsers[0], Memo))
+
+    def test_memo_table_size(self):
+        table = MemoTable(max_size=2)
+        parser = Memo(Rep(Memo(id, table)), table)
+        self.combinator_test('x y z', parser, ['x', 'y', 'z'])
+        self.assertTrue(len(table.results) <= 2)
+
+    def test_rule(self):
+        built = []
+        @rule
+        def parser():
+            built.append(True)
+            return id
+        self.assertTrue(parser() is parser())
+        self.assertEquals(1, len(built))
+        parser.clear()
+        parser()
+        self.assertEquals(2, len(built))
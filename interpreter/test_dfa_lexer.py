@@ -0,0 +1,55 @@
+import unittest
+from StringIO import StringIO
+from lexer import lex
+from dfa_lexer import *
+
+KEYWORD = 'KEYWORD'
+OP = 'OP'
+INT = 'INT'
+ID = 'ID'
+token_exprs = [
+    (r'[ \t\n]+', None),
+    (r'#[^\n]*', None),
+    (r'keyword', KEYWORD),
+    (r'<=', OP),
+    (r'<', OP),
+    (r'[0-9]+', INT),
+    (r'[A-Za-z][A-Za-z0-9_]*', ID)
+]
+
+class TestDfaLexer(unittest.TestCase):
+    def lexer_test(self, code, expected):
+        actual = list(dfa_lex(code, token_exprs))
+        self.assertEquals(expected, actual)
+
+    def test_empty(self):
+        self.lexer_test('', [])
+
+    def test_same_as_regex_lexer(self):
+        code = 'abc keyword 123 <= < # comment\nx1<=y_2'
+        self.lexer_test(code, lex(code, token_exprs))
+
+    def test_keyword_lookup(self):
+        dfa = compile_dfa(token_exprs)
+        self.assertEquals({6: {'keyword': kind_code(KEYWORD, 'keyword')}}, dfa.keywords)
+        self.lexer_test('keyword', [('keyword', KEYWORD)])
+
+    def test_longest_match(self):
+        self.lexer_test('keywords', [('keywords', ID)])
+        self.lexer_test('<=<', [('<=', OP), ('<', OP)])
+
+    def test_repeat_and_branch(self):
+        exprs = [(r'a{2,3}', ID), (r'b|cd', INT), (r'(?:x?y)+', OP)]
+        self.assertEquals([('aaa', ID), ('aa', ID), ('cd', INT), ('b', INT), ('yxy', OP)],
+                          list(dfa_lex('aaaaacdbyxy', exprs)))
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, lambda: compile_dfa([(r'^a', ID)]))
+
+    def test_stream(self):
+        code = 'keywords keyword <= 123 # comment\nabc<<=x_1 keyword'
+        expected = list(dfa_lex(code, token_exprs))
+        self.assertEquals(expected, list(dfa_lex_stream(code, token_exprs)))
+        for chunk_size in [1, 2, 3, 7, 100]:
+            actual = list(dfa_lex_stream(StringIO(code), token_exprs, chunk_size))
+            self.assertEquals(expected, actual)
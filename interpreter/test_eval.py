@@ -1,4 +1,5 @@
 import unittest
+import imp_ast
 from imp_lexer import *
 from imp_parser import *
 
@@ -11,6 +12,11 @@ class TestEvaluation(unittest.TestCase):
         env = {}
         program.eval(env)
         self.assertEquals(expected_env, env)
+        compiled_env = {}
+        compile_program(program)(compiled_env)
+        self.assertEquals(expected_env, compiled_env)
+        stream_result = imp_parse_stream(imp_lex_stream(code))
+        self.assertEquals(program, stream_result.value)
 
     def test_assign(self):
         self.program_test('x := 1', {'x': 1})
@@ -19,4 +25,112 @@ class TestEvaluation(unittest.TestCase):
         self.program_test('x := 1; y:= 2', {'x': 1, 'y': 2})
 
     def test_if(self):
-        self.program_test('if 1 < 2 then x := 1 else x :=2 end', {'x': 1})
\ No newline at end of file
+        self.program_test('if 1 < 2 then x := 1 else x :=2 end', {'x': 1})
+
+    def test_while(self):
+        self.program_test('n := 5; p := 1; while n > 0 do p := p * n; n := n - 1 end',
+                          {'n': 0, 'p': 120})
+
+    def test_nested_while(self):
+        code = 'i := 0; while i < 10 do j := 0; while j < i do s := s + j; j := j + 1 end; ' \
+               'i := i + 1 end'
+        self.program_test(code, {'i': 10, 'j': 9, 's': 120})
+
+    def test_expressions(self):
+        code = 'x := (7 - y) / 2 * 3; if not x >= 9 or x != 9 and 1 = 1 then z := x + x else z := 1 end'
+        self.program_test(code, {'x': 9, 'z': 1})
+
+    def test_unknown_operator(self):
+        program = BinopAexp('%', IntAexp(1), IntAexp(2))
+        self.assertRaises(RuntimeError, program.eval, {})
+        compiled = compile_program(program)
+        self.assertRaises(RuntimeError, compiled, {})
+
+    def test_unassigned(self):
+        self.program_test('x := y; z := y + 1', {'x': 0, 'z': 1})
+        self.program_test('if y = 0 then x := 0 end', {'x': 0})
+        self.program_test('while x < 3 do x := x + 1 end; w := v', {'x': 3, 'w': 0})
+
+    def test_initial_env(self):
+        program = imp_parse(imp_lex('y := x + 1; z := w')).value
+        env = {'x': 1, 'a': 2}
+        compile_program(program)(env)
+        self.assertEquals({'x': 1, 'a': 2, 'y': 2, 'z': 0}, env)
+
+    def test_short_circuit(self):
+        code = 'if x != 0 and 10 / x > 1 then y := 1 end; if x = 0 or 10 / x > 1 then z := 1 end'
+        self.program_test(code, {'z': 1})
+        program = imp_parse(imp_lex(code)).value
+        imp_ast.short_circuit = False
+        try:
+            self.assertRaises(ZeroDivisionError, program.eval, {})
+            self.assertRaises(ZeroDivisionError, compile_program(program), {})
+            self.program_test('x := 5; ' + code, {'x': 5, 'y': 1, 'z': 1})
+        finally:
+            imp_ast.short_circuit = True
+
+    def test_short_circuit_value(self):
+        code = 'if (1 < 2 or x / 0 = 1) and not (2 < 1 and x / 0 = 1) then y := 1 end'
+        self.program_test(code, {'y': 1})
+
+    # Runs `code` with and without counted loops, checking the results match
+    # and that its last statement is a loop which counts (or not).
+    def counted_test(self, code, expected_env, counts=True, sums=True):
+        program = imp_parse(imp_lex(code)).value
+        loop = program.statements[-1] if isinstance(program, BlockStatement) else program
+        counted = loop.counted()
+        self.assertEquals(counts, counted is not None)
+        if counted:
+            self.assertEquals(sums, counted.sums is not None)
+        self.program_test(code, expected_env)
+        imp_ast.count_loops = False
+        try:
+            self.program_test(code, expected_env)
+        finally:
+            imp_ast.count_loops = True
+
+    def test_counted_loops(self):
+        self.counted_test('i := 0; while i < 10 do x := i * i; i := i + 1 end',
+                          {'i': 10, 'x': 81}, sums=False)
+        self.counted_test('i := 0; n := 7; while n >= i do x := x + i * 2; i := i + 3 end',
+                          {'i': 9, 'n': 7, 'x': 18}, sums=False)
+        self.counted_test('i := 10; while i > 0 - 5 do x := i; i := i - 4 end',
+                          {'i': -6, 'x': -2}, sums=False)
+        self.counted_test('i := 5; while i <= 4 do x := 1; i := i + 1 end', {'i': 5}, sums=False)
+        self.counted_test('while i < 3 do x := x - i; i := 1 + i end', {'i': 3, 'x': -3})
+        self.counted_test('n := 4; while i < n * 2 do while j < i do j := j + 1 end; ' \
+                          'i := i + 1 end', {'i': 8, 'j': 7, 'n': 4}, sums=False)
+
+    def test_counted_sums(self):
+        self.counted_test('k := 3; while i < 100 do s := s + i; t := t + k; u := u - 2; ' \
+                          's := s + 1; i := i + 1 end',
+                          {'i': 100, 'k': 3, 's': 5050, 't': 300, 'u': -200})
+        self.counted_test('i := 20; while i >= 3 do s := s + i; i := i - 3 end',
+                          {'i': 2, 's': 75})
+        self.counted_test('while i < 0 do s := s + i; i := i + 1 end', {})
+
+    def test_counted_sums_closed_form(self):
+        program = imp_parse(imp_lex('while i < 10000000000 do s := s + i; i := i + 1 end')).value
+        expected_env = {'i': 10000000000, 's': 49999999995000000000}
+        env = {}
+        program.eval(env)
+        self.assertEquals(expected_env, env)
+        env = {}
+        compile_program(program)(env)
+        self.assertEquals(expected_env, env)
+
+    def test_uncounted_loops(self):
+        self.counted_test('while i < 10 do i := i + 2; x := i end', {'i': 10, 'x': 10}, False)
+        self.counted_test('n := 10; while i < n do n := n - 1; i := i + 1 end',
+                          {'i': 5, 'n': 5}, False)
+        self.counted_test('while i < 10 do i := i * 2 + 1 end', {'i': 15}, False)
+        self.counted_test('while i < 10 do if i > 3 then i := i + 1 end; i := i + 1 end',
+                          {'i': 10}, False)
+        self.counted_test('while i != 10 do i := i + 1 end', {'i': 10}, False)
+
+    def test_counted_failure(self):
+        code = 'while i < 5 do x := 10 / (3 - i); i := i + 1 end'
+        env = {}
+        program = imp_parse(imp_lex(code)).value
+        self.assertRaises(ZeroDivisionError, program.eval, env)
+        self.assertEquals({'i': 3, 'x': 10}, env)
@@ -0,0 +1,102 @@
+import unittest
+from imp_lexer import *
+from imp_parser import *
+from grammar_compiler import *
+
+integer = Tag(INT)
+
+class TestGrammarCompiler(unittest.TestCase):
+    # Checks the compiled parser against the original, on a `TokenStream`
+    # and on a list of tuples.
+    def compiler_test(self, code, parser, expected):
+        compiled = compile_parser(parser)
+        tokens = imp_lex(code)
+        for tokens in [tokens, list(tokens)]:
+            self.assertEquals(expected, parser.parse(tokens, 0))
+            self.assertEquals(expected, compiled.parse(tokens, 0))
+
+    def test_primitives(self):
+        self.compiler_test('x', id, ('x', 1))
+        self.compiler_test('if', keyword('if'), ('if', 1))
+        self.compiler_test('x', keyword('if'), None)
+
+    def test_sequences(self):
+        self.compiler_test('x := 1', Seq(id, keyword(':='), integer), (('x', ':=', '1'), 3))
+        self.compiler_test('x y', id + id, (('x', 'y'), 2))
+        self.compiler_test('x 1', id + id, None)
+
+    def test_alternate(self):
+        parser = any_operator_in_list(['+', '-']) | id | integer
+        self.compiler_test('-', parser, ('-', 1))
+        self.compiler_test('12', parser, ('12', 1))
+        self.compiler_test(':=', parser, None)
+
+    def test_reserved_plain_tag(self):
+        # A token of the plain RESERVED kind still matches by its text
+        tokens = TokenStream('+')
+        tokens.append(kind_code(RESERVED), 0, 1)
+        compiled = compile_parser(any_operator_in_list(['+', '-']))
+        self.assertEquals(('+', 1), compiled.parse(tokens, 0))
+
+    def test_dispatch(self):
+        parser = Dispatch(Seq(id, keyword(':='), integer),
+                          keyword('if') + id,
+                          id + id,
+                          Opt(integer))
+        self.compiler_test('x := 1', parser, (('x', ':=', '1'), 3))
+        self.compiler_test('x y', parser, (('x', 'y'), 2))
+        self.compiler_test('if x', parser, (('if', 'x'), 2))
+        self.compiler_test('12', parser, ('12', 1))
+        self.compiler_test(':=', parser, (None, 0))
+        self.compiler_test('', parser, (None, 0))
+
+    def test_dispatch_literal_and_tag(self):
+        # A keyword can also start a choice which takes any reserved word
+        reserved = Tag(RESERVED)
+        for parser in [Dispatch(Seq(keyword('if'), id), Seq(reserved, integer)),
+                       Dispatch(Seq(reserved, integer), Seq(keyword('if'), id))]:
+            self.compiler_test('if 1', parser, (('if', '1'), 2))
+            self.compiler_test('if x', parser, (('if', 'x'), 2))
+            self.compiler_test('+ 1', parser, (('+', '1'), 2))
+
+    def test_repetition(self):
+        self.compiler_test('x y 1', Rep(id), (['x', 'y'], 2))
+        self.compiler_test('1', Opt(id) + integer, ((None, '1'), 1))
+        separator = keyword('+') ^ (lambda x: lambda l, r: l + r)
+        self.compiler_test('x + y + 1', Exp(id, separator), ('xy', 3))
+        self.compiler_test('x y', Phrase(Rep(id)), (['x', 'y'], 2))
+        self.compiler_test('x 1', Phrase(Rep(id)), None)
+
+    def test_precedence(self):
+        combine = lambda op: lambda l, r: (op, l, r)
+        parser = Precedence(id, [[keyword('*')], [keyword('+'), keyword('-')]], combine)
+        self.compiler_test('x + y * z - w', parser, (('-', ('+', 'x', ('*', 'y', 'z')), 'w'), 7))
+        self.compiler_test('x * y + *', parser, (('*', 'x', 'y'), 3))
+        refuse = lambda op: lambda l, r: None if r == 'z' else (op, l, r)
+        parser = Precedence(id, [[keyword('*')], [keyword('+')]], refuse)
+        self.compiler_test('x + y * z', parser, (('+', 'x', 'y'), 3))
+
+    def test_filter(self):
+        parser = Seq(id, Filter(integer ^ int, lambda i: i > 1))
+        self.compiler_test('x 12', parser, (('x', 12), 2))
+        self.compiler_test('x 1', parser, None)
+
+    def test_lazy(self):
+        def get_parser():
+            return Seq(keyword('('), Lazy(get_parser), keyword(')')) ^ (lambda p: p[1]) | id
+        self.compiler_test('((x))', Lazy(get_parser), ('x', 5))
+
+    def test_other_parsers(self):
+        self.compiler_test('x', packrat(id), ('x', 1))
+
+    def test_imp(self):
+        for code in ['x := 1; if x < 2 and not y = 3 then y := (x + 1) * 2 else y := 0 end',
+                     'while (x > 0 or y <= 1) and z != 2 do x := x - 1 end',
+                     'x := 1;', 'x := (1']:
+            tokens = imp_lex(code)
+            expected = imp_parse(tokens)
+            result = imp_parse(tokens, compiled=True)
+            if expected is None:
+                self.assertEquals(None, result)
+            else:
+                self.assertEquals(expected.value, result.value)
@@ -1,4 +1,5 @@
 import unittest
+from StringIO import StringIO
 from imp_lexer import *
 from imp_parser import *
 
@@ -87,6 +88,118 @@ class TestImpParser(unittest.TestCase):
 
     def test_compound_stmt(self):
         code = 'x := 1; y := 2'
-        expected = CompoundStatement(AssignStatement('x', IntAexp(1)),
-                                     AssignStatement('y', IntAexp(2)))
-        self.parser_test(code, stmt_list(), expected)
\ No newline at end of file
+        expected = BlockStatement([AssignStatement('x', IntAexp(1)),
+                                   AssignStatement('y', IntAexp(2))])
+        self.parser_test(code, stmt_list(), expected)
+
+    def test_long_stmt_list(self):
+        # Far more statements than the recursion limit
+        code = ';\n'.join('x%d := %d' % (i, i) for i in range(5000))
+        ast = imp_parse(imp_lex(code)).value
+        self.assertEquals(5000, len(ast.statements))
+        self.assertEquals(AssignStatement('x4999', IntAexp(4999)), ast.statements[-1])
+        self.assertEquals(ast, imp_parse_stream(imp_lex(code)).value)
+        self.assertEquals(ast, imp_parse(imp_lex(code), compiled=True).value)
+        env = {}
+        ast.eval(env)
+        self.assertEquals(4999, env['x4999'])
+        self.assertTrue(repr(ast).startswith('BlockStatement([AssignStatement(x0, IntAexp(0)), '))
+
+    def test_packrat(self):
+        code = 'if ((((x < 1)))) and (((1) + 2) * 3 = 9) then x := (4) else while not x < 2 do x := 1 end end'
+        tokens = imp_lex(code)
+        self.assertEquals(imp_parse(tokens).value, imp_parse(tokens, packrat=True).value)
+
+    def test_groups(self):
+        # Arithmetic and boolean groups are told apart after parsing them
+        code = 'if ((x + 1) * 2 < 3 or (not (y) = 4)) and ((z < 5)) then x := ((1)) end'
+        condition = AndBexp(OrBexp(RelopBexp('<', BinopAexp('*', BinopAexp('+', VarAexp('x'), IntAexp(1)),
+                                                            IntAexp(2)), IntAexp(3)),
+                                   NotBexp(RelopBexp('=', VarAexp('y'), IntAexp(4)))),
+                            RelopBexp('<', VarAexp('z'), IntAexp(5)))
+        expected = IfStatement(condition, AssignStatement('x', IntAexp(1)), None)
+        for options in [{}, {'packrat': True}, {'compiled': True}]:
+            self.assertEquals(expected, imp_parse(imp_lex(code), **options).value)
+        for code in ['if (x) then x := 1 end', 'if (x < 1) + 2 < 3 then x := 1 end',
+                     'if x < (y < 1) then x := 1 end', 'if (x < 1) < 2 then x := 1 end',
+                     'if x < 1 and (2) then x := 1 end', 'if not (x) then x := 1 end',
+                     'x := (x < 1)', 'x := 1 + (x < 1)']:
+            for options in [{}, {'packrat': True}, {'compiled': True}]:
+                self.assertEquals(None, imp_parse(imp_lex(code), **options))
+
+    def test_nested_groups(self):
+        # Each level of parentheses is parsed once
+        calls = []
+        rule = aexp_group()
+        parse = rule.parse
+        def counted(tokens, pos):
+            calls.append(pos)
+            return parse(tokens, pos)
+        rule.parse = counted
+        try:
+            imp_parse(imp_lex('if ' + '(' * 50 + 'x < 1' + ')' * 50 + ' then x := 1 end'))
+        finally:
+            del rule.parse
+        self.assertEquals(50, len(calls))
+
+    def test_grammar_is_shared(self):
+        self.assertTrue(stmt_list() is stmt_list())
+        self.assertTrue(keyword('if') is keyword('if'))
+        first = imp_parse(imp_lex('x := 1; y := (x + 2) * 3')).value
+        second = imp_parse(imp_lex('x := 1; y := (x + 2) * 3')).value
+        self.assertEquals(first, second)
+
+    def test_node_equality(self):
+        node = BinopAexp('+', VarAexp('x'), IntAexp(1))
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertEquals(node, BinopAexp('+', VarAexp('x'), IntAexp(1)))
+        self.assertNotEquals(node, BinopAexp('-', VarAexp('x'), IntAexp(1)))
+        self.assertNotEquals(node, BinopAexp('+', VarAexp('x'), IntAexp(2)))
+        self.assertNotEquals(node, RelopBexp('+', VarAexp('x'), IntAexp(1)))
+        self.assertNotEquals(VarAexp('x'), 'x')
+        self.assertEquals(BlockStatement([AssignStatement('x', node)]),
+                          BlockStatement([AssignStatement('x', node)]))
+
+    def test_node_hash(self):
+        first = imp_parse(imp_lex('x := 1; if x < n then y := x + 1 end')).value
+        second = imp_parse(imp_lex('x := 1; if x < n then y := x + 1 end')).value
+        self.assertEquals(hash(first), hash(second))
+        self.assertEquals({first: 1}[second], 1)
+
+    def test_hash_consing(self):
+        code = 'x := x + 1; while i < n do x := x + 1; i := i + 1 end; y := 2 * (x + 1)'
+        table = NodeTable()
+        tokens = imp_lex(code)
+        shared = imp_parse(tokens, table=table).value
+        self.assertEquals(imp_parse(tokens).value, shared)
+        first, loop, last = shared.statements
+        self.assertTrue(loop.body.statements[0] is first)
+        self.assertTrue(last.aexp.right is first.aexp)
+        self.assertTrue(imp_parse(tokens, compiled=True, table=table).value is shared)
+        self.assertTrue(imp_parse_stream(imp_lex_stream(code), table).value is shared)
+        # Nodes made outside the table are not shared
+        self.assertFalse(imp_parse(tokens).value.statements[0] is first)
+
+    def test_shared_nodes_compare_in_constant_time(self):
+        # Far too deep to compare field by field within the recursion limit
+        table = NodeTable()
+        terms = ' + x' * 5000
+        first = imp_parse(imp_lex('y := 1' + terms), table=table).value
+        second = imp_parse(imp_lex('y := 2' + terms), table=table).value
+        self.assertFalse(first == second)
+        self.assertTrue(first != second)
+        self.assertTrue(first.aexp.right == second.aexp.right)
+        # Nodes of different tables or none still compare by their fields
+        small = imp_parse(imp_lex('y := 1 + x'), table=table).value
+        self.assertEquals(imp_parse(imp_lex('y := 1 + x'), table=NodeTable()).value, small)
+        self.assertEquals(imp_parse(imp_lex('y := 1 + x')).value, small)
+        self.assertNotEquals(imp_parse(imp_lex('y := 2 + x')).value, small)
+
+    def test_lex_stream(self):
+        code = 'android := 1; ifx := android + 2; if orx <= 3 then endx := 0 end'
+        tokens = list(imp_lex(code))
+        self.assertEquals(('android', ID), tokens[0])
+        self.assertEquals(tokens, list(imp_lex_stream(code)))
+        self.assertEquals(tokens, list(imp_lex_stream(StringIO(code))))
+        program = imp_parse(imp_lex(code)).value
+        self.assertEquals(program, imp_parse_stream(imp_lex_stream(StringIO(code))).value)
@@ -0,0 +1,142 @@
+import random
+import unittest
+from dfa_lexer import ILLEGAL, LexerError, dfa_lex
+from incremental import *
+
+code = '''x := 1;
+# count up
+while x < 10 do
+    x := x + 1
+end;
+if x = 10 then y := 2 else y := 3 end'''
+
+class TestIncremental(unittest.TestCase):
+    def edit_test(self, program, offset, deleted, inserted):
+        program.edit(offset, deleted, inserted)
+        ast = program.ast
+        tokens = dfa_lex(program.text, token_exprs, errors=True)
+        self.assertEquals(tokens, program.tokens)
+        self.assertEquals(list(tokens.starts), list(program.tokens.starts))
+        result = imp_parse(tokens)
+        if result:
+            self.assertEquals(result.value, ast)
+        else:
+            self.assertEquals(None, ast)
+        return ast
+
+    def test_initial_parse(self):
+        program = IncrementalProgram(code)
+        self.assertEquals(imp_parse(imp_lex(code)).value, program.ast)
+
+    def test_edit_reuses_statements(self):
+        program = IncrementalProgram(code)
+        loop, branch = program.statements[1:]
+        self.edit_test(program, code.index('1'), 1, '42')
+        self.assertEquals(AssignStatement('x', IntAexp(42)), program.statements[0])
+        self.assertTrue(program.statements[1] is loop)
+        self.assertTrue(program.statements[2] is branch)
+
+    def test_edit_comment(self):
+        program = IncrementalProgram(code)
+        ast = program.ast
+        self.assertTrue(self.edit_test(program, code.index('count'), 5, 'loop') is ast)
+
+    def test_broken_then_fixed(self):
+        program = IncrementalProgram(code)
+        self.assertEquals(None, self.edit_test(program, code.index('end;'), 4, ''))
+        self.assertEquals(None, self.edit_test(program, 0, 0, 'z := 0; '))
+        ast = self.edit_test(program, program.text.index('if'), 0, 'end;\n')
+        self.assertEquals(imp_parse(imp_lex('z := 0; ' + code)).value, ast)
+
+    def test_insert_and_delete_statements(self):
+        program = IncrementalProgram(code)
+        self.edit_test(program, len(code), 0, ';\nz := x * y')
+        self.edit_test(program, 0, 0, 'a := 1; b := 2;\n')
+        self.edit_test(program, 0, program.text.index('x'), '')
+        self.assertEquals(code + ';\nz := x * y', program.text)
+
+    def test_random_edits(self):
+        random.seed(0)
+        program = IncrementalProgram(code)
+        texts = {'ID': ['q', 'x', 'abc'], 'INT': ['7', '123']}
+        for _ in range(200):
+            pos = random.randrange(len(program.tokens))
+            tag = program.tokens.tag(pos)
+            text = program.tokens.text(pos)
+            if tag in texts:
+                replacement = random.choice(texts[tag])
+            elif text == ';':
+                replacement = random.choice([';', '; y := 2;', ';;'])
+            else:
+                replacement = random.choice([text, text, ''])
+            start = program.tokens.starts[pos]
+            self.edit_test(program, start, program.tokens.ends[pos] - start,
+                           replacement)
+
+    def test_random_characters(self):
+        # Small blocks, and edits which cut through tokens, comments and `;`
+        random.seed(1)
+        program = IncrementalProgram(';\n'.join([code] * 10))
+        program.block_size = 2
+        pieces = ['x', '1', ' ', '\n', ';', '#', 'end', 'if', ' := ', '+']
+        for _ in range(300):
+            offset = random.randrange(len(program.text) + 1)
+            deleted = random.choice([0, 0, 1, 3])
+            deleted = min(deleted, len(program.text) - offset)
+            self.edit_test(program, offset, deleted, random.choice(pieces + ['']))
+
+    def test_edit_work_is_flat(self):
+        # A keystroke re-lexes and re-parses as much text in a large one line
+        # buffer as in a small one (benchmark.py times it)
+        def edit_work(statements):
+            text = '; '.join('x%05d := x%05d + 1' % (i, i) for i in range(statements))
+            program = IncrementalProgram(text)
+            parsed = []
+            parse = program.parse
+            def counted(text, final):
+                parsed.append(len(text))
+                return parse(text, final)
+            program.parse = counted
+            offset = text.index('+ 1', len(text) // 2) + 2
+            for digit in '1234567890':
+                program.edit(offset, 1, digit)
+            self.assertEquals(imp_parse(imp_lex(program.text)).value, program.ast)
+            return parsed
+        work = edit_work(100)
+        self.assertEquals(10, len(work))
+        self.assertEquals(work, edit_work(10000))
+
+    def test_illegal_character(self):
+        program = IncrementalProgram(code)
+        offset = code.index('= 10')
+        program.edit(offset, 1, ':')
+        self.assertEquals(None, program.ast)
+        index = list(program.tokens.starts).index(offset)
+        self.assertEquals(ILLEGAL, program.tokens.tag(index))
+        program.edit(offset, 0, '?')
+        self.assertEquals(None, program.ast)
+        program.edit(offset, 2, '=')
+        self.assertEquals(imp_parse(imp_lex(code)).value, program.ast)
+        program = IncrementalProgram('x := 1; y : 2')
+        self.assertEquals(None, program.ast)
+        program.edit(len('x := 1; y :'), 0, '=')
+        self.assertEquals(imp_parse(imp_lex('x := 1; y := 2')).value, program.ast)
+
+    def test_empty_buffer(self):
+        program = IncrementalProgram('')
+        self.assertEquals(None, self.edit_test(program, 0, 0, 'x'))
+        self.assertEquals(None, self.edit_test(program, 1, 0, ' :'))
+        ast = self.edit_test(program, 3, 0, '= 1')
+        self.assertEquals(imp_parse(imp_lex('x := 1')).value, ast)
+        # Emptied by an edit, then typed into again
+        program = IncrementalProgram('x := 1')
+        self.assertEquals(None, self.edit_test(program, 0, 6, ''))
+        self.assertEquals(None, self.edit_test(program, 0, 0, 'y'))
+        self.assertEquals(AssignStatement('y', IntAexp(2)), self.edit_test(program, 1, 0, ' := 2'))
+        program = IncrementalProgram('x := 1; y := 2')
+        self.assertEquals(None, self.edit_test(program, 8, 6, ''))
+        ast = self.edit_test(program, 8, 0, 'z := 3')
+        self.assertEquals(imp_parse(imp_lex('x := 1; z := 3')).value, ast)
+
+    def test_lexer_error(self):
+        self.assertRaises(LexerError, imp_lex, 'x := 1 ? 2')
@@ -1,4 +1,5 @@
 import unittest
+from StringIO import StringIO
 from lexer import *
 
 KEYWORD = 'KEYWORD'
@@ -32,4 +33,27 @@ class TestLexer(unittest.TestCase):
     def test_id_space(self):
         self.lexer_test('abc def', [('abc', ID), ('def', ID)])
 
-    
+    def test_first_expression_wins(self):
+        self.lexer_test('keywords', [('keyword', KEYWORD), ('s', ID)])
+
+    def test_comment(self):
+        self.lexer_test('abc # def\n12', [('abc', ID), ('12', INT)])
+
+    def test_stream_chunk_boundaries(self):
+        code = 'abc keyword 123 # comment\nxyz'
+        expected = lex(code, token_exprs)
+        for chunk_size in range(1, len(code) + 1):
+            actual = list(lex_stream(StringIO(code), token_exprs, chunk_size))
+            self.assertEquals(expected, actual)
+
+    def test_token_stream(self):
+        code = 'abc keyword 123 # comment\nxyz'
+        tokens = lex_token_stream(code, token_exprs)
+        self.assertEquals(lex(code, token_exprs), list(tokens))
+        self.assertEquals(kind_code(KEYWORD, 'keyword'), tokens.codes[1])
+        self.assertEquals(kind_code(ID), tokens.codes[0])
+        self.assertEquals('123', str(tokens.view(2)))
+
+    def test_literal_text(self):
+        self.assertEquals(':=', literal_text(r'\:='))
+        self.assertEquals(None, literal_text(r'[0-9]+'))
@@ -0,0 +1,153 @@
+import unittest
+from imp_lexer import *
+from imp_parser import *
+from optimizer import *
+
+class TestOptimizer(unittest.TestCase):
+    def parse(self, code):
+        return imp_parse(imp_lex(code)).value
+
+    # Checks the optimized program, and that it gives the same results as
+    # the original. Temporaries are written `tmp0`, `tmp1`... in
+    # `expected_code`, since `$t0` does not parse.
+    def optimizer_test(self, code, expected_code, env=None):
+        program = self.parse(code)
+        optimized = optimize(program)
+        self.assertEquals(repr(self.parse(expected_code)),
+                          repr(optimized).replace(TEMPORARY_PREFIX + 't', 'tmp'))
+        expected_env = dict(env or {})
+        program.eval(expected_env)
+        optimized_env = dict(env or {})
+        optimized.eval(optimized_env)
+        remove_temporaries(optimized_env)
+        self.assertEquals(expected_env, optimized_env)
+
+    def test_fold_binop(self):
+        self.optimizer_test('x := 2 * 3 + 0', 'x := 6')
+        self.optimizer_test('x := (10 - 4) / 4 * y', 'x := y')
+        self.optimizer_test('x := 7 / 2 + y', 'x := 3 + y')
+
+    def test_simplify(self):
+        self.optimizer_test('x := y * 1; z := 1 * y + 0; w := y / 1 - 0', 'x := y; z := y; w := y')
+        self.optimizer_test('x := y * 0 + (0 * (y + 1))', 'x := 0')
+        self.optimizer_test('x := 0 - y', 'x := 0 - y')
+
+    def test_errors_kept(self):
+        for code in ['y := x / 0 * 0', 'y := 1 / 0', 'y := 0 * (x / y)',
+                     'if 1 > 2 and x / y = 1 then z := 1 end']:
+            program = self.parse(code)
+            self.assertEquals(program, optimize(program))
+
+    def test_fold_if(self):
+        self.optimizer_test('if 1 < 2 then x := 1 else x := 2 end', 'x := 1')
+        self.optimizer_test('if 2 * 2 != 4 then x := 1 else x := 2; y := 3 end; z := 4',
+                            'x := 2; y := 3; z := 4')
+        self.optimizer_test('x := 5; if 3 = 4 then x := 1 end', 'x := 5')
+        self.optimizer_test('if x < 1 then y := 3 - 3 end', 'if x < 1 then y := 0 end')
+
+    def test_fold_while(self):
+        self.optimizer_test('x := 1; while 1 < 0 do x := x + 1 end; y := 2', 'x := 1; y := 2')
+        self.optimizer_test('while x < 2 * 5 do x := x + 1 end', 'while x < 10 do x := x + 1 end')
+
+    def test_fold_logic(self):
+        self.optimizer_test('if not not x < 1 then y := 1 end', 'if x < 1 then y := 1 end')
+        self.optimizer_test('if x < 1 and 1 < 2 then y := 1 end', 'if x < 1 then y := 1 end')
+        self.optimizer_test('if 1 = 1 or x < 1 then y := 1 end', 'y := 1')
+        self.optimizer_test('if x < 1 and not 1 < 2 then y := 1 else y := 2 end', 'y := 2')
+        self.optimizer_test('if x < 1 or 2 < 1 then y := 1 end', 'if x < 1 then y := 1 end')
+
+    def test_empty_program(self):
+        program = optimize(self.parse('if 1 > 2 then x := 1 end'))
+        self.assertEquals(BlockStatement([]), program)
+        env = {}
+        program.eval(env)
+        self.assertEquals({}, env)
+
+    def test_loop_invariants(self):
+        self.optimizer_test('i := 0; while i < n * n do i := i + (a + b) * c end',
+                            'i := 0; tmp0 := n * n; tmp1 := (a + b) * c; '
+                            'while i < tmp0 do i := i + tmp1 end',
+                            {'n': 3, 'a': 1, 'b': 2, 'c': 3})
+        # Expressions reading variables the loop assigns stay put
+        self.optimizer_test('while i < n do n := n - 1; x := n * 2 + i end',
+                            'while i < n do n := n - 1; x := n * 2 + i end', {'n': 5})
+        self.optimizer_test('while i < n do i := i + 1; x := (a + i) + (a + 1) end',
+                            'tmp0 := a + 1; while i < n do i := i + 1; x := (a + i) + tmp0 end',
+                            {'n': 5, 'a': 2})
+
+    def test_nested_loop_invariants(self):
+        self.optimizer_test('while i < 10 do j := 0; while j < 10 do s := s + k * k; '
+                            'j := j + 1 end; i := i + 1 end',
+                            'tmp0 := k * k; while i < 10 do j := 0; while j < 10 do '
+                            's := s + tmp0; j := j + 1 end; i := i + 1 end',
+                            {'k': 3})
+        self.optimizer_test('while i < 10 do j := 0; while j < 10 do s := s + i * i; '
+                            'j := j + 1 end; i := i + 1 end',
+                            'while i < 10 do j := 0; tmp0 := i * i; while j < 10 do '
+                            's := s + tmp0; j := j + 1 end; i := i + 1 end')
+
+    def test_loop_invariants_might_fail(self):
+        program = self.parse('while i < 0 do i := n / m end')
+        self.assertEquals(program, optimize(program))
+
+    def test_common_subexpressions(self):
+        self.optimizer_test('x := (a + b) * 2; y := (a + b) * 3',
+                            'tmp0 := a + b; x := tmp0 * 2; y := tmp0 * 3', {'a': 1, 'b': 2})
+        self.optimizer_test('x := (a + b) * c; y := (a + b) * c; z := a + b',
+                            'tmp0 := a + b; tmp1 := tmp0 * c; x := tmp1; y := tmp1; z := tmp0',
+                            {'a': 1, 'b': 2, 'c': 3})
+        self.optimizer_test('x := a * a + a * a', 'tmp0 := a * a; x := tmp0 + tmp0', {'a': 4})
+
+    def test_common_subexpressions_killed(self):
+        self.optimizer_test('x := a + b; a := 1; y := a + b', 'x := a + b; a := 1; y := a + b')
+        self.optimizer_test('x := a + b; a := a + b; y := a + b',
+                            'tmp0 := a + b; x := tmp0; a := tmp0; y := a + b', {'a': 2, 'b': 3})
+        # Only within a run of assignments
+        self.optimizer_test('x := a + b; if x < 1 then y := 1 end; z := a + b',
+                            'x := a + b; if x < 1 then y := 1 end; z := a + b')
+
+    def test_temporary_names(self):
+        program = optimize(self.parse('x := a * a + a * a'))
+        again = optimize(program)
+        self.assertEquals(program, optimize(self.parse('x := a * a + a * a')))
+        env = {}
+        again.eval(env)
+        self.assertEquals({'x': 0}, dict((name, value) for name, value in env.items()
+                                         if not is_temporary(name)))
+
+    def test_dead_stores(self):
+        self.optimizer_test('x := 1; x := 2', 'x := 2')
+        self.optimizer_test('x := 1; y := x; x := 2', 'x := 1; y := x; x := 2')
+        self.optimizer_test('x := a; if b < 1 then x := 1 else x := 2 end',
+                            'if b < 1 then x := 1 else x := 2 end')
+        self.optimizer_test('x := a; if b < 1 then x := 1 end', 'x := a; if b < 1 then x := 1 end')
+        # The first store is read by the next iteration
+        self.optimizer_test('while i < 3 do y := x; x := i; i := i + 1 end',
+                            'while i < 3 do y := x; x := i; i := i + 1 end')
+        self.optimizer_test('while i < 3 do x := i; x := i * 2; i := i + 1 end',
+                            'while i < 3 do x := i * 2; i := i + 1 end')
+
+    def test_dead_stores_might_fail(self):
+        program = self.parse('x := 1 / y; x := 2')
+        self.assertEquals(program, optimize(program))
+
+    # Checks that optimizing with the given outputs gives `expected_code`,
+    # and the same values of the outputs as the original program.
+    def outputs_test(self, code, outputs, expected_code):
+        program = self.parse(code)
+        optimized = optimize(program, outputs)
+        self.assertEquals(self.parse(expected_code), optimized)
+        env = {}
+        program.eval(env)
+        optimized_env = {}
+        optimized.eval(optimized_env)
+        for name in outputs:
+            self.assertEquals(env.get(name), optimized_env.get(name))
+
+    def test_outputs(self):
+        self.outputs_test('x := 1; y := x + 1; z := y * 2', ['z'], 'x := 1; y := x + 1; z := y * 2')
+        self.outputs_test('x := 1; y := 2; z := x', ['z'], 'x := 1; z := x')
+        self.outputs_test('x := 1; if x < 2 then y := 1 else y := 2 end; z := x', ['z'],
+                          'x := 1; z := x')
+        self.outputs_test('n := 5; while n > 0 do t := t + n; u := u + 1; n := n - 1 end',
+                          ['t'], 'n := 5; while n > 0 do t := t + n; n := n - 1 end')
@@ -0,0 +1,23 @@
+import unittest
+from imp_lexer import *
+from parallel_lexer import *
+
+class TestParallelLexer(unittest.TestCase):
+    def test_split_chunks(self):
+        code = 'a\nbb\nccc\n'
+        self.assertEquals([(0, 0)], split_chunks('', 4))
+        self.assertEquals([(0, 9)], split_chunks(code, 1))
+        self.assertEquals([(0, 5), (5, 9)], split_chunks(code, 2))
+        chunks = split_chunks(code, 10)
+        self.assertEquals(0, chunks[0][0])
+        self.assertEquals(9, chunks[-1][1])
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEquals(end, start)
+            self.assertEquals('\n', code[start - 1])
+
+    def test_same_as_serial(self):
+        code = '\n'.join(['x := 1; # set x\n  while x < 10 do x := x + 1 end;'] * 50) + \
+               '\ny := x'
+        expected = imp_lex(code)
+        self.assertEquals(expected, imp_lex_parallel(code, 2))
+        self.assertEquals(list(expected.starts), list(imp_lex_parallel(code, 3).starts))
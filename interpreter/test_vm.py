@@ -0,0 +1,132 @@
+import unittest
+import imp_ast
+from imp_lexer import *
+from imp_parser import *
+from imp_vm import *
+
+class TestVM(unittest.TestCase):
+    def program_test(self, code, expected_env):
+        program = imp_parse(imp_lex(code)).value
+        env = {}
+        program.eval(env)
+        self.assertEquals(expected_env, env)
+        vm_env = {}
+        run(compile_bytecode(program), vm_env)
+        self.assertEquals(expected_env, vm_env)
+
+    def test_assign(self):
+        self.program_test('x := 1', {'x': 1})
+
+    def test_compound(self):
+        self.program_test('x := 1; y:= 2', {'x': 1, 'y': 2})
+
+    def test_if(self):
+        self.program_test('if 1 < 2 then x := 1 else x :=2 end', {'x': 1})
+        self.program_test('if 1 > 2 then x := 1 else x :=2 end', {'x': 2})
+        self.program_test('if 1 > 2 then x := 1 end; y := x', {'y': 0})
+
+    def test_while(self):
+        self.program_test('n := 5; p := 1; while n > 0 do p := p * n; n := n - 1 end',
+                          {'n': 0, 'p': 120})
+        self.program_test('while 0 = 1 do x := 1 end', {})
+
+    def test_nested_while(self):
+        code = 'i := 0; while i < 10 do j := 0; while j < i do s := s + j; j := j + 1 end; ' \
+               'i := i + 1 end'
+        self.program_test(code, {'i': 10, 'j': 9, 's': 120})
+
+    def test_expressions(self):
+        code = 'x := (7 - y) / 2 * 3; if not x >= 9 or x != 9 and 1 = 1 then z := x + x else z := 1 end'
+        self.program_test(code, {'x': 9, 'z': 1})
+        self.program_test('x := 123456789012345678901234567890 * 2',
+                          {'x': 246913578024691357802469135780})
+
+    def test_operands(self):
+        code = 'x := 2; y := 3; z := x * y - (x + 1) * (y / x); ' \
+               'if 1 < x and not y = x then a := 1 end'
+        self.program_test(code, {'x': 2, 'y': 3, 'z': 3, 'a': 1})
+
+    def test_unknown_operator(self):
+        program = compile_bytecode(AssignStatement('x', BinopAexp('%', IntAexp(1), IntAexp(2))))
+        self.assertRaises(RuntimeError, run, program, {})
+
+    def test_disassemble(self):
+        program = compile_bytecode(imp_parse(imp_lex('x := 1; while x < 10 do x := x + 1 end')).value)
+        self.assertEquals('\n'.join(['   0 CONST             0 (1)',
+                                      '   2 STORE             0 (x)',
+                                      '   4 JUMP              3 (to 9)',
+                                      '   6 UPDATE_CONST      0    0 (x + 1)',
+                                      '   9 TEST_CONST        0   20   -7 (x < 10, to 6)']),
+                          disassemble(program))
+
+    def test_conditions(self):
+        # Conditions compiled into jumps, with and without short-circuiting
+        code = 'i := 0; while not (i >= 10 or i = n) and (i < m or m < 0) do ' \
+               'if i / 2 * 2 = i and not i > 6 then s := s + i else t := t - i end; ' \
+               'i := i + 1 end'
+        for n, m in [(5, '20'), (20, '7'), (20, '0 - 1'), (0, '0')]:
+            setup = 'n := %d; m := %s; ' % (n, m)
+            self.program_test(setup + code, eval_program(setup + code))
+        imp_ast.short_circuit = False
+        try:
+            self.program_test('n := 3; m := 1; ' + code, eval_program('n := 3; m := 1; ' + code))
+        finally:
+            imp_ast.short_circuit = True
+
+    def test_updates(self):
+        self.program_test('x := x + 1; y := y * x; z := z - y; x := x / 1', {'x': 1, 'y': 0, 'z': 0})
+        program = compile_bytecode(imp_parse(imp_lex('s := s + i; s := s - 1')).value)
+        self.assertEquals([UPDATE_LOAD, UPDATE_CONST],
+                          [program.code[0], program.code[3]])
+
+    def test_superinstructions(self):
+        code = 'i := 0; while i < 10 do if i / 2 * 2 = i then s := s + i else t := t + 1 end; ' \
+               'i := i + 1 end'
+        self.program_test(code, eval_program(code))
+        program = compile_bytecode(imp_parse(imp_lex(code)).value)
+        ops = [instruction[0] for instruction in decode(program)]
+        self.assertEquals([CONST, STORE, JUMP, LOAD_BINARY_CONST, BINARY_CONST, BINARY_CONST,
+                           BRANCH_LOAD, UPDATE_LOAD_JUMP, JUMP, UPDATE_CONST, UPDATE_TEST,
+                           TEST_CONST], ops)
+
+    def test_unassigned(self):
+        self.program_test('x := y; z := y + 1', {'x': 0, 'z': 1})
+        self.program_test('while x < 3 do x := x + 1 end; w := v', {'x': 3, 'w': 0})
+        program = compile_bytecode(imp_parse(imp_lex('y := x + 1; z := w')).value)
+        env = {'x': 1, 'a': 2}
+        run(program, env)
+        self.assertEquals({'x': 1, 'a': 2, 'y': 2, 'z': 0}, env)
+
+    def test_short_circuit(self):
+        code = 'if x != 0 and 10 / x > 1 then y := 1 end; if x = 0 or 10 / x > 1 then z := 1 end'
+        self.program_test(code, {'z': 1})
+        program = imp_parse(imp_lex(code)).value
+        imp_ast.short_circuit = False
+        try:
+            self.assertRaises(ZeroDivisionError, run, compile_bytecode(program), {})
+            self.program_test('x := 5; ' + code, {'x': 5, 'y': 1, 'z': 1})
+        finally:
+            imp_ast.short_circuit = True
+
+    def test_disassemble_short_circuit(self):
+        program = compile_bytecode(imp_parse(imp_lex('if x < 1 and y < 1 then z := 1 end')).value)
+        self.assertEquals('\n'.join(['   0 TEST_CONST        0    7    8 (x >= 1, to 12)',
+                                      '   4 TEST_CONST        1    7    4 (y >= 1, to 12)',
+                                      '   8 CONST             0 (1)',
+                                      '  10 STORE             2 (z)']),
+                          disassemble(program))
+        # Outside a condition, `or` leaves its value on the stack
+        program = compile_bytecode(AssignStatement('z', OrBexp(RelopBexp('<', VarAexp('x'), IntAexp(1)),
+                                                               RelopBexp('<', VarAexp('y'), IntAexp(1)))))
+        self.assertEquals('\n'.join(['   0 LOAD              0 (x)',
+                                      '   2 BINARY_CONST      4 (< 1)',
+                                      '   4 JUMP_IF_TRUE_OR_POP    4 (to 10)',
+                                      '   6 LOAD              1 (y)',
+                                      '   8 BINARY_CONST      4 (< 1)',
+                                      '  10 STORE             2 (z)']),
+                          disassemble(program))
+
+def eval_program(code):
+    env = {}
+    imp_parse(imp_lex(code)).value.eval(env)
+    return env
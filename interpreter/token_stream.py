@@ -0,0 +1,94 @@
+# token_stream.py
+# ---------------
+# A compact representation for a list of tokens.
+#
+# A list of (text, tag) tuples costs a tuple and a fresh substring for every
+# token. `TokenStream` instead keeps three parallel `array`s over the original
+# source: a small integer "kind" code per token and the start and end offsets
+# of its text. The text is only sliced out of the source when someone asks
+# for it, and tokens which always have the same text (reserved words and
+# operators) never need to be sliced at all.
+#
+# Token kinds
+# -----------
+# Every token has a kind code. A kind is either:
+#
+#   * a tag on its own, e.g. (None, ID), for tokens whose text varies, or
+#   * a literal text with a tag, e.g. ('while', RESERVED), for tokens produced
+#     by a token expression which can only ever match that one text.
+#
+# Kind codes are global, so the codes a lexer assigns and the codes the
+# combinators look for always agree.
+
+from array import array
+
+kind_texts = []      # code -> literal text, or None for a plain tag
+kind_tags = []       # code -> tag
+kind_tag_codes = []  # code -> code of the plain tag kind
+_kind_codes = {}     # (text, tag) -> code
+
+def kind_code(tag, text=None):
+    key = (text, tag)
+    code = _kind_codes.get(key)
+    if code is None:
+        if text is None:
+            tag_code = len(kind_tags)
+        else:
+            tag_code = kind_code(tag)
+        code = len(kind_tags)
+        kind_texts.append(text)
+        kind_tags.append(tag)
+        kind_tag_codes.append(tag_code)
+        _kind_codes[key] = code
+    return code
+
+class TokenStream:
+    def __init__(self, source):
+        self.source = source
+        self.codes = array('i')
+        self.starts = array('l')
+        self.ends = array('l')
+
+    def append(self, code, start, end):
+        self.codes.append(code)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.codes)
+
+    # The text of the token at `pos`, as a string.
+    def text(self, pos):
+        text = kind_texts[self.codes[pos]]
+        if text is None:
+            text = self.source[self.starts[pos]:self.ends[pos]]
+        return text
+
+    # The text of the token at `pos` as a read-only view of the source,
+    # without copying it.
+    def view(self, pos):
+        start = self.starts[pos]
+        return buffer(self.source, start, self.ends[pos] - start)
+
+    def tag(self, pos):
+        return kind_tags[self.codes[pos]]
+
+    # Indexing gives the usual (text, tag) tuple, so a `TokenStream` can be
+    # used anywhere a list of tokens is expected.
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += len(self.codes)
+        return (self.text(pos), kind_tags[self.codes[pos]])
+
+    def __iter__(self):
+        for pos in range(len(self.codes)):
+            yield self[pos]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'TokenStream(%s)' % list(self)